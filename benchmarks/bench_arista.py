@@ -0,0 +1,125 @@
+"""
+Compare decoding the VLAN and MAC address tables of an Arista switch from
+the JSON output of EOS against scraping its text tables, for the same
+switch contents
+
+Usage: python benchmarks/bench_arista.py [n_vlans] [n_macs]
+"""
+import sys
+import json
+import time
+from os import path
+
+sys.path.insert(0,path.dirname(path.dirname(path.abspath(__file__))))
+
+from psnet.survey import survey
+
+N_PORTS = 48
+#Breakout ports of the uplinks, named EtN/M
+BREAKOUT = ['Et{:}/{:}'.format(port,lane) for port in range(49,53)
+                                          for lane in range(1,5)]
+PORTS    = ['Et{:}'.format(port) for port in range(1,N_PORTS+1)] + BREAKOUT
+
+
+def vlan_ports(n_vlans):
+    """
+    Spread the Ethernet ports over the VLANs, with some VLANs holding many
+    ports so that their text rows wrap on to continuation lines
+    """
+    return dict((100 + i,[PORTS[(i + k) % len(PORTS)]
+                          for k in range(1 + (i % 5) * 6)])
+                for i in range(n_vlans))
+
+
+def vlan_text(vlans):
+    lines = ['VLAN  Name                             Status    Ports',
+             '----- -------------------------------- --------- '
+             '-------------------------------']
+    for vlan_no,ports in vlans.items():
+        rows = [', '.join(ports[i:i+6]) for i in range(0,len(ports),6)]
+        lines.append('{:<5} {:<32} {:<9} {:}'.format(vlan_no,
+                                                     'VLAN{:04d}'.format(vlan_no),
+                                                     'active',rows[0]))
+        for row in rows[1:]:
+            lines.append('{:<49}{:}'.format('',row))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def vlan_json(vlans):
+    return json.dumps({'vlans':dict((str(vlan_no),
+                                     {'status':'active',
+                                      'name':'VLAN{:04d}'.format(vlan_no),
+                                      'dynamic':False,
+                                      'interfaces':dict(('Ethernet'+port[2:],
+                                                         {'privatePromoted':False})
+                                                        for port in ports)})
+                                    for vlan_no,ports in vlans.items()),
+                       'sourceDetail':''},indent=2)
+
+
+def mac_entries(n_macs):
+    for i in range(n_macs):
+        mac = '{:012x}'.format(0x001c73000000 + i)
+        yield 100 + i % 50,mac,PORTS[i % len(PORTS)]
+
+
+def mac_text(n_macs):
+    lines = ['          Mac Address Table',
+             '-' * 66,
+             '',
+             'Vlan    Mac Address       Type        Ports      Moves   Last Move',
+             '----    -----------       ----        -----      -----   ---------']
+    for vlan_no,mac,port in mac_entries(n_macs):
+        lines.append(' {:<6} {:}.{:}.{:}    DYNAMIC     {:<10} 1       '
+                     '0:00:05 ago'.format(vlan_no,mac[:4],mac[4:8],mac[8:],
+                                          port))
+    lines.append('Total Mac Addresses for this criterion: {:}'.format(n_macs))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def mac_json(n_macs):
+    entries = [{'vlanId':vlan_no,
+                'macAddress':':'.join(mac[i:i+2] for i in range(0,12,2)),
+                'entryType':'dynamic',
+                'interface':'Ethernet'+port[2:],
+                'moves':1,
+                'lastMove':1700000000.0}
+               for vlan_no,mac,port in mac_entries(n_macs)]
+    return json.dumps({'unicastTable':{'tableEntries':entries},
+                       'multicastTable':{'tableEntries':[]}},indent=2)
+
+
+def best_of(func,raw,repeat=5):
+    best = None
+    for i in range(repeat):
+        start  = time.perf_counter()
+        result = func(raw)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return result,best
+
+
+def main():
+    n_vlans = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_macs  = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    vlans   = vlan_ports(n_vlans)
+    tables  = {'vlan':(vlan_text(vlans),vlan_json(vlans)),
+               'mac' :(mac_text(n_macs),mac_json(n_macs))}
+    print('{:} VLANs, {:} MAC addresses'.format(n_vlans,n_macs))
+
+    text = survey.AristaSurveyer('bench','bench',None,use_json=False)
+    js   = survey.AristaSurveyer('bench','bench',None,use_json=True)
+    print('{:<6}{:<6}{:>10}{:>10}'.format('table','path','MB','seconds'))
+    for table,(raw_text,raw_json) in tables.items():
+        parse = 'parse_{:}'.format(table)
+        from_text,text_time = best_of(getattr(text,parse),raw_text)
+        from_json,json_time = best_of(getattr(js,parse),raw_json)
+        assert from_text == from_json, 'Paths disagree on the {:} table'.format(table)
+        print('{:<6}{:<6}{:>10.2f}{:>10.4f}'.format(table,'text',
+                                                    len(raw_text)/1e6,text_time))
+        print('{:<6}{:<6}{:>10.2f}{:>10.4f}'.format('','json',
+                                                    len(raw_json)/1e6,json_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Compare the time a command runner needs to read a large ``show mac-address``
+table, when every line is decoded and appended to the output on its own
+against receiving large chunks and joining the output once
+
+Usage: python benchmarks/bench_command.py [n_lines]
+"""
+import sys
+import time
+import socket
+import threading
+from os import path
+
+sys.path.insert(0,path.dirname(path.dirname(path.abspath(__file__))))
+
+from psnet.survey import command
+
+HOST = 'switch-bench'
+
+
+def mac_table(n_lines):
+    """
+    Brocade style ``show mac-address`` output
+    """
+    lines = ['Total active entries from all ports = {:}\r\n'.format(n_lines),
+             'MAC-Address     Port           Type          Index  VLAN\r\n']
+    for i in range(n_lines):
+        mac = '{:012x}'.format(i)
+        lines.append('{:}.{:}.{:}  1/1/{:<10} Dynamic       {:<6} {:}\r\n'
+                     .format(mac[:4],mac[4:8],mac[8:],i % 48 + 1,i,
+                             10 + i % 20))
+    return ''.join(lines).encode()
+
+
+class Channel(object):
+    """
+    One end of a socket pair, standing in for a paramiko channel
+    """
+    closed = False
+
+    def __init__(self,sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self,n):
+        return self.sock.recv(n)
+
+    def send(self,data):
+        return self.sock.sendall(data.encode())
+
+
+def serve(sock,output):
+    """
+    Answer each command with the table, echoing commands and prompts the
+    way the switch does
+    """
+    prompt = 'SSH@{:}#'.format(HOST).encode()
+    sock.sendall(prompt)
+    for line in sock.makefile('rb'):
+        cmd = line.rstrip(b'\r\n')
+        sock.sendall(cmd + b'\r\n')
+        if cmd.strip():
+            sock.sendall(output)
+        sock.sendall(prompt)
+
+
+class PreviousExchange(command.Exchange):
+    """
+    The previous output handling, appending each line to a string
+    """
+    def __init__(self,*args,**kwargs):
+        super(PreviousExchange,self).__init__(*args,**kwargs)
+        self.text = ''
+
+    @property
+    def output(self):
+        return self.text
+
+    def _write(self,text):
+        self.text += text
+
+
+class PreviousRunner(command.BrocadeCommandRunner):
+    """
+    The previous reads, slicing and decoding one line at a time
+    """
+    def __init__(self,*args,**kwargs):
+        super(PreviousRunner,self).__init__(*args,**kwargs)
+        self.recv_buf = 8192
+
+    def _readline(self,deadline):
+        end = self._rbuf.find(b'\n')
+        while end < 0:
+            self._wait_readable(deadline)
+            data = self.chan.recv(self.recv_buf)
+            start = len(self._rbuf)
+            self._rbuf += data
+            end = self._rbuf.find(b'\n',start)
+        line,self._rbuf = self._rbuf[:end+1],self._rbuf[end+1:]
+        return line.decode('utf-8')
+
+    def exchange(self,cmd,keepOutput=True,sink=None):
+        return PreviousExchange(cmd,self.prompt_pattern,
+                                self.page_cont_pattern,self.terminator,
+                                keepOutput=keepOutput,sink=sink)
+
+
+def measure(runner_class,output,repeat=3):
+    ours,theirs = socket.socketpair()
+    threading.Thread(target=serve,args=(theirs,output),daemon=True).start()
+    runner = runner_class('bench','bench',None,22,[])
+    runner.prompt_pattern = command.re.compile(runner.prompt_temp
+                                               % (HOST,'(?P<mode>[#>])'))
+    runner.host = HOST
+    runner.chan = Channel(ours)
+    best = None
+    for i in range(repeat):
+        start  = time.perf_counter()
+        result = runner.exec_cmd('show mac-address')
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    ours.close()
+    return result,best
+
+
+def main():
+    n_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    output  = mac_table(n_lines)
+    print('show mac-address with {:} entries, {:.1f} MB'
+          .format(n_lines,len(output)/1e6))
+
+    old,old_time = measure(PreviousRunner,output)
+    new,new_time = measure(command.BrocadeCommandRunner,output)
+    assert old == new, 'Outputs differ'
+
+    print('{:<28}{:>10}'.format('','seconds'))
+    print('{:<28}{:>10.3f}'.format('line at a time',old_time))
+    print('{:<28}{:>10.3f}'.format('chunked',new_time))
+    print('Speedup {:.1f}x'.format(old_time/new_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare the memory used by NetConfig host information stored as plain
+dictionaries against the compact HostRecord store, and the time taken to
+build each of them
+
+Usage: python benchmarks/bench_hoststore.py [n_hosts]
+"""
+import sys
+import time
+import tracemalloc
+from os import path
+
+sys.path.insert(0,path.dirname(path.dirname(path.abspath(__file__))))
+
+from psnet.netconfig import parsing, store
+from psnet.netconfig.host import Host
+from netconfig_data import netconfig_search
+
+
+class CopyingHost(object):
+    """
+    The previous Host, which copied every attribute on to the instance
+    """
+    def __init__(self,host_name,host_info):
+        self.name = host_name
+        self._info = host_info
+        for attr,value in host_info.items():
+            setattr(self,attr.lower().replace(' ','_'),value)
+
+
+def measure(build,repeat=3):
+    # Tracing slows allocations down, so time untraced runs on their own
+    best = None
+    for i in range(repeat):
+        start   = time.perf_counter()
+        build()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    tracemalloc.start()
+    result = build()
+    size,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result,size,best
+
+
+def main():
+    n_hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    raw     = netconfig_search(n_hosts)
+    print('{:} hosts'.format(n_hosts))
+
+    def as_dicts():
+        return dict((sys.intern(name),info)
+                    for name,info in parsing.iter_netconfig(raw.splitlines()))
+
+    def as_records():
+        hosts = store.HostStore()
+        for name,info in parsing.iter_netconfig(raw.splitlines()):
+            hosts.add(name,info)
+        return hosts.nodes
+
+    for label,build,view in (('dict',as_dicts,CopyingHost),
+                             ('HostRecord',as_records,Host)):
+        nodes,size,elapsed = measure(build)
+        print('{:12} {:8.1f} MiB {:8.3f} s'.format(label,size/2.**20,elapsed))
+        hosts,size,elapsed = measure(lambda: [view(name,info)
+                                              for name,info in nodes.items()])
+        print('{:12} {:8.1f} MiB {:8.3f} s  (Host objects)'.format('',
+                                                                 size/2.**20,
+                                                                 elapsed))
+        del nodes,hosts
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Compare the time a command runner needs to read a long ``show mac-address``
+table when the switch turns its pager off against answering the pager page
+by page, and check that a switch refusing ``skip-page-display`` still has
+every page of its output read
+
+Usage: python benchmarks/bench_paging.py [n_lines] [page_lines]
+"""
+import sys
+import time
+import socket
+import threading
+from os import path
+
+sys.path.insert(0,path.dirname(path.dirname(path.abspath(__file__))))
+
+from psnet.survey import command
+
+from bench_command import HOST, Channel, mac_table
+
+MORE = b'--More--, next page: Space, next line: Return key, quit: Control-c'
+
+
+class Switch(object):
+    """
+    A Brocade switch paging its output, which either accepts or refuses
+    the command to stop paging
+
+    :param output: The reply to any command but skip-page-display
+    :type  output: bytes
+
+    :param page_lines: Lines per page while paging
+    :type  page_lines: int
+
+    :param accept: Whether skip-page-display is accepted
+    :type  accept: bool
+    """
+    def __init__(self,output,page_lines,accept):
+        self.lines  = output.splitlines(True)
+        self.page_lines = page_lines
+        self.accept = accept
+        self.paging = True
+        # --More-- prompts sent
+        self.pages  = 0
+
+    def serve(self,sock):
+        prompt = 'SSH@{:}#'.format(HOST).encode()
+        rfile  = sock.makefile('rb')
+        sock.sendall(prompt)
+        for line in rfile:
+            cmd = line.rstrip(b'\r\n')
+            sock.sendall(cmd + b'\r\n')
+            if cmd == b'skip-page-display':
+                if self.accept:
+                    self.paging = False
+                else:
+                    sock.sendall(b'Invalid input -> skip-page-display\r\n'
+                                 b'Type ? for a list\r\n')
+            elif cmd.strip() and self.paging:
+                for i in range(0,len(self.lines),self.page_lines):
+                    sock.sendall(b''.join(self.lines[i:i+self.page_lines]))
+                    if i + self.page_lines < len(self.lines):
+                        sock.sendall(MORE)
+                        self.pages += 1
+                        # Wait for the space that asks for the next page
+                        rfile.readline()
+                        sock.sendall(b'\b \b')
+            elif cmd.strip():
+                sock.sendall(b''.join(self.lines))
+            sock.sendall(prompt)
+
+
+def measure(output,page_lines,accept):
+    ours,theirs = socket.socketpair()
+    switch = Switch(output,page_lines,accept)
+    threading.Thread(target=switch.serve,args=(theirs,),daemon=True).start()
+    runner = command.BrocadeCommandRunner('bench','bench',None,22,[])
+    runner.prompt_pattern = command.re.compile(runner.prompt_temp
+                                               % (HOST,'(?P<mode>[#>])'))
+    runner.host = HOST
+    runner.chan = Channel(ours)
+    runner.enter()
+    start   = time.perf_counter()
+    result  = runner.exec_cmd('show mac-address')
+    elapsed = time.perf_counter() - start
+    ours.close()
+    return runner,switch,result,elapsed
+
+
+def main():
+    n_lines    = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    page_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    output     = mac_table(n_lines)
+    print('show mac-address with {:} entries, {:} lines per page'
+          .format(n_lines,page_lines))
+
+    runner,switch,off,off_time = measure(output,page_lines,True)
+    assert not runner.paging, 'Paging still on after skip-page-display'
+    assert switch.pages == 0, 'Switch paged after skip-page-display'
+    assert off == output.decode(), 'Output differs with paging off'
+
+    runner,switch,paged,paged_time = measure(output,page_lines,False)
+    assert runner.paging, 'Refused skip-page-display taken as accepted'
+    assert switch.pages == (len(switch.lines) - 1) // page_lines, \
+           'Pager not drained'
+    assert paged == output.decode(), 'Output differs through the pager'
+
+    print('{:<28}{:>8}{:>10}'.format('','pages','seconds'))
+    print('{:<28}{:>8}{:>10.3f}'.format('skip-page-display',0,off_time))
+    print('{:<28}{:>8}{:>10.3f}'.format('refused, pager answered',
+                                        switch.pages,paged_time))
+    print('Speedup {:.1f}x'.format(paged_time/off_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare the time a new process needs before it can answer its first
+NetConfig lookup, when parsing the raw search output, unpickling a parsed
+database and mapping the binary snapshot
+
+Usage: python benchmarks/bench_snapshot.py [n_hosts]
+"""
+import os
+import sys
+import time
+import pickle
+import tempfile
+import subprocess
+from os import path
+
+sys.path.insert(0,path.dirname(path.dirname(path.abspath(__file__))))
+
+from psnet.netconfig import sources
+from netconfig_data import netconfig_search
+
+#Run in a fresh interpreter, so imports and caches are not shared
+STARTUP = {
+    'dump'    : 'from psnet.netconfig import sources\n'
+                'nodes,mac = sources.DumpSource({path!r}).load()\n'
+                'nodes[{host!r}]',
+    'pickle'  : 'import pickle\n'
+                'from psnet.netconfig import store\n'
+                'nodes,mac = pickle.load(open({path!r},"rb"))\n'
+                'nodes[{host!r}]',
+    'snapshot': 'from psnet.netconfig import sources\n'
+                'nodes,mac = sources.SnapshotSource({path!r}).load()\n'
+                'nodes[{host!r}]',
+}
+
+
+def startup(code,repeat=5):
+    root = path.dirname(path.dirname(path.abspath(__file__)))
+    env  = dict(os.environ,PYTHONPATH=root)
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable,'-c',code],env=env)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return best
+
+
+def main():
+    n_hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    tmp     = tempfile.mkdtemp()
+    files   = {'dump'    : path.join(tmp,'netconfig.txt'),
+               'pickle'  : path.join(tmp,'netconfig.pkl'),
+               'snapshot': path.join(tmp,'netconfig.snap')}
+    with open(files['dump'],'w') as f:
+        f.write(netconfig_search(n_hosts))
+    nodes,mac = sources.DumpSource(files['dump']).load()
+    with open(files['pickle'],'wb') as f:
+        pickle.dump((nodes,mac),f,protocol=pickle.HIGHEST_PROTOCOL)
+    sources.write_snapshot(files['snapshot'],{'nodes'   :nodes,
+                                              'mac'     :mac,
+                                              'loadtime':time.time()})
+    host = sorted(nodes)[len(nodes)//2]
+
+    print('{:} hosts'.format(n_hosts))
+    baseline = startup('import psnet.netconfig.sources')
+    for label,code in sorted(STARTUP.items()):
+        elapsed = startup(code.format(path=files[label],host=host))
+        print('{:10} {:8.1f} KiB {:8.3f} s  ({:.3f} s over import)'.format(
+              label,path.getsize(files[label])/1024.,elapsed,
+              elapsed - baseline))
+    for filename in files.values():
+        os.remove(filename)
+    os.rmdir(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Synthetic NetConfig data for the benchmark scripts
+"""
+import random
+
+SUBNETS = ['swhmgt.pcdsn','cds-xpp.pcdsn','cds-amo.pcdsn','cds-cxi.pcdsn',
+           'cds-mec.pcdsn','srv.pcdsn','fez-xpp.pcdsn','dmzlocal.pcdsn']
+VENDORS = ['Brocade','Arista','Cisco','Ruckus','Moxa','Digi']
+KINDS   = ['switch','ioc','daq','digi','moxa','gige']
+HUTCHES = ['amo','sxr','xpp','xcs','mfx','cxi','mec','tst']
+
+
+def netconfig_search(n_hosts=20000,seed=0):
+    """
+    Return text resembling the output of ``netconfig search '*'`` with
+    n_hosts entries
+    """
+    rand  = random.Random(seed)
+    lines = ['']
+    for i in range(n_hosts):
+        kind  = rand.choice(KINDS)
+        hutch = rand.choice(HUTCHES)
+        name  = '{:}-{:}-{:02d}-{:}'.format(kind,hutch,i % 97,i)
+        lines.append('{:}:'.format(name))
+        lines.append('\tname: {:}'.format(name))
+        lines.append('\tsubnet: {:}'.format(rand.choice(SUBNETS)))
+        lines.append('\tIP: 172.21.{:}.{:}'.format(i // 250,i % 250 + 1))
+        if i % 13:
+            mac = ':'.join('{:02x}'.format(rand.randrange(256))
+                           for octet in range(6))
+            lines.append('\tEthernet Address: {:}'.format(mac))
+        lines.append('\tDescription: {:} {:} in B999 '\
+                     'R{:02d}A E{:02d}F'.format(rand.choice(VENDORS),kind,
+                                                i % 40,i % 42))
+        if i % 7 == 0:
+            lines.append('\t\tcontinued description text')
+        lines.append('\tLocation: B{:} H{:} R{:02d}'.format(rand.choice([950,999]),
+                                                           rand.randrange(1,7),
+                                                           i % 40))
+        if i % 5 == 0:
+            lines.append('\tcnames: sw-{:}-R{:02d}A-{:02d}F.pcdsn'.format(hutch,
+                                                                        i % 40,
+                                                                        i % 42))
+        lines.append('')
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,8 @@
 import logging
 #from netconfig import NetConfig
-from . import host, parsing, netconfig
+from . import host, index, parsing, store, registry, query, sources, netconfig
 
-__all__ = ['host','parsing','netconfig']
+__all__ = ['host','index','parsing','store','registry','query','sources','netconfig']
 
 
 
@@ -1,15 +1,37 @@
+import time
+import errno
+import socket
+import struct
 import logging
 import functools
-import subprocess
+import selectors
+from collections import deque, OrderedDict
+from collections.abc import Mapping
 
 from . import netconfig
 
 module_logger = logging.getLogger(__name__)
 
+#Maximum number of probes in flight at once
+PING_CONCURRENCY = 256
+#Ports tried when ICMP sockets are not available to unprivileged users
+PROBE_PORTS      = (22,23)
+#Consecutive errors from the ICMP socket before probing with TCP instead
+ICMP_MAX_ERRORS  = 5
+
+ICMP_ECHO_REPLY   = 0
+ICMP_ECHO_REQUEST = 8
+#Connection results that prove the host itself answered
+_TCP_ALIVE = (0,errno.ECONNREFUSED,errno.ECONNRESET)
+
 class Host(object):
     """
     Class to represent a host found in NetConfig.
 
+    A Host is a lightweight view of the NetConfig information, each attribute
+    is read from the underlying record when it is accessed rather than being
+    copied on to the object.
+
     :param host_name: The name of the host
     :type  host_name: str
 
@@ -17,12 +39,21 @@ class Host(object):
                       host
     :type  host_info: dict
     """
+    __slots__ = ('name','_info')
+
     def __init__(self,host_name,host_info):
         self.name = host_name
         self._info = host_info
-        
-        for attr,value in host_info.items():
-            setattr(self,attr.lower().replace(' ','_'),value)
+
+
+    def __getattr__(self,attr):
+        if attr == '_info' or attr.startswith('__'):
+            raise AttributeError(attr)
+        try:
+            return self._info[attr]
+        except KeyError:
+            raise AttributeError('{:} has no attribute {:}'.format(self.name,
+                                                                  attr))
 
 
     @classmethod
@@ -61,15 +92,7 @@ class Host(object):
         :return: Whether or not device was responsive within the wait period.
         :rtype:  bool
         """
-        ping_response = subprocess.call(['ping','-c1','-w{:}'.format(wait),
-                                        '{:}'.format(self.name)],
-                                        stdout=subprocess.PIPE)
-        if ping_response == 0:
-            module_logger.info('{:} was responsive to ping'.format(self.name))
-            return True
-
-        module_logger.warn('{:} was unresponsive to ping'.format(self.name))
-        return False
+        return ping(self.name,wait=wait,address=self._info.get('ip'))
    
 
     def show_info(self):
@@ -101,23 +124,62 @@ class Host(object):
 
 
 
-class HostGroup(object):
+class HostGroup(Mapping):
     """
     A group of nodes assembled into a single object.
 
     This class is useful when grouping a number of hosts together with a shared
     attribute, such as a subnet or location
 
+    The group is a mapping of host names to :class:`.Host` objects. A Host is
+    only created the first time it is requested, either by name or as an
+    attribute with dashes replaced by underscores, so iterating over the names
+    or taking the length of a large group costs nothing extra.
+
     :param hosts: A  dictionary of host names with a sub-dictionary containing
                   each hosts information.
     :type hosts: dict
     """
     def __init__(self,hosts):
-        
-        self._hosts = dict([(node,Host(node,node_info)) 
-                            for node,node_info in hosts.items()])
-        for node,host in self._hosts.items():
-            setattr(self,node.replace('-','_'),host)
+        self._info    = hosts
+        self._hosts   = {}
+        self._aliases = None
+
+    def __getitem__(self,name):
+        try:
+            return self._hosts[name]
+        except KeyError:
+            host = Host(name,self._info[name])
+            self._hosts[name] = host
+            return host
+
+    def __iter__(self):
+        return iter(self._info)
+
+    def __len__(self):
+        return len(self._info)
+
+    def __contains__(self,name):
+        return name in self._info
+
+    def __getattr__(self,attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if self._aliases is None:
+            self._aliases = dict([(node.replace('-','_'),node)
+                                  for node in self._info])
+        try:
+            return self[self._aliases[attr]]
+        except KeyError:
+            raise AttributeError('No host {:} in group'.format(attr))
+
+    def __dir__(self):
+        attrs = set(super(HostGroup,self).__dir__())
+        attrs.update(node.replace('-','_') for node in self._info)
+        return sorted(attrs)
+
+    def __repr__(self):
+        return '<HostGroup of {:} hosts>'.format(len(self))
 
     @classmethod
     def from_search(group_class,**kwargs):
@@ -136,18 +198,328 @@ class HostGroup(object):
         return group
 
 
-    def ping_group(self,wait=1):
+    def ping_group(self,wait=1,concurrency=None):
         """
         Ping all of the hosts in the group.
+
+        The hosts are probed concurrently from a single :class:`.Prober`, so
+        the whole group takes roughly one wait period rather than one per
+        host. The addresses are taken from NetConfig, no Host objects are
+        created and no names are looked up.
         
         :param wait: Wait for this many seconds for response
         :type  wait: int
 
+        :param concurrency: Maximum number of pings in flight at once. By
+                            default, this is :data:`PING_CONCURRENCY`
+        :type  concurrency: int
+
         :return: A dictionary of ping results, with each host name in the group
-                 and a True/False value whether they were responsive to the ping
+                 and a True/False value whether they were responsive to the
+                 ping, ordered by host name. Use :meth:`.iter_ping` to see
+                 each result as soon as it is available
         :rtype:  bool
         
         """
-        pings = [(name,self._hosts[name].ping(wait=1))
-                 for name in sorted(self._hosts.keys())] 
-        return dict(pings)
+        return dict(sorted(self.iter_ping(wait=wait,concurrency=concurrency)))
+
+
+    def iter_ping(self,wait=1,concurrency=None):
+        """
+        Ping all of the hosts in the group, yielding each result as soon as
+        it is available
+
+        :return: A generator of (host name, responsive) pairs in order of
+                 completion
+        """
+        addresses = dict([(name,info.get('ip'))
+                          for name,info in self._info.items()])
+        return ping_many(sorted(addresses),wait=wait,concurrency=concurrency,
+                         addresses=addresses)
+
+
+def ping(name,wait=1,address=None):
+    """
+    Ping a device.
+
+    :param name: The host name or address of the device
+    :type  name: str
+
+    :param wait: Wait for this many seconds for response.
+    :type  wait: int
+
+    :param address: The IP address of the device, if known. Otherwise the
+                    name is resolved
+    :type  address: str
+
+    :return: Whether or not device was responsive within the wait period.
+    :rtype:  bool
+    """
+    for name,alive in Prober(wait=wait).probe([(name,address)]):
+        return alive
+
+
+def ping_many(names,wait=1,concurrency=None,addresses=None):
+    """
+    Ping many devices concurrently.
+
+    :param names: The host names or addresses of the devices
+    :type  names: iterable
+
+    :param wait: Wait for this many seconds for each response.
+    :type  wait: int
+
+    :param concurrency: Maximum number of pings in flight at once. By
+                        default, this is :data:`PING_CONCURRENCY`
+    :type  concurrency: int
+
+    :param addresses: Dictionary of names and known IP addresses. Names
+                      missing from it are resolved
+    :type  addresses: dict
+
+    :return: A generator of (name, responsive) pairs in order of completion
+    """
+    addresses = addresses or {}
+    prober    = Prober(wait=wait,concurrency=concurrency)
+    return prober.probe([(name,addresses.get(name)) for name in names])
+
+
+class Prober(object):
+    """
+    Check whether many devices are reachable from a single event loop.
+
+    ICMP echo requests are sent from one unprivileged ICMP datagram socket
+    when the kernel allows it (see ``net.ipv4.ping_group_range``). Otherwise
+    a non-blocking TCP connection is opened to each of the probe ports, and
+    either an accepted or a refused connection counts as the device being
+    up.
+
+    :param wait: Seconds to wait for each device to respond
+    :type  wait: float
+
+    :param concurrency: Maximum number of devices probed at once. By default,
+                        this is :data:`PING_CONCURRENCY`
+    :type  concurrency: int
+
+    :param ports: TCP ports used when ICMP is not available
+    :type  ports: tuple
+
+    :param icmp: Force ICMP on or off. By default, ICMP is used if available
+    :type  icmp: bool
+    """
+    def __init__(self,wait=1,concurrency=None,ports=PROBE_PORTS,icmp=None):
+        self.wait        = wait
+        self.concurrency = concurrency or PING_CONCURRENCY
+        self.ports       = ports
+        self.icmp        = icmp
+
+    def probe(self,targets):
+        """
+        Probe each target
+
+        :param targets: Iterable of (name, address) pairs. If the address is
+                        None, the name is resolved
+        :type  targets: iterable
+
+        :return: A generator of (name, responsive) pairs in order of
+                 completion
+        """
+        names = OrderedDict()
+        for name,address in targets:
+            address = address or self._resolve(name)
+            if not address:
+                module_logger.warn('{:} has no known address'.format(name))
+                yield name,False
+                continue
+            names.setdefault(address,[]).append(name)
+
+        if not names:
+            return
+
+        sock = None
+        if self.icmp is not False:
+            sock = self._icmp_socket()
+        if sock:
+            results = self._probe_icmp(sock,list(names))
+        else:
+            results = self._probe_tcp(list(names))
+
+        for address,alive in results:
+            for name in names[address]:
+                if alive:
+                    module_logger.info('{:} was responsive to '\
+                                       'ping'.format(name))
+                else:
+                    module_logger.warn('{:} was unresponsive to '\
+                                       'ping'.format(name))
+                yield name,alive
+
+    def _resolve(self,name):
+        try:
+            return socket.gethostbyname(name)
+        except (socket.error,UnicodeError):
+            return None
+
+    def _icmp_socket(self):
+        try:
+            sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM,
+                                 socket.IPPROTO_ICMP)
+        except (OSError,AttributeError) as e:
+            if self.icmp:
+                raise
+            module_logger.debug('ICMP sockets unavailable, probing with TCP '\
+                                'instead: {:}'.format(e))
+            return None
+        sock.setblocking(False)
+        return sock
+
+    def _probe_icmp(self,sock,addresses):
+        queue    = deque(addresses)
+        pending  = OrderedDict()
+        selector = selectors.DefaultSelector()
+        selector.register(sock,selectors.EVENT_READ)
+        seq      = 0
+        errors   = 0
+        error    = None
+        try:
+            while queue or pending:
+                #Keep up to concurrency requests in flight
+                while queue and len(pending) < self.concurrency:
+                    address = queue.popleft()
+                    seq     = (seq + 1) & 0xffff
+                    try:
+                        sock.sendto(_echo_request(seq),(address,0))
+                    except (socket.error,OverflowError) as e:
+                        module_logger.debug('Unable to send ICMP echo to '\
+                                            '{:}: {:}'.format(address,e))
+                        yield address,False
+                        continue
+                    pending[address] = time.monotonic() + self.wait
+
+                if not pending:
+                    continue
+
+                #Deadlines are in send order, so the first is the earliest
+                timeout = next(iter(pending.values())) - time.monotonic()
+                if selector.select(max(timeout,0)):
+                    while True:
+                        try:
+                            data,(source,port) = sock.recvfrom(1024)
+                        except (BlockingIOError,InterruptedError):
+                            break
+                        except socket.error as e:
+                            #Wait for the selector again rather than spin on
+                            #a socket that keeps failing
+                            errors += 1
+                            error   = e
+                            break
+                        errors = 0
+                        if data[:1] == bytes([ICMP_ECHO_REPLY]) \
+                           and source in pending:
+                            del pending[source]
+                            yield source,True
+
+                if errors >= ICMP_MAX_ERRORS:
+                    break
+
+                now = time.monotonic()
+                while pending and next(iter(pending.values())) <= now:
+                    yield pending.popitem(last=False)[0],False
+        finally:
+            selector.close()
+            sock.close()
+
+        if errors >= ICMP_MAX_ERRORS:
+            remaining = list(pending) + list(queue)
+            module_logger.warn('ICMP socket failed {:} times, probing {:} '\
+                               'hosts with TCP instead: {:}'.format(errors,
+                                                                    len(remaining),
+                                                                    error))
+            for address,alive in self._probe_tcp(remaining):
+                yield address,alive
+
+    def _probe_tcp(self,addresses):
+        queue    = deque(addresses)
+        pending  = OrderedDict()
+        selector = selectors.DefaultSelector()
+
+        def close(address):
+            deadline,socks = pending.pop(address)
+            for conn in socks:
+                selector.unregister(conn)
+                conn.close()
+
+        try:
+            while queue or pending:
+                while queue and len(pending) < self.concurrency:
+                    address = queue.popleft()
+                    socks   = []
+                    alive   = False
+                    for port in self.ports:
+                        conn = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+                        conn.setblocking(False)
+                        err  = conn.connect_ex((address,port))
+                        if err in _TCP_ALIVE:
+                            alive = True
+                        if err in (errno.EINPROGRESS,errno.EWOULDBLOCK):
+                            selector.register(conn,selectors.EVENT_WRITE,
+                                              address)
+                            socks.append(conn)
+                        else:
+                            conn.close()
+                    pending[address] = (time.monotonic() + self.wait,socks)
+                    if alive or not socks:
+                        close(address)
+                        yield address,alive
+
+                if not pending:
+                    continue
+
+                timeout = next(iter(pending.values()))[0] - time.monotonic()
+                for key,mask in selector.select(max(timeout,0)):
+                    address = key.data
+                    if address not in pending:
+                        continue
+                    conn = key.fileobj
+                    err  = conn.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR)
+                    if err in _TCP_ALIVE:
+                        close(address)
+                        yield address,True
+                        continue
+                    #This port failed, see if any other is still connecting
+                    selector.unregister(conn)
+                    conn.close()
+                    pending[address][1].remove(conn)
+                    if not pending[address][1]:
+                        close(address)
+                        yield address,False
+
+                now = time.monotonic()
+                while pending and next(iter(pending.values()))[0] <= now:
+                    address = next(iter(pending))
+                    close(address)
+                    yield address,False
+        finally:
+            for address in list(pending):
+                close(address)
+            selector.close()
+
+
+def _echo_request(seq):
+    """
+    Build an ICMP echo request. The kernel replaces the identifier with the
+    one assigned to the socket
+    """
+    payload = b'psnet-ping'
+    header  = struct.pack('!BBHHH',ICMP_ECHO_REQUEST,0,0,0,seq)
+    checksum = _checksum(header + payload)
+    return struct.pack('!BBHHH',ICMP_ECHO_REQUEST,0,checksum,0,seq) + payload
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!{:}H'.format(len(data) // 2),data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
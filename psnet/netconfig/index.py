@@ -0,0 +1,608 @@
+import re
+import bisect
+import logging
+import fnmatch
+import functools
+import ipaddress
+
+module_logger = logging.getLogger(__name__)
+
+GLOB_CHARS = '*?['
+
+#Separators used between the groups of hex digits of a MAC address
+_mac_separators = re.compile(r'[:.\-\s]')
+_mac_hex        = re.compile(r'[0-9a-fA-F]{12}$')
+#Digits in each group, keyed by the number of groups
+_mac_groups     = {6:2,3:4,1:12}
+
+
+def literal_prefix(pattern):
+    """
+    Return the portion of a glob pattern before the first wildcard
+    """
+    for i,char in enumerate(pattern):
+        if char in GLOB_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+def is_glob(pattern):
+    """
+    Whether or not a pattern contains any glob metacharacters
+    """
+    return any(char in pattern for char in GLOB_CHARS)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_glob(pattern):
+    """
+    Translate a glob pattern into a compiled regular expression match function
+    """
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def parse_mac(address):
+    """
+    Convert a MAC address into a 48-bit integer
+
+    Colon or dash separated octets, as used by NetConfig and most switches,
+    dotted groups of four digits, as used by Cisco and Brocade, and bare hex
+    digits are all accepted, in either case. Leading zeros may be left out
+    of each group.
+
+    :param address: The MAC address
+    :type  address: str
+
+    :return: The address as an integer, or None if it is not a MAC address
+    """
+    if not address:
+        return None
+    groups = _mac_separators.split(address.strip())
+    width  = _mac_groups.get(len(groups))
+    if width is None:
+        return None
+    if width == 12:
+        address = groups[0]
+    else:
+        address = ''.join(group.zfill(width) for group in groups)
+    if not _mac_hex.match(address):
+        return None
+    return int(address,16)
+
+
+def format_mac(value):
+    """
+    Format a 48-bit integer as a lower-case, colon separated MAC address
+    """
+    digits = '{:012x}'.format(value)
+    return ':'.join(digits[i:i+2] for i in range(0,12,2))
+
+
+def parse_ip(address):
+    """
+    Convert an IP address into a sortable key
+
+    :param address: The IPv4 or IPv6 address
+    :type  address: str
+
+    :return: Tuple of the IP version and the address as an integer, or None if
+             address is not an IP address
+    """
+    if not address:
+        return None
+    try:
+        address = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return None
+    return (address.version,int(address))
+
+
+def _ip_address(key):
+    version,value = key
+    if version == 4:
+        return ipaddress.IPv4Address(value)
+    return ipaddress.IPv6Address(value)
+
+
+def _unshare(copy,original,key):
+    """
+    Give copy its own version of a set it still shares with original
+    """
+    if key in original and copy[key] is original[key]:
+        copy[key] = set(original[key])
+
+
+class AttributeIndex(object):
+    """
+    Secondary index of a single NetConfig attribute.
+
+    Values are stored lower-cased, matching the case-insensitive behavior of
+    :meth:`.NetConfig.search`. The sorted list of distinct values used for
+    prefix queries is only built when first needed.
+
+    :param attr: The name of the attribute to index. The special attribute
+                 ``name`` indexes the host names themselves
+    :type  attr: str
+
+    :param tokenize: Whether or not to also index each whitespace separated
+                     word of the value, used to narrow down substring searches
+                     on free text fields such as the description
+    :type  tokenize: bool
+    """
+    def __init__(self,attr,tokenize=False):
+        self.attr    = attr
+        self._values = {}
+        self._sorted = None
+        self._tokens = {} if tokenize else None
+
+    @classmethod
+    def from_nodes(index_class,attr,nodes,tokenize=False):
+        """
+        Build an index for an attribute over a dictionary of nodes
+        """
+        index = index_class(attr,tokenize=tokenize)
+        for node,info in nodes.items():
+            index.add(node,info)
+        module_logger.debug('Indexed {:} distinct values of '\
+                            '{:}'.format(len(index._values),attr))
+        return index
+
+    def _value(self,node,info):
+        if self.attr == 'name':
+            return node.lower()
+        value = info.get(self.attr)
+        if value:
+            return value.lower()
+        return None
+
+    def add(self,node,info):
+        """
+        Add a host to the index
+        """
+        value = self._value(node,info)
+        if not value:
+            return
+        if value not in self._values:
+            self._values[value] = set()
+            self._sorted = None
+        self._values[value].add(node)
+        if self._tokens is not None:
+            for token in value.split():
+                self._tokens.setdefault(token,set()).add(node)
+
+    def discard(self,node,info):
+        """
+        Remove a host from the index
+        """
+        value = self._value(node,info)
+        if not value or value not in self._values:
+            return
+        self._values[value].discard(node)
+        if not self._values[value]:
+            del self._values[value]
+            self._sorted = None
+        if self._tokens is not None:
+            for token in value.split():
+                nodes = self._tokens.get(token)
+                if nodes is not None:
+                    nodes.discard(node)
+                    if not nodes:
+                        del self._tokens[token]
+
+    def __len__(self):
+        return len(self._values)
+
+    def updated(self,changes):
+        """
+        Return a copy of the index with a set of hosts updated. Only the
+        entries touched by the changes are copied, this index is left as is
+
+        :param changes: Iterable of (name, old info, new info) triples, where
+                        either information can be None for added or removed
+                        hosts
+        """
+        idx = AttributeIndex(self.attr)
+        idx._values = dict(self._values)
+        idx._sorted = self._sorted
+        if self._tokens is not None:
+            idx._tokens = dict(self._tokens)
+
+        #Copy the sets that are about to change, the rest stay shared
+        changes = list(changes)
+        for node,old,info in changes:
+            for host_info in (old,info):
+                if host_info is None:
+                    continue
+                value = self._value(node,host_info)
+                if not value:
+                    continue
+                _unshare(idx._values,self._values,value)
+                if self._tokens is not None:
+                    for token in value.split():
+                        _unshare(idx._tokens,self._tokens,token)
+
+        for node,old,info in changes:
+            if old is not None:
+                idx.discard(node,old)
+            if info is not None:
+                idx.add(node,info)
+        return idx
+
+    def exact(self,value):
+        """
+        Return the set of hosts whose value equals value
+        """
+        return set(self._values.get(value.lower(),()))
+
+    def prefix(self,prefix):
+        """
+        Return the set of hosts whose value starts with prefix
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self._values)
+        prefix = prefix.lower()
+        start  = bisect.bisect_left(self._sorted,prefix)
+        found  = set()
+        for value in self._sorted[start:]:
+            if not value.startswith(prefix):
+                break
+            found.update(self._values[value])
+        return found
+
+    def narrow(self,pattern):
+        """
+        Return a superset of the hosts whose value matches the glob pattern,
+        using the word index. If the index can not help, None is returned
+        """
+        if self._tokens is None:
+            return None
+        runs  = re.split(r'[*?]|\[[^\]]*\]',pattern.lower())
+        words = [word for run in runs for word in run.split()]
+        if not words:
+            return None
+        #Any value that matches contains the longest literal word inside one
+        #of its own words
+        word  = max(words,key=len)
+        found = set()
+        for token,nodes in self._tokens.items():
+            if word in token:
+                found.update(nodes)
+        return found
+
+    def match(self,pattern):
+        """
+        Return the set of hosts whose value matches the glob pattern by
+        checking each distinct value
+        """
+        return self.where(compile_glob(pattern.lower()))
+
+    def where(self,test):
+        """
+        Return the set of hosts whose value passes test, calling test once
+        for each distinct lower-cased value rather than once per host
+        """
+        found = set()
+        for value,nodes in self._values.items():
+            if test(value):
+                found.update(nodes)
+        return found
+
+    def filter(self,pattern,nodes,lookup):
+        """
+        Return the subset of nodes whose value matches the glob pattern
+
+        :param lookup: A function returning the information of a node
+        """
+        match = compile_glob(pattern.lower())
+        return self.select(lambda value: value and match(value),nodes,lookup)
+
+    def select(self,test,nodes,lookup):
+        """
+        Return the subset of nodes whose lower-cased value passes test. Nodes
+        without a value are tested with None
+
+        :param lookup: A function returning the information of a node
+        """
+        found = set()
+        for node in nodes:
+            if test(self._value(node,lookup(node))):
+                found.add(node)
+        return found
+
+
+class NameIndex(object):
+    """
+    Sorted list of host names, used to answer glob patterns with a literal
+    prefix without checking every name in NetConfig.
+
+    Unlike :class:`.AttributeIndex`, names are matched case-sensitively, the
+    same as :func:`fnmatch.filter`
+    """
+    def __init__(self,names=()):
+        self._names = sorted(names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def updated(self,added=(),removed=()):
+        """
+        Return a copy of the index with names added and removed
+        """
+        idx = NameIndex()
+        idx._names = list(self._names)
+        for name in removed:
+            idx.discard(name)
+        for name in added:
+            idx.add(name)
+        return idx
+
+    def add(self,name):
+        """
+        Add a host name to the index
+        """
+        i = bisect.bisect_left(self._names,name)
+        if i == len(self._names) or self._names[i] != name:
+            self._names.insert(i,name)
+
+    def discard(self,name):
+        """
+        Remove a host name from the index
+        """
+        i = bisect.bisect_left(self._names,name)
+        if i < len(self._names) and self._names[i] == name:
+            del self._names[i]
+
+    def prefix(self,prefix):
+        """
+        Return the sorted list of names starting with prefix
+        """
+        start = bisect.bisect_left(self._names,prefix)
+        end   = start
+        while end < len(self._names) and self._names[end].startswith(prefix):
+            end += 1
+        return self._names[start:end]
+
+    def filter(self,pattern):
+        """
+        Return the sorted list of names matching a glob pattern
+        """
+        prefix = literal_prefix(pattern)
+        names  = self.prefix(prefix) if prefix else self._names
+        if pattern == prefix + '*':
+            return list(names)
+        match = compile_glob(pattern)
+        return [name for name in names if match(name)]
+
+
+class MacIndex(object):
+    """
+    Index of hosts by MAC address, keyed by 48-bit integers.
+
+    Addresses are normalized with :func:`.parse_mac`, so a lookup matches
+    regardless of the format the switch or NetConfig uses for the address.
+
+    :param mac: Dictionary of MAC addresses and host names
+    :type  mac: dict
+    """
+    def __init__(self,mac=None):
+        self._hosts = {}
+        for address,node in (mac or {}).items():
+            self.add(address,node)
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def __contains__(self,address):
+        return parse_mac(address) in self._hosts
+
+    def add(self,address,node):
+        """
+        Add the address of a host to the index
+        """
+        value = parse_mac(address)
+        if value is None:
+            module_logger.debug('Ignoring invalid MAC address {:} '\
+                                'of {:}'.format(address,node))
+            return
+        self._hosts[value] = node
+
+    def discard(self,address,node):
+        """
+        Remove the address of a host, unless it has since been given to
+        another host
+        """
+        value = parse_mac(address)
+        if self._hosts.get(value) == node:
+            del self._hosts[value]
+
+    def updated(self,changes):
+        """
+        Return a copy of the index with a set of hosts updated
+
+        :param changes: Iterable of (name, old info, new info) triples, the
+                        same as :meth:`.AttributeIndex.updated`
+        """
+        idx = MacIndex()
+        idx._hosts = dict(self._hosts)
+        for node,old,info in changes:
+            if old is not None and old.get('ethernet_address'):
+                idx.discard(old['ethernet_address'],node)
+        for node,old,info in changes:
+            if info is not None and info.get('ethernet_address'):
+                idx.add(info['ethernet_address'],node)
+        return idx
+
+    def get(self,address,default=None):
+        """
+        Return the host with a MAC address
+
+        :param address: The MAC address in any format accepted by
+                        :func:`.parse_mac`
+        """
+        return self._hosts.get(parse_mac(address),default)
+
+    def join(self,addresses):
+        """
+        Look up a whole table of MAC addresses at once
+
+        :param addresses: Iterable of MAC addresses
+        :type  addresses: iterable
+
+        :return: List of host names in the same order as addresses, with None
+                 for each address not found
+        """
+        hosts = self._hosts
+        return [hosts.get(parse_mac(address)) for address in addresses]
+
+
+class IpIndex(object):
+    """
+    Sorted index of hosts by IP address.
+
+    Hosts are kept in address order, so a single address is found with a
+    binary search and every host inside a range or CIDR network is a
+    contiguous slice. The first and last address used by each subnet is also
+    available, to check which subnet an address belongs to.
+
+    :param nodes: Dictionary of host names and information
+    :type  nodes: dict
+    """
+    def __init__(self,nodes=None):
+        entries = []
+        for node,info in (nodes or {}).items():
+            key = parse_ip(info.get('ip'))
+            if key is not None:
+                entries.append((key,node,(info.get('subnet') or '').lower()))
+        entries.sort()
+        self._keys    = [key for key,node,subnet in entries]
+        self._hosts   = [node for key,node,subnet in entries]
+        self._nets    = [subnet for key,node,subnet in entries]
+        self._subnets = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self,node,info):
+        """
+        Add a host to the index
+        """
+        key = parse_ip(info.get('ip'))
+        if key is None:
+            return
+        i = bisect.bisect_right(self._keys,key)
+        while i > 0 and self._keys[i-1] == key and self._hosts[i-1] > node:
+            i -= 1
+        self._keys.insert(i,key)
+        self._hosts.insert(i,node)
+        self._nets.insert(i,(info.get('subnet') or '').lower())
+        self._subnets = None
+
+    def discard(self,node,info):
+        """
+        Remove a host from the index
+        """
+        key = parse_ip(info.get('ip'))
+        if key is None:
+            return
+        i = bisect.bisect_left(self._keys,key)
+        while i < len(self._keys) and self._keys[i] == key:
+            if self._hosts[i] == node:
+                del self._keys[i]
+                del self._hosts[i]
+                del self._nets[i]
+                self._subnets = None
+                return
+            i += 1
+
+    def updated(self,changes):
+        """
+        Return a copy of the index with a set of hosts updated
+
+        :param changes: Iterable of (name, old info, new info) triples, the
+                        same as :meth:`.AttributeIndex.updated`
+        """
+        idx = IpIndex()
+        idx._keys  = list(self._keys)
+        idx._hosts = list(self._hosts)
+        idx._nets  = list(self._nets)
+        for node,old,info in changes:
+            if old is not None:
+                idx.discard(node,old)
+            if info is not None:
+                idx.add(node,info)
+        return idx
+
+    def find(self,address):
+        """
+        Return the name of the host with an IP address, or None. If several
+        hosts share the address, the first name alphabetically is returned
+        """
+        key = parse_ip(address)
+        i   = bisect.bisect_left(self._keys,key) if key else len(self._keys)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._hosts[i]
+        return None
+
+    def range(self,first,last):
+        """
+        Return the names of the hosts with addresses from first to last,
+        inclusive, ordered by address
+        """
+        start_key,end_key = parse_ip(str(first)),parse_ip(str(last))
+        if start_key is None or end_key is None:
+            raise ValueError('Invalid address range {:} - '\
+                             '{:}'.format(first,last))
+        start = bisect.bisect_left(self._keys,start_key)
+        end   = bisect.bisect_right(self._keys,end_key)
+        return self._hosts[start:end]
+
+    def network(self,network):
+        """
+        Return the names of the hosts inside a CIDR network, such as
+        ``172.21.32.0/24``, ordered by address
+        """
+        network = ipaddress.ip_network(network,strict=False)
+        return self.range(network.network_address,network.broadcast_address)
+
+    def _subnet_ranges(self):
+        if self._subnets is None:
+            subnets = {}
+            for key,subnet in zip(self._keys,self._nets):
+                if not subnet:
+                    continue
+                if subnet in subnets:
+                    subnets[subnet][1] = key
+                else:
+                    subnets[subnet] = [key,key]
+            ranges = sorted((first,last,subnet)
+                            for subnet,(first,last) in subnets.items())
+            self._ranges  = ranges
+            self._starts  = [first for first,last,subnet in ranges]
+            self._subnets = subnets
+        return self._subnets
+
+    def subnet_range(self,subnet):
+        """
+        Return the first and last address used by hosts on a subnet, or None
+        if no host on the subnet has an address
+        """
+        span = self._subnet_ranges().get(subnet.lower())
+        if span is None:
+            return None
+        return _ip_address(span[0]),_ip_address(span[1])
+
+    def subnet(self,address):
+        """
+        Return the name of the subnet whose range of addresses contains
+        address, or None
+        """
+        key = parse_ip(address)
+        if key is None:
+            return None
+        self._subnet_ranges()
+        #Subnets can overlap, check each range starting at or before key
+        for i in range(bisect.bisect_right(self._starts,key)-1,-1,-1):
+            first,last,subnet = self._ranges[i]
+            if last >= key:
+                return subnet
+        return None
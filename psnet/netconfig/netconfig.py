@@ -1,14 +1,197 @@
 import sys
 import time
+import weakref
 import logging
-import fnmatch
-import subprocess
+import functools
+from os import path,getenv
 
 from . import host
+from . import index
+from . import query
+from . import store
 from . import parsing
+from . import sources
+from .registry import registry, Generation
 
 module_logger = logging.getLogger(__name__)
 
+#Persistent snapshot of the parsed database, shared by short-lived processes
+CACHE_FILE    = getenv('PSNET_NETCONFIG_CACHE',
+                       path.join(path.expanduser('~'),'.cache','psnet',
+                                 'netconfig.snap'))
+CACHE_TTL     = float(getenv('PSNET_NETCONFIG_TTL',3600))
+CACHE_VERSION = sources.SNAPSHOT_VERSION
+#Where the database is loaded from, see :func:`.sources.from_spec`
+SOURCE        = getenv('PSNET_NETCONFIG_SOURCE','netconfig')
+
+
+def query_netconfig():
+    """
+    Run ``netconfig search '*'`` and parse its output while it is still
+    being written
+
+    :return: The dictionary of host names and :class:`.store.HostRecord`,
+             and the MAC address dictionary
+    """
+    return sources.CommandSource().load()
+
+
+def use_source(spec):
+    """
+    Load the database from a different source, for example a saved dump when
+    NetConfig itself is not available. The database already loaded in this
+    process is dropped, and the next request loads it from the new source
+
+    :param spec: The source specification, see :func:`.sources.from_spec`
+    :type  spec: str
+    """
+    global SOURCE
+    sources.from_spec(spec)
+    SOURCE = spec
+    registry.clear()
+
+
+def read_cache(ttl,source=None):
+    """
+    Return the snapshot stored in the snapshot file, or None if the snapshot
+    is missing, unreadable, from an older format, loaded from a different
+    source or older than ttl seconds
+
+    :return: Dictionary with the ``nodes`` and ``mac`` of the database, the
+             ``loadtime`` and, if they were inferred, the ``locations`` of
+             each host
+    """
+    snapshot = sources.read_snapshot(CACHE_FILE)
+    if snapshot is None:
+        return None
+
+    source = str(sources.from_spec(source or SOURCE))
+    if snapshot.get('source') != source:
+        module_logger.debug('Ignoring NetConfig snapshot loaded from '\
+                            '{:}'.format(snapshot.get('source')))
+        return None
+
+    age = time.time() - snapshot['loadtime']
+    if age < 0 or age > ttl:
+        module_logger.debug('NetConfig snapshot is stale, '\
+                            '{:.0f} seconds old'.format(age))
+        return None
+
+    module_logger.debug('Using NetConfig snapshot from {:}, {:.0f} '\
+                        'seconds old'.format(CACHE_FILE,age))
+    return snapshot
+
+
+def write_cache(nodes,mac,locations=None,loadtime=None,source=None):
+    """
+    Atomically replace the snapshot file with the given information
+
+    :param locations: Inferred location of each host, see
+                      :func:`.infer_locations`
+    :type  locations: dict
+
+    :param loadtime: Time the information was queried from NetConfig, by
+                     default now
+    :type  loadtime: float
+
+    :param source: The source the information was loaded from, by default
+                   :data:`SOURCE`
+    :type  source: str
+    """
+    snapshot = {'loadtime' : time.time() if loadtime is None else loadtime,
+                'source'   : str(sources.from_spec(source or SOURCE)),
+                'nodes'    : nodes,
+                'mac'      : mac,
+                'locations': locations}
+    return sources.write_snapshot(CACHE_FILE,snapshot)
+
+
+def infer_locations(nodes):
+    """
+    Infer the building, rack, elevation and hutch of every host
+
+    :param nodes: Dictionary of host names and information
+    :type  nodes: dict
+
+    :return: Dictionary of host names and :class:`.store.HostRecord` of
+             location fields
+    """
+    locations = store.HostStore()
+    memo      = {}
+    for node,info in nodes.items():
+        locations.add(node,parsing.locate(info,memo))
+    module_logger.debug('Parsed netconfig information for '\
+                        'relevant location phrases')
+    return locations.nodes
+
+
+def load_generation(cache=True,ttl=None,infer_location=False,refresh=False,
+                    source=None):
+    """
+    Build a new generation of the database from the snapshot or NetConfig
+
+    :param cache: Whether or not to use the on-disk snapshot
+    :type  cache: bool
+
+    :param ttl: Maximum age of the snapshot in seconds, by default
+                :data:`CACHE_TTL`
+    :type  ttl: float
+
+    :param infer_location: Whether or not to parse NetConfig for additional
+                           information including rack, building, and hutch.
+                           The result is saved with the snapshot, so this is
+                           only done once per snapshot
+    :type infer_location:  bool
+
+    :param refresh: Ignore any existing snapshot and query NetConfig directly
+    :type refresh:  bool
+
+    :param source: Where to load the database from, by default
+                   :data:`SOURCE`
+    :type  source: str
+
+    :rtype: :class:`.registry.Generation`
+    """
+    source   = sources.from_spec(source or SOURCE)
+    cache    = cache and source.cacheable
+    snapshot = None
+    if cache and not refresh:
+        snapshot = read_cache(CACHE_TTL if ttl is None else ttl,source=source)
+
+    if snapshot:
+        hosts,mac = snapshot['nodes'],snapshot['mac']
+        locations = snapshot.get('locations')
+    else:
+        module_logger.debug('Loading NetConfig information from '\
+                            '{:}...'.format(source))
+        hosts,mac = source.load()
+        locations = None
+        snapshot  = {'loadtime':time.time()}
+        if cache and not infer_location:
+            write_cache(hosts,mac,loadtime=snapshot['loadtime'],source=source)
+
+    module_logger.info('Succesfully loaded NetConfig information')
+
+    if infer_location and snapshot.get('located') is not None:
+        #Records from a mapped snapshot merge their location when read
+        hosts = snapshot['located']
+    elif infer_location:
+        if locations is None:
+            locations = infer_locations(hosts)
+            if cache:
+                write_cache(hosts,mac,locations=locations,
+                            loadtime=snapshot['loadtime'],source=source)
+
+        located = store.HostStore()
+        for node,info in hosts.items():
+            info = dict(info)
+            info.update(locations.get(node,()))
+            located.add(node,info)
+        hosts = located.nodes
+
+    return Generation(hosts,mac,located=infer_location,source=str(source))
+
+
 class NetConfig(object):
     """
     Python API for NetConfig.
@@ -21,53 +204,178 @@ class NetConfig(object):
     :param infer_location: Whether or not to parse NetConfig for additional
                            information including rack, building, and hutch
     :type infer_location:  bool
+
+    :param cache: Whether or not to use the on-disk snapshot of NetConfig
+                  stored at :data:`CACHE_FILE`
+    :type cache:  bool
+
+    :param ttl: Age in seconds after which the on-disk snapshot is considered
+                stale. By default, this is :data:`CACHE_TTL`
+    :type ttl:  float
+
+    :param refresh: Ignore any existing snapshot and query NetConfig directly
+    :type refresh:  bool
+
+    :param source: Where to load NetConfig from, either the live database, a
+                   saved dump or a snapshot file. By default this is
+                   :data:`SOURCE`, set by the ``PSNET_NETCONFIG_SOURCE``
+                   environment variable. See :func:`.sources.from_spec`
+    :type source:  str
+
+    Every NetConfig in a process shares the same database, held by
+    :data:`.registry.registry`. Only the first instance loads it, and a
+    :meth:`.refresh` from any instance is seen by all of them. Asking for a
+    different source once the database is loaded raises ValueError, use
+    :func:`.use_source` to switch the whole process to another source.
     """
-    _loadtime = None 
-    _nodes    = {} 
-    _mac      = {}   
-    
-    def __init__(self,auto_load=True,infer_location=False):
+    def __init__(self,auto_load=True,infer_location=False,
+                 cache=True,ttl=None,refresh=False,source=None):
+        self.cache  = cache
+        self.ttl    = CACHE_TTL if ttl is None else ttl
+        self.source = source
+        self.infer_location = infer_location
+        self._check_source()
+        registry.acquire()
+        self._release = weakref.finalize(self,registry.release)
         if auto_load:
-            self.load_nodes(infer_location=infer_location)
+            self.load_nodes(infer_location=infer_location,refresh=refresh)
+
+
+    def _check_source(self):
+        """
+        Refuse a source other than the one the shared database was loaded
+        from, rather than silently reading the data of the first one
+        """
+        generation = registry.current()
+        if self.source is None or generation is None:
+            return
+        source = str(sources.from_spec(self.source))
+        if generation.source is not None and generation.source != source:
+            raise ValueError('NetConfig is already loaded from {:} in this '\
+                             'process, not {:}. Use use_source() to switch '\
+                             'sources'.format(generation.source,source))
+
+
+    @property
+    def _loadtime(self):
+        generation = registry.current()
+        if generation:
+            return generation.loadtime
+        return None
+
+
+    @property
+    def _nodes(self):
+        return self._generation().nodes
+
+
+    @property
+    def _mac(self):
+        return self._generation().mac
+
+
+    def _generation(self):
+        """
+        Return the current generation of the database, loading it if needed
+        """
+        return registry.get(self._loader())
 
 
-    def load_nodes(self,infer_location=False):
+    def _loader(self,infer_location=None,refresh=False):
+        if infer_location is None:
+            infer_location = self.infer_location
+        return functools.partial(load_generation,cache=self.cache,ttl=self.ttl,
+                                 infer_location=infer_location,refresh=refresh,
+                                 source=self.source)
+
+
+    def load_nodes(self,infer_location=False,refresh=False):
         """
         Load all of Netconfig into underlying Python dictionaries.
+
+        The database is only loaded once per process. If caching is enabled, a
+        snapshot younger than the configured TTL is used instead of querying
+        NetConfig, and a fresh query is written back to the snapshot file.
         
         :param infer_location: Whether or not to parse NetConfig for additional
                                information including rack, building, and hutch
         :type infer_location:  bool
+
+        :param refresh: Ignore the database already loaded in this process and
+                        any existing snapshot, and query NetConfig directly
+        :type refresh:  bool
         """
-        module_logger.debug('Loading NetConfig information...')
-        #raw   = subprocess.check_output("netconfig search '*'",shell=True)
-        raw   = subprocess.check_output(["/reg/common/tools/bin/netconfig", "search", "*"]).decode('utf-8')
-        hosts = parsing.parse_netconfig(raw)
-        self._nodes.update(hosts)
-        
-        for device,info in self._nodes.items():
-            try:
-                self._mac.update({info['ethernet_address'].lower():device})
-            except KeyError:
-                module_logger.debug('{:} has no ethernet '\
-                                    'address listed'.format(device))
-        
-        module_logger.info('Succesfully loaded NetConfig information')
-        
-        if infer_location:                                   #This still needs to be worked on
-            for node,info in self._nodes.items():            #I will probably wait until the 
-                for attr in ['name','alias','description',   #the time comes to integrate PyQT
-                             'cnames','subnet','location']:  #Rack Profiles into the home screen
-                    if attr == 'cnames':
-                        search_func = parsing.parse_cname
-                    else:
-                        search_func = parsing.search_location
-                    
-                    info.update(search_func(info.get(attr)))
-
-            module_logger.debug('Parsed netconfig information for '\
-                               'relevant location phrases')
-        self._loadtime = time.time()
+        loader  = self._loader(infer_location=infer_location,refresh=refresh)
+        current = registry.current()
+        if refresh or (infer_location and current and not current.located):
+            registry.refresh(loader)
+        else:
+            registry.get(loader)
+
+
+    def refresh(self,incremental=False):
+        """
+        Query NetConfig again and publish the result to every NetConfig,
+        Switch, Host and HostGroup user in the process
+
+        :param incremental: Keep the records, MAC entries and search indexes
+                            of unchanged hosts, and only update the entries
+                            of hosts that were added, removed or changed
+        :type  incremental: bool
+
+        :return: The hosts that were added, removed or changed, or None if
+                 nothing had been loaded yet
+        :rtype:  :class:`.registry.Delta`
+        """
+        return registry.refresh(self._loader(refresh=True),
+                                incremental=incremental)
+
+
+    def start_refresh(self,interval,incremental=True):
+        """
+        Refresh the database from a background thread every interval seconds.
+        This stops once every NetConfig in the process has been closed
+
+        :param interval: Time between refreshes in seconds
+        :type  interval: float
+
+        :param incremental: See :meth:`.refresh`
+        :type  incremental: bool
+        """
+        registry.start_refresh(self._loader(refresh=True),interval,
+                               incremental=incremental)
+
+
+    def subscribe(self,callback):
+        """
+        Call callback with the :class:`.registry.Delta` of every refresh made
+        by any NetConfig in the process. Bound methods are weakly referenced
+
+        :param callback: Function accepting a single Delta
+        """
+        registry.subscribe(callback)
+
+
+    def unsubscribe(self,callback):
+        """
+        Stop sending refresh deltas to callback
+        """
+        registry.unsubscribe(callback)
+
+
+    def close(self):
+        """
+        Release this consumer of the shared database
+        """
+        self._release()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self,*exc):
+        self.close()
 
 
     def find_hosts(self,key,as_list=False,as_dict=False,as_object=False):
@@ -78,7 +386,9 @@ class NetConfig(object):
         search will return a dictionary with matching host names as keys and
         information as sub-dictionaries. 
 
-        An exact host name can be requested or glob patterns
+        An exact host name can be requested or glob patterns. Exact names are
+        looked up directly, and patterns that begin with a literal prefix only
+        check the names sharing that prefix
 
         :param key:  Search parameter. Can either be a name or a glob pattern
         :type  key:  str
@@ -102,11 +412,14 @@ class NetConfig(object):
                                 'will return as a dictionary')
             as_dict = True
 
-        if not self._loadtime:
-            self.load_nodes()
-        
-        hosts = self._nodes.keys()
-        matches = fnmatch.filter(hosts,key)
+        generation = self._generation()
+        nodes      = generation.nodes
+
+        if not index.is_glob(key):
+            #Exact host name, no need to look at any other entry
+            matches = [key] if key in nodes else []
+        else:
+            matches = generation.names.filter(key)
 
         module_logger.debug('Found {:} that match {:}'.format(str(len(matches)),key))
         
@@ -116,7 +429,7 @@ class NetConfig(object):
         if as_list:
             return matches
         
-        match_info = dict([(node,self._nodes[node]) for node in matches])
+        match_info = dict([(node,nodes[node]) for node in matches])
 
         if as_dict:
             return match_info
@@ -128,6 +441,89 @@ class NetConfig(object):
                 return host.Host(list(match_info.keys())[0],
                                  list(match_info.values())[0])
 
+
+    def find_by_mac(self,address):
+        """
+        Find the host with an ethernet address
+
+        :param address: The MAC address, either colon, dash or dot separated,
+                        or bare hex digits, in any case
+        :type  address: str
+
+        :return: The name of the host, or None if the address is not in
+                 NetConfig
+        """
+        return self._generation().macs.get(address)
+
+
+    def join_macs(self,addresses):
+        """
+        Find the hosts for a whole table of ethernet addresses, such as the
+        MAC table of a switch, in a single pass
+
+        :param addresses: Iterable of MAC addresses in any of the formats
+                          accepted by :meth:`.find_by_mac`
+        :type  addresses: iterable
+
+        :return: List of host names in the same order as addresses, with None
+                 for each address not in NetConfig
+        """
+        return self._generation().macs.join(addresses)
+
+
+    def find_by_ip(self,address):
+        """
+        Find the host with an IP address
+
+        :param address: The IP address
+        :type  address: str
+
+        :return: The name of the host, or None if no host has the address
+        """
+        return self._generation().ips.find(address)
+
+
+    def find_in_network(self,network):
+        """
+        Find every host with an address inside a network
+
+        :param network: The network in CIDR notation, e.g ``172.21.32.0/24``
+        :type  network: str
+
+        :return: List of host names, ordered by address
+        """
+        return self._generation().ips.network(network)
+
+
+    def find_in_range(self,first,last):
+        """
+        Find every host with an address between first and last, inclusive
+
+        :return: List of host names, ordered by address
+        """
+        return self._generation().ips.range(first,last)
+
+
+    def subnet_range(self,subnet):
+        """
+        Return the first and last address used by the hosts on a subnet
+
+        :param subnet: The name of the subnet, e.g ``cds-xpp.pcdsn``
+        :type  subnet: str
+
+        :return: Tuple of :class:`ipaddress.IPv4Address`, or None if no host
+                 on the subnet has an address
+        """
+        return self._generation().ips.subnet_range(subnet)
+
+
+    def find_subnet(self,address):
+        """
+        Return the name of the subnet whose range of host addresses contains
+        address, or None
+        """
+        return self._generation().ips.subnet(address)
+
     @property
     def searchable_attributes(self):
         """
@@ -174,38 +570,136 @@ class NetConfig(object):
                                 'will return as a dictionary')
             as_dict = True
         
-        if not self._loadtime:
-            self.load_nodes()
-        
-        hosts = self._nodes.copy()
-        
-        for node,host_info in hosts.items():
-            for param,search_param  in kwargs.items():
-                if param == 'name':
-                    match_value = node
-                else:
-                    match_value = host_info.get(param)
-
-                if not match_value or not fnmatch.filter([match_value.lower()],
-                                                         search_param.lower()):
-                    del hosts[node]
-                    break
-         
-
-        module_logger.debug('Found {:} matches for search parameters'.format(str(len(hosts))))
+        generation = self._generation()
+        matches    = self._match(generation,kwargs)
+
+        module_logger.debug('Found {:} matches for search parameters'.format(str(len(matches))))
         
+        return self._results(generation,matches,as_list,as_object)
+
+
+    def query(self,expr,as_list=False,as_dict=False,as_object=False):
+        """
+        Find the hosts matching a query expression.
+
+        Conditions on attributes are combined with ``and``, ``or``, ``not``
+        and parentheses. ``attr = value`` matches the value or glob pattern the
+        same as :meth:`.search`, ``!=`` negates it, ``attr ~ regex`` searches
+        with a regular expression and ``attr in 172.21.0.0/24`` matches
+        addresses within a network. Values containing spaces or operators must
+        be quoted. For example,
+
+        .. code::
+
+            nc.query("subnet = cds-xpp* and not description ~ 'moxa|digi'")
+
+        Expressions are compiled once and reused. See :meth:`.explain` to see
+        how an expression is evaluated.
+
+        :param expr: The query expression
+        :type  expr: str
+
+        :param as_list: If True, the results are returned as a list of host
+                        names
+        :type  as_list: bool
+
+        :param as_dict: If True, the results are returned as a dictionary
+                        of host names and information. This is the default
+                        behavior
+        :type as_dict:  bool
+
+        :param as_object: If True, the results are returned as either a
+                          :py:class:'host.HostGroup' object, or a single Host
+                          if just one results is returned.
+        :type as_object: bool
+
+        :raises: :class:`.query.QueryError` if the expression is invalid
+        """
+        generation = self._generation()
+        matches    = query.compile_query(expr).evaluate(generation)
+        module_logger.debug('Found {:} matches for {!r}'.format(len(matches),
+                                                                 expr))
+        return self._results(generation,matches,as_list,as_object)
+
+
+    def explain(self,expr):
+        """
+        Evaluate a query expression and return a description of each step,
+        including which indexes were used and how many hosts remained
+
+        :param expr: The query expression, see :meth:`.query`
+        :type  expr: str
+
+        :rtype: str
+        """
+        return query.compile_query(expr).explain(self._generation())
+
+
+    def _results(self,generation,matches,as_list,as_object):
+        """
+        Format a set of matching host names as a list, HostGroup or Host, or
+        by default a dictionary of host information
+        """
+        hosts = dict([(node,generation.nodes[node]) for node in matches])
+
         if not hosts:
             return {}
 
         if as_list:
             return sorted(hosts.keys())
 
-        if as_dict:
-            return hosts
-
         if as_object:
             if len(hosts)>1:
                 return host.HostGroup(hosts)
             else:
-                return host.Host(hosts)
+                return host.Host(*list(hosts.items())[0])
+
+        return hosts
+
+
+    def _match(self,generation,kwargs):
+        """
+        Return the set of host names matching every attribute glob pattern
+
+        Exact values and patterns with a literal prefix are answered from the
+        attribute indexes and intersected, starting with the most specific.
+        Any remaining glob is then only checked against the surviving
+        candidates.
+        """
+        def specificity(item):
+            pattern = item[1]
+            if not index.is_glob(pattern):
+                return 0
+            return 1 if index.literal_prefix(pattern) else 2
+
+        candidates = None
+        unverified = []
+        for param,pattern in sorted(kwargs.items(),key=specificity):
+            idx    = generation.index(param)
+            prefix = index.literal_prefix(pattern)
+            if not index.is_glob(pattern):
+                found = idx.exact(pattern)
+            elif prefix:
+                found = idx.prefix(prefix)
+                if pattern != prefix + '*':
+                    unverified.append((idx,pattern))
+            else:
+                found = idx.narrow(pattern)
+                unverified.append((idx,pattern))
+                if found is None:
+                    continue
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return set()
+
+        for idx,pattern in unverified:
+            if candidates is None:
+                candidates = idx.match(pattern)
+            else:
+                candidates = idx.filter(pattern,candidates,
+                                        generation.nodes.get)
+            if not candidates:
+                return set()
+
+        return candidates
 
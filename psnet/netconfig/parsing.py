@@ -2,28 +2,54 @@ import re
 
 hutches = {'AMO':1,'SXR':2,'XPP':3,'XCS':4,'MFX':4.5,'CXI':5,'MEC':6}
 
+_host_line = re.compile(r'(\S+):$')
+
+
+def iter_netconfig(lines):
+    """
+    Parse a Netconfig search result one line at a time
+
+    Each host starts with an unindented ``name:`` line, attributes are
+    indented by a single tab and long values continue on lines indented by
+    two tabs. Because the input is consumed lazily, this can be fed directly
+    from the stdout of a running ``netconfig search``.
+
+    :param lines: An iterable of lines of NetConfig output
+    :type  lines: iterable
+
+    :return: A generator of (host name, attribute dictionary) pairs
+    """
+    device = None
+    info   = None
+    param  = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith('\t\t'):
+            #Continuation of the previous value
+            if param is not None:
+                info[param] += ' ' + line[2:]
+        elif line.startswith('\t'):
+            key,sep,value = line[1:].partition(': ')
+            if device is not None and sep and key:
+                param = key.lower().replace(' ','_')
+                info[param] = value
+        elif _host_line.match(line):
+            if device is not None:
+                yield device,info
+            device = line[:-1]
+            info   = {}
+            param  = None
+
+    if device is not None:
+        yield device,info
+
 
 def parse_netconfig(s):
     """
     Parse a Netconfig search result and return a dictionary of host names
     matched with NetConfig information
     """
-    results = {}
-    name = re.compile(r'\n(\S+?):\n')
-    devices = name.findall(s)
-    info    = name.split(s)
-    info    = [piece for piece in info if piece and piece not in devices]
-    search  = zip(devices,info)
-    
-    for (device,info) in search:
-        results[device] = {}
-        info = info.replace('\n\t\t',' ')
-        key  = re.compile(r'\t(.+?): (.+?)[\n?]')
-        search_results = key.findall(info)
-        for (param,result) in search_results:
-            results[device][param.lower().replace(' ','_')] = result
-
-    return results
+    return dict(iter_netconfig(s.splitlines()))
 
 
 def parse_subnet(subnet):
@@ -38,16 +64,23 @@ def parse_subnet(subnet):
     return {'hutch':hutch}
 
 
+#Location phrases, compiled once for every host
+_location_keys = (('building' ,re.compile(r'[Bb]{1}(\d{3})')),
+                  ('rack'     ,re.compile(r'([rR{1}]\d{2}[AaBb]?)')),
+                  ('elevation',re.compile(r'[Ee]{1}(\d{2}[BbFf]?)')),
+                  ('hutch'    ,re.compile(r'[Hh]{1}([4.5]*[\d]{0,2}?)')))
+
+#Fields added to each host when its location is inferred
+location_fields = tuple(attr for attr,key in _location_keys) + ('orientation',)
+
+_cname = re.compile(r'[\D]+?-([\D]{3})-([R][\d]{2}[AB]?)-([\d]{2}[BF]?)',
+                    flags=re.I)
+
+
 def search_location(s):
     """
     Search a string for possible location information.
     """
-
-    keys  = {'building' : r'[Bb]{1}(\d{3})',
-             'rack'     : r'([rR{1}]\d{2}[AaBb]?)',
-             'elevation': r'[Ee]{1}(\d{2}[BbFf]?)',
-             'hutch'    : r'[Hh]{1}([4.5]*[\d]{0,2}?)'}
-
     found = {}
     
     if not s:
@@ -61,12 +94,10 @@ def search_location(s):
         hutch_name = None
 
     #Look for other location information
-    for attr, key in keys.items():
-        search = re.findall(key,s)
+    for attr, key in _location_keys:
+        search = key.search(s)
         if search:
-            search = search[0]
-        else:
-            search = None
+            search = search.group(1)
         found[attr] = search
     
     orientation = None
@@ -90,9 +121,6 @@ def search_location(s):
     else:
         found['hutch'] = hutch_name
     
-
-   
-        
     return found
 
 
@@ -103,15 +131,54 @@ def parse_cname(cname):
     if not cname:
         return {}
 
-    matches = re.findall(r'[\D]+?-([\D]{3})-([R][\d]{2}[AB]?)-([\d]{2}[BF]?)',
-            cname,flags=re.I)
-    if matches:
-        hutch_id,rack,elevation = matches[0]
-        print(hutch_id)
+    match = _cname.search(cname)
+    if match:
+        hutch_id,rack,elevation = match.groups()
         return {'hutch':hutch_id,'rack':rack,'elevation':elevation}
     else:
         return {}
 
-    
+
+def locate(info,memo=None):
+    """
+    Infer the location of a host from its NetConfig information
+
+    This gives the same result as applying :func:`.search_location` to the
+    name, alias, description, subnet and location, and :func:`.parse_cname`
+    to the cnames, then merging them in that order. Each phrase search returns
+    every location field, so only the last attribute that is present is
+    actually scanned, along with the cnames when no subnet or location is
+    listed.
+
+    :param info: Dictionary of NetConfig attributes for the host
+    :type  info: dict
+
+    :param memo: Dictionary used to remember the result for each string
+                 already searched. Subnets and locations are shared by many
+                 hosts, so passing the same memo for a whole database avoids
+                 scanning them again
+    :type  memo: dict
+
+    :return: Dictionary of location fields
+    """
+    if memo is None:
+        memo = {}
+
+    for attr in ('location','subnet'):
+        if info.get(attr):
+            return dict(_memoized(search_location,info[attr],memo))
+
+    found = {}
+    for attr in ('description','alias','name'):
+        if info.get(attr):
+            found.update(_memoized(search_location,info[attr],memo))
+            break
+    found.update(parse_cname(info.get('cnames')))
+    return found
 
 
+def _memoized(func,s,memo):
+    try:
+        return memo[s]
+    except KeyError:
+        return memo.setdefault(s,func(s))
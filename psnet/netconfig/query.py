@@ -0,0 +1,420 @@
+import re
+import logging
+import functools
+import ipaddress
+
+from . import index
+
+module_logger = logging.getLogger(__name__)
+
+_token = re.compile(r'''\s*(?:(?P<paren>[()])
+                           |(?P<op>==|!=|=|~)
+                           |"(?P<dquote>(?:[^"\\]|\\.)*)"
+                           |'(?P<squote>(?:[^'\\]|\\.)*)'
+                           |(?P<word>[^\s()=!~"']+))''',re.X)
+_escaped_quote = re.compile(r'''\\(["'])''')
+_keywords      = ('and','or','not','in')
+
+
+class QueryError(ValueError):
+    """
+    Raised when a query expression can not be parsed
+    """
+    pass
+
+
+def tokenize(expr):
+    """
+    Split a query expression into a list of (kind, text) tokens, where kind is
+    one of ``paren``, ``op``, ``keyword`` or ``value``
+    """
+    tokens = []
+    expr   = expr.rstrip()
+    pos    = 0
+    while pos < len(expr):
+        match = _token.match(expr,pos)
+        if not match:
+            raise QueryError('Unable to parse {!r} at position '\
+                             '{:}'.format(expr,pos))
+        pos = match.end()
+        if match.group('paren'):
+            tokens.append(('paren',match.group('paren')))
+        elif match.group('op'):
+            tokens.append(('op',match.group('op')))
+        elif match.group('word') is not None:
+            word = match.group('word')
+            if word.lower() in _keywords:
+                tokens.append(('keyword',word.lower()))
+            else:
+                tokens.append(('value',word))
+        else:
+            quoted = match.group('dquote')
+            if quoted is None:
+                quoted = match.group('squote')
+            tokens.append(('value',_escaped_quote.sub(r'\1',quoted)))
+    return tokens
+
+
+class Term(object):
+    """
+    Condition on a single attribute.
+
+    Terms with a lower rank can be answered more directly from the indexes,
+    and are evaluated first within an AND.
+
+    :param attr: The name of the attribute, ``name`` for the host name
+    :type  attr: str
+
+    :param value: The value the attribute is compared against
+    :type  value: str
+    """
+    rank = 3
+    op   = None
+
+    def __init__(self,attr,value):
+        self.attr  = attr.lower().replace(' ','_')
+        self.value = value
+
+    def test(self,value):
+        """
+        Whether or not a lower-cased attribute value passes the condition.
+        Hosts without the attribute are passed None
+        """
+        raise NotImplementedError
+
+    def lookup(self,idx,nodes):
+        """
+        Return the set of matching hosts and a description of how the index
+        was used
+        """
+        return idx.where(self.test),'scanned distinct values of {:}'\
+                                    ''.format(self.attr)
+
+    def evaluate(self,generation,candidates,notes,depth=0):
+        idx = generation.index(self.attr)
+        if candidates is None:
+            found,how = self.lookup(idx,generation.nodes)
+        else:
+            found = idx.select(self.test,candidates,generation.nodes.get)
+            how   = 'checked {:} candidates'.format(len(candidates))
+        notes.append((depth,'{:}: {:}, {:} hosts'.format(self,how,
+                                                           len(found))))
+        return found
+
+    def __str__(self):
+        return '{:} {:} {!r}'.format(self.attr,self.op,self.value)
+
+
+class Equals(Term):
+    """
+    Case-insensitive equality, or a glob pattern match if the value contains
+    any wildcards, the same as :meth:`.NetConfig.search`
+    """
+    op = '='
+
+    def __init__(self,attr,value):
+        super(Equals,self).__init__(attr,value)
+        self._pattern = value.lower()
+        self._prefix  = index.literal_prefix(self._pattern)
+        self._glob    = index.is_glob(self._pattern)
+        if not self._glob:
+            self.rank = 0
+        elif self._prefix:
+            self.rank = 1
+        self._match   = index.compile_glob(self._pattern)
+
+    def test(self,value):
+        if value is None:
+            return False
+        if not self._glob:
+            return value == self._pattern
+        return self._match(value) is not None
+
+    def lookup(self,idx,nodes):
+        if not self._glob:
+            return idx.exact(self._pattern),'exact index on '\
+                                            '{:}'.format(self.attr)
+        if self._prefix:
+            found = idx.prefix(self._prefix)
+            how   = 'prefix index on {:}'.format(self.attr)
+            if self._pattern != self._prefix + '*':
+                found = idx.select(self.test,found,nodes.get)
+            return found,how
+        return super(Equals,self).lookup(idx,nodes)
+
+    def evaluate(self,generation,candidates,notes,depth=0):
+        if candidates is not None and not self._glob:
+            #Intersecting with the index is cheaper than checking each host
+            found = generation.index(self.attr).exact(self._pattern)
+            found &= candidates
+            notes.append((depth,'{:}: exact index on {:}, {:} '\
+                                'hosts'.format(self,self.attr,len(found))))
+            return found
+        return super(Equals,self).evaluate(generation,candidates,notes,
+                                           depth=depth)
+
+
+class Regex(Term):
+    """
+    Case-insensitive regular expression search
+    """
+    op   = '~'
+    rank = 4
+
+    def __init__(self,attr,value):
+        super(Regex,self).__init__(attr,value)
+        try:
+            self._search = re.compile(value,re.I).search
+        except re.error as e:
+            raise QueryError('Invalid regular expression {!r}: '\
+                             '{:}'.format(value,e))
+
+    def test(self,value):
+        return value is not None and self._search(value) is not None
+
+
+class InNetwork(Term):
+    """
+    Whether an address lies within a CIDR network
+    """
+    op   = 'in'
+    rank = 2
+
+    def __init__(self,attr,value):
+        super(InNetwork,self).__init__(attr,value)
+        try:
+            self._network = ipaddress.ip_network(value,strict=False)
+        except ValueError as e:
+            raise QueryError('Invalid network {!r}: {:}'.format(value,e))
+
+    def test(self,value):
+        if not value:
+            return False
+        try:
+            return ipaddress.ip_address(value) in self._network
+        except ValueError:
+            return False
+
+    def evaluate(self,generation,candidates,notes,depth=0):
+        if candidates is not None or self.attr != 'ip':
+            return super(InNetwork,self).evaluate(generation,candidates,notes,
+                                                  depth=depth)
+        found = set(generation.ips.network(self._network))
+        notes.append((depth,'{:}: address index, {:} '\
+                            'hosts'.format(self,len(found))))
+        return found
+
+
+class Not(object):
+    """
+    Hosts that do not match a sub-expression
+    """
+    rank = 5
+
+    def __init__(self,child):
+        self.child = child
+
+    def evaluate(self,generation,candidates,notes,depth=0):
+        base = set(generation.nodes) if candidates is None else candidates
+        line = len(notes)
+        notes.append(None)
+        found = base - self.child.evaluate(generation,base,notes,depth+1)
+        notes[line] = (depth,'NOT: {:} hosts'.format(len(found)))
+        return found
+
+    def __str__(self):
+        return 'not ({:})'.format(self.child)
+
+
+class And(object):
+    """
+    Hosts matching every sub-expression.
+
+    The sub-expressions are ordered by rank when the query is compiled, so
+    the terms answered directly from an index run first and each following
+    term only checks the hosts that are still candidates.
+    """
+    def __init__(self,children):
+        self.children = sorted(children,key=lambda child: child.rank)
+        self.rank     = self.children[0].rank
+
+    def evaluate(self,generation,candidates,notes,depth=0):
+        line = len(notes)
+        notes.append(None)
+        for i,child in enumerate(self.children):
+            candidates = child.evaluate(generation,candidates,notes,depth+1)
+            if not candidates:
+                skipped = len(self.children) - i - 1
+                if skipped:
+                    notes.append((depth+1,'skipped {:} remaining '\
+                                          'terms'.format(skipped)))
+                break
+        notes[line] = (depth,'AND: {:} hosts'.format(len(candidates)))
+        return candidates
+
+    def __str__(self):
+        return ' and '.join('({:})'.format(child)
+                            for child in self.children)
+
+
+class Or(object):
+    """
+    Hosts matching any sub-expression
+    """
+    def __init__(self,children):
+        self.children = children
+        self.rank     = max(child.rank for child in children)
+
+    def evaluate(self,generation,candidates,notes,depth=0):
+        line  = len(notes)
+        notes.append(None)
+        found = set()
+        for child in self.children:
+            found |= child.evaluate(generation,candidates,notes,depth+1)
+        notes[line] = (depth,'OR: {:} hosts'.format(len(found)))
+        return found
+
+    def __str__(self):
+        return ' or '.join('({:})'.format(child)
+                           for child in self.children)
+
+
+class _Parser(object):
+
+    _terms = {'=':Equals,'==':Equals,'~':Regex}
+
+    def __init__(self,expr):
+        self.expr   = expr
+        self.tokens = tokenize(expr)
+        self.pos    = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None,None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def error(self,msg):
+        return QueryError('{:} in query {!r}'.format(msg,self.expr))
+
+    def parse(self):
+        if not self.tokens:
+            raise self.error('Empty expression')
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise self.error('Unexpected {!r}'.format(self.peek()[1]))
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == ('keyword','or'):
+            self.next()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() == ('keyword','and'):
+            self.next()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.peek() == ('keyword','not'):
+            self.next()
+            return Not(self.parse_not())
+        if self.peek() == ('paren','('):
+            self.next()
+            node = self.parse_or()
+            if self.next() != ('paren',')'):
+                raise self.error('Missing closing parenthesis')
+            return node
+        return self.parse_term()
+
+    def parse_term(self):
+        kind,attr = self.next()
+        if kind != 'value':
+            raise self.error('Expected an attribute name, found '\
+                             '{!r}'.format(attr))
+        kind,op = self.next()
+        negate  = False
+        if (kind,op) == ('keyword','not') and self.peek() == ('keyword','in'):
+            kind,op = self.next()
+            negate  = True
+        if (kind,op) == ('keyword','in'):
+            term_class = InNetwork
+        elif kind == 'op' and op == '!=':
+            term_class = Equals
+            negate     = True
+        elif kind == 'op':
+            term_class = self._terms[op]
+        else:
+            raise self.error('Expected an operator after {!r}'.format(attr))
+        kind,value = self.next()
+        if kind != 'value':
+            raise self.error('Expected a value after {!r}'.format(op))
+        term = term_class(attr,value)
+        return Not(term) if negate else term
+
+
+class Query(object):
+    """
+    A compiled query expression.
+
+    Expressions combine conditions on NetConfig attributes with ``and``,
+    ``or``, ``not`` and parentheses. Each condition is one of
+
+    ``attr = value``
+        Case-insensitive equality, or a glob match if value contains
+        wildcards. ``==`` is the same, and ``!=`` negates it
+    ``attr ~ regex``
+        Case-insensitive regular expression search
+    ``attr in network``
+        Address within a CIDR network, ``not in`` negates it
+
+    Values containing spaces, parentheses or operators must be quoted, for
+    example ``subnet = cds-xpp* and description ~ 'moxa|digi'``
+
+    :param expr: The query expression
+    :type  expr: str
+    """
+    def __init__(self,expr):
+        self.expr = expr
+        self.plan = _Parser(expr).parse()
+
+    def evaluate(self,generation,notes=None):
+        """
+        Return the set of host names in a generation matching the query
+
+        :param notes: List that receives a (depth, text) pair describing each
+                      step of the evaluation
+        :type  notes: list
+        """
+        if notes is None:
+            notes = []
+        return self.plan.evaluate(generation,None,notes)
+
+    def explain(self,generation):
+        """
+        Evaluate the query and describe each step taken, including which
+        indexes were used and how many hosts remained
+        """
+        notes = []
+        self.evaluate(generation,notes)
+        return '\n'.join('  '*depth + text for depth,text in notes)
+
+    def __str__(self):
+        return str(self.plan)
+
+
+@functools.lru_cache(maxsize=128)
+def compile_query(expr):
+    """
+    Compile a query expression into a :class:`.Query`, reusing the result
+    for repeated expressions
+    """
+    return Query(expr)
@@ -0,0 +1,490 @@
+import time
+import weakref
+import logging
+import threading
+
+from . import index
+from .parsing import location_fields
+
+module_logger = logging.getLogger(__name__)
+
+#Free text attributes whose individual words are indexed for searches
+TOKENIZED = ('description','location')
+
+
+class ReadWriteLock(object):
+    """
+    A lock allowing many concurrent readers or a single writer.
+
+    Writers are given priority, so that a steady stream of readers can not
+    hold off a refresh indefinitely.
+    """
+    def __init__(self):
+        self._cond    = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer  = False
+        self._waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer   = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def read(self):
+        """
+        Context manager holding the lock for reading
+        """
+        return _Held(self.acquire_read,self.release_read)
+
+    def write(self):
+        """
+        Context manager holding the lock for writing
+        """
+        return _Held(self.acquire_write,self.release_write)
+
+
+class _Held(object):
+
+    def __init__(self,acquire,release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self,*exc):
+        self._release()
+
+
+class Delta(object):
+    """
+    The hosts that differ between two generations of the database
+
+    :param added: Names of hosts only in the new generation
+    :type  added: set
+
+    :param removed: Names of hosts only in the old generation
+    :type  removed: set
+
+    :param changed: Names of hosts whose information differs
+    :type  changed: set
+
+    :param generation: The number of the new generation
+    :type  generation: int
+    """
+    def __init__(self,added=(),removed=(),changed=(),generation=0):
+        self.added      = set(added)
+        self.removed    = set(removed)
+        self.changed    = set(changed)
+        self.generation = generation
+
+    @property
+    def hosts(self):
+        """
+        Every host affected by the change
+        """
+        return self.added | self.removed | self.changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return '<Delta to generation {:}: {:} added, {:} removed, {:} '\
+               'changed>'.format(self.generation,len(self.added),
+                                 len(self.removed),len(self.changed))
+
+
+def _unlocated(info):
+    return dict((attr,value) for attr,value in info.items()
+                if attr not in location_fields)
+
+
+class Generation(object):
+    """
+    A single load of the NetConfig database.
+
+    A generation is never modified once it is published, a refresh instead
+    builds a new one. The search indexes are built lazily on first use.
+
+    :param nodes: Dictionary of host names and :class:`.store.HostRecord`
+    :type  nodes: dict
+
+    :param mac: Dictionary of lower-cased ethernet addresses and host names
+    :type  mac: dict
+
+    :param located: Whether or not location information has been inferred
+                    for each host
+    :type  located: bool
+
+    :param source: Description of where the database was loaded from, see
+                   :mod:`.sources`
+    :type  source: str
+    """
+    def __init__(self,nodes,mac,located=False,source=None):
+        self.nodes    = nodes
+        self.mac      = mac
+        self.located  = located
+        self.source   = source
+        self.number   = 0
+        self.loadtime = time.time()
+        self._indexes = {}
+        self._names   = None
+        self._macs    = None
+        self._ips     = None
+        self._lock    = threading.Lock()
+        #Snapshot the nodes are read from, with prebuilt address indexes
+        self._mapped  = getattr(nodes,'snapshot',None)
+
+    def index(self,attr):
+        """
+        Return the secondary index for an attribute, building it on first use
+        """
+        try:
+            return self._indexes[attr]
+        except KeyError:
+            with self._lock:
+                if attr not in self._indexes:
+                    idx = index.AttributeIndex.from_nodes(attr,self.nodes,
+                                                   tokenize=attr in TOKENIZED)
+                    self._indexes[attr] = idx
+            return self._indexes[attr]
+
+    @property
+    def names(self):
+        """
+        Sorted index of host names
+        """
+        if self._names is None:
+            with self._lock:
+                if self._names is None:
+                    self._names = index.NameIndex(self.nodes.keys())
+        return self._names
+
+    @property
+    def macs(self):
+        """
+        Index of host names by integer MAC address
+        """
+        if self._macs is None:
+            with self._lock:
+                if self._macs is None and self._mapped is not None:
+                    self._macs = self._mapped.mac_index()
+                elif self._macs is None:
+                    self._macs = index.MacIndex(self.mac)
+        return self._macs
+
+    @property
+    def ips(self):
+        """
+        Index of host names by IP address
+        """
+        if self._ips is None:
+            with self._lock:
+                if self._ips is None and self._mapped is not None:
+                    self._ips = self._mapped.ip_index()
+                elif self._ips is None:
+                    self._ips = index.IpIndex(self.nodes)
+        return self._ips
+
+    def diff(self,other):
+        """
+        Return the :class:`.Delta` from this generation to other
+
+        If only one of them is located the inferred location fields are left
+        out of the comparison, so that locating the same database does not
+        change every host
+        """
+        old,new = self.nodes,other.nodes
+        if self.located == other.located:
+            changed = [node for node,info in new.items()
+                       if node in old and old[node] != info]
+        else:
+            changed = [node for node,info in new.items()
+                       if node in old and _unlocated(old[node]) != _unlocated(info)]
+        return Delta(added=new.keys() - old.keys(),
+                     removed=old.keys() - new.keys(),
+                     changed=changed)
+
+    def evolve(self,other,delta):
+        """
+        Rebase a freshly loaded generation on this one.
+
+        Unchanged hosts keep their existing records, and the MAC map and any
+        index already built are copied with only the hosts in delta updated,
+        instead of being rebuilt from scratch. Neither generation is modified
+        in place, so readers of this generation are unaffected.
+
+        :param other: The freshly loaded generation
+        :type  other: :class:`.Generation`
+
+        :param delta: The result of :meth:`.diff`
+        :type  delta: :class:`.Delta`
+
+        :return: The new generation
+        """
+        nodes   = dict(self.nodes)
+        mac     = dict(self.mac)
+        changes = []
+        for node in delta.hosts:
+            old  = self.nodes.get(node)
+            info = other.nodes.get(node)
+            changes.append((node,old,info))
+            if old is not None:
+                address = (old.get('ethernet_address') or '').lower()
+                if mac.get(address) == node:
+                    del mac[address]
+                del nodes[node]
+            if info is not None:
+                address = (info.get('ethernet_address') or '').lower()
+                if address:
+                    mac[address] = node
+                nodes[node] = info
+
+        generation = Generation(nodes,mac,located=other.located,
+                                source=other.source)
+        for attr,idx in list(self._indexes.items()):
+            generation._indexes[attr] = idx.updated(changes)
+        if self._names is not None:
+            generation._names = self._names.updated(delta.added,delta.removed)
+        if self._macs is not None:
+            generation._macs = self._macs.updated(changes)
+        if self._ips is not None:
+            generation._ips = self._ips.updated(changes)
+        return generation
+
+
+class Registry(object):
+    """
+    Process-wide holder of the current NetConfig generation.
+
+    Every :class:`.NetConfig` registers itself as a consumer, and the database
+    is only loaded by the first one that needs it. A refresh loads a new
+    generation without holding any lock, so refreshes and the first load may
+    overlap, and only comparing it with the current generation and swapping
+    it in are serialised. The swap happens under the write lock, so readers
+    always see either the complete old or the complete new database. A load
+    that finishes after one started later has been published is dropped.
+    """
+    def __init__(self):
+        self._lock       = ReadWriteLock()
+        # Serialises the first load, and comparing and publishing refreshes
+        self._load_lock  = threading.Lock()
+        # Loads started, and the latest of them that was published
+        self._loads      = 0
+        self._published  = 0
+        self._generation = None
+        self._consumers  = 0
+        self._count_lock = threading.Lock()
+        self._stop       = None
+        self._subscribers = []
+
+    @property
+    def consumers(self):
+        """
+        Number of registered consumers
+        """
+        return self._consumers
+
+    def acquire(self):
+        """
+        Register a new consumer
+        """
+        with self._count_lock:
+            self._consumers += 1
+
+    def release(self):
+        """
+        Unregister a consumer. Once the last consumer is released, any
+        background refresh is stopped
+        """
+        with self._count_lock:
+            self._consumers = max(self._consumers - 1,0)
+            if not self._consumers:
+                self.stop_refresh()
+
+    def current(self):
+        """
+        Return the current generation, or None if nothing is loaded
+        """
+        with self._lock.read():
+            return self._generation
+
+    def get(self,loader):
+        """
+        Return the current generation, loading it if this is the first request
+        in the process
+
+        :param loader: Function returning a new :class:`.Generation`
+        """
+        generation = self.current()
+        if generation is not None:
+            return generation
+
+        with self._load_lock:
+            generation = self.current()
+            if generation is None:
+                generation = self._load(loader)
+        return generation
+
+    def refresh(self,loader,incremental=False):
+        """
+        Load a new generation and make it visible to every consumer
+
+        Subscribers are then notified with the :class:`.Delta` between the
+        previous and the new generation.
+
+        :param loader: Function returning a new :class:`.Generation`
+
+        :param incremental: Rebase the new generation on the current one so
+                            that only the entries of changed hosts are
+                            updated, see :meth:`.Generation.evolve`
+        :type  incremental: bool
+
+        :return: The changes, or None if nothing was loaded before or a
+                 later load was published first
+        :rtype:  :class:`.Delta`
+        """
+        ticket     = self._start_load()
+        generation = loader()
+        with self._load_lock:
+            if ticket < self._published:
+                module_logger.debug('Dropped NetConfig load {:}, overtaken '\
+                                    'by load {:}'.format(ticket,
+                                                         self._published))
+                return None
+            previous   = self.current()
+            delta      = None
+            if previous is not None:
+                delta = previous.diff(generation)
+                if incremental and previous.located == generation.located:
+                    generation = previous.evolve(generation,delta)
+            self._publish(generation)
+            self._published = ticket
+
+        if delta is not None:
+            delta.generation = generation.number
+            module_logger.info('NetConfig changes: {:}'.format(delta))
+            self._notify(delta)
+        return delta
+
+    def _start_load(self):
+        with self._load_lock:
+            self._loads += 1
+            return self._loads
+
+    def _load(self,loader):
+        # Called with the load lock held
+        self._loads += 1
+        ticket      = self._loads
+        generation  = loader()
+        self._publish(generation)
+        self._published = ticket
+        return generation
+
+    def _publish(self,generation):
+        with self._lock.write():
+            if self._generation is not None:
+                generation.number = self._generation.number + 1
+            self._generation = generation
+        module_logger.debug('Published NetConfig generation {:} with {:} '\
+                            'hosts'.format(generation.number,
+                                           len(generation.nodes)))
+
+    def subscribe(self,callback):
+        """
+        Call callback with a :class:`.Delta` after every refresh
+
+        Bound methods are only weakly referenced, so subscribing does not keep
+        the object alive.
+        """
+        try:
+            ref = weakref.WeakMethod(callback)
+        except TypeError:
+            ref = lambda: callback
+        with self._count_lock:
+            self._subscribers.append(ref)
+
+    def unsubscribe(self,callback):
+        """
+        Stop notifying callback
+        """
+        with self._count_lock:
+            self._subscribers = [ref for ref in self._subscribers
+                                 if ref() is not None and ref() != callback]
+
+    def _notify(self,delta):
+        with self._count_lock:
+            self._subscribers = [ref for ref in self._subscribers
+                                 if ref() is not None]
+            callbacks = [ref() for ref in self._subscribers]
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(delta)
+            except Exception as e:
+                module_logger.exception('NetConfig subscriber {:} '\
+                                        'failed: {:}'.format(callback,e))
+
+    def start_refresh(self,loader,interval,incremental=True):
+        """
+        Refresh the database from a daemon thread every interval seconds,
+        until the last consumer is released or :meth:`.stop_refresh` is called
+        """
+        self.stop_refresh()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.refresh(loader,incremental=incremental)
+                except Exception as e:
+                    module_logger.error('Background NetConfig refresh '\
+                                        'failed: {:}'.format(e))
+
+        thread = threading.Thread(target=run,name='netconfig-refresh')
+        thread.daemon = True
+        self._stop = stop
+        thread.start()
+
+    def stop_refresh(self):
+        """
+        Stop the background refresh if one is running
+        """
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def clear(self):
+        """
+        Drop the loaded database, the next consumer will load it again
+        """
+        with self._lock.write():
+            self._generation = None
+
+
+#The registry shared by every NetConfig in the process
+registry = Registry()
@@ -0,0 +1,426 @@
+import sys
+import json
+import mmap
+import array
+import bisect
+import struct
+import logging
+from collections.abc import Mapping, ItemsView, ValuesView
+
+from . import index
+from .store import HostRecord
+
+module_logger = logging.getLogger(__name__)
+
+MAGIC   = b'PSNETNC\x00'
+#Format of the snapshot files, bumped whenever their layout changes
+VERSION = 3
+#String identifier used for missing values
+NONE    = 0xFFFFFFFF
+
+_header = struct.Struct('<I')
+
+
+class SnapshotError(ValueError):
+    """
+    Raised when a file is not a snapshot this version can read
+    """
+    pass
+
+
+class _Builder(object):
+    """
+    Assign identifiers to the strings and attribute name tuples of a
+    database while it is being written
+    """
+    def __init__(self):
+        self.strings      = {}
+        self.keysets      = {}
+        self.keyset_ids   = array.array('I')
+        self.keyset_offs  = array.array('I',[0])
+
+    def string(self,s):
+        if s is None:
+            return NONE
+        if not isinstance(s,str):
+            raise TypeError('Unable to store {!r} in a snapshot'.format(s))
+        return self.strings.setdefault(s,len(self.strings))
+
+    def keyset(self,keys):
+        try:
+            return self.keysets[keys]
+        except KeyError:
+            self.keyset_ids.extend(self.string(key) for key in keys)
+            self.keyset_offs.append(len(self.keyset_ids))
+            return self.keysets.setdefault(keys,len(self.keysets))
+
+    def table(self,names,nodes,values):
+        """
+        Build the (name, attribute names, first value) records of each host,
+        adding the values to the shared value pool
+        """
+        records = array.array('I')
+        for name in names:
+            info = nodes.get(name) or {}
+            keys = tuple(info.keys())
+            records.extend((self.string(name),self.keyset(keys),len(values)))
+            values.extend(self.string(info[key]) for key in keys)
+        return records
+
+    def string_table(self):
+        offsets = array.array('I',[0])
+        blob    = bytearray()
+        for s in sorted(self.strings,key=self.strings.get):
+            blob.extend(s.encode('utf-8'))
+            offsets.append(len(blob))
+        return offsets,bytes(blob)
+
+
+def write(f,nodes,mac,locations=None,**meta):
+    """
+    Write a database to an open binary file
+
+    The file starts with a JSON header describing each section, followed by
+    the sections themselves, each aligned to eight bytes. Every string is
+    stored once in a string table and referred to by its position. Each host
+    is a fixed-width record of its name, its tuple of attribute names and
+    the position of its first value in a pool of string identifiers. The
+    hosts are sorted by name, and the MAC and IP addresses are stored as
+    sorted columns, so all three can be searched in place.
+
+    :param nodes: Dictionary of host names and information
+    :type  nodes: dict
+
+    :param mac: Dictionary of ethernet addresses and host names
+    :type  mac: dict
+
+    :param locations: Optional dictionary of host names and inferred
+                      location information
+    :type  locations: dict
+
+    :param meta: Other information saved in the header, such as the
+                 ``loadtime`` and ``source``
+    """
+    builder  = _Builder()
+    names    = sorted(nodes)
+    position = dict((name,i) for i,name in enumerate(names))
+    values   = array.array('I')
+    sections = [('hosts',builder.table(names,nodes,values))]
+    if locations is not None:
+        sections.append(('located',builder.table(names,locations,values)))
+    sections.append(('values',values))
+
+    #MAC addresses as integers, sorted
+    macs = sorted((value,position[node],address)
+                  for value,node,address in
+                  ((index.parse_mac(address),node,address)
+                   for address,node in mac.items())
+                  if value is not None and node in position)
+    sections.extend([('mac_values',array.array('Q',[m[0] for m in macs])),
+                     ('mac_hosts',array.array('I',[m[1] for m in macs])),
+                     ('mac_strings',array.array('I',[builder.string(m[2])
+                                                     for m in macs]))])
+
+    #IP addresses in the same order as the IpIndex
+    ips = index.IpIndex(nodes)
+    sections.extend([
+        ('ip_versions',array.array('B',[key[0] for key in ips._keys])),
+        ('ip_high',array.array('Q',[key[1] >> 64 for key in ips._keys])),
+        ('ip_low',array.array('Q',[key[1] & 0xFFFFFFFFFFFFFFFF
+                                   for key in ips._keys])),
+        ('ip_hosts',array.array('I',[position[node] for node in ips._hosts])),
+        ('ip_subnets',array.array('I',[builder.string(net)
+                                       for net in ips._nets]))])
+
+    sections.extend([('keyset_offsets',builder.keyset_offs),
+                     ('keyset_ids',builder.keyset_ids)])
+    offsets,blob = builder.string_table()
+    sections.extend([('string_offsets',offsets),('strings',blob)])
+
+    #Lay out the sections after the header
+    layout = {}
+    offset = 0
+    for name,data in sections:
+        if isinstance(data,bytes):
+            layout[name] = [offset,len(data),'B']
+            offset += len(data)
+        else:
+            layout[name] = [offset,len(data),data.typecode]
+            offset += len(data)*data.itemsize
+        offset += -offset % 8
+    meta = dict(meta,version=VERSION,byteorder=sys.byteorder,hosts=len(names),
+                sections=layout)
+    header = json.dumps(meta).encode('utf-8')
+    start  = len(MAGIC) + _header.size + len(header)
+    start += -start % 8
+
+    f.write(MAGIC)
+    f.write(_header.pack(len(header)))
+    f.write(header)
+    f.write(b'\0'*(start - f.tell()))
+    for name,data in sections:
+        f.write(b'\0'*(start + layout[name][0] - f.tell()))
+        f.write(data if isinstance(data,bytes) else data.tobytes())
+
+
+class Snapshot(object):
+    """
+    A database snapshot mapped into memory.
+
+    Opening a snapshot only reads its header, records are decoded when they
+    are first accessed. The file is mapped read-only, so every process using
+    the same snapshot shares its pages in the page cache.
+
+    :param filename: The snapshot file
+    :type  filename: str
+
+    :raises: :class:`.SnapshotError` if the file is not a valid snapshot
+    """
+    def __init__(self,filename):
+        with open(filename,'rb') as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError('{:} is empty'.format(filename))
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise SnapshotError('{:} is not a NetConfig '\
+                                'snapshot'.format(filename))
+        start = len(MAGIC) + _header.size
+        try:
+            size, = _header.unpack(self._mm[len(MAGIC):start])
+            self.meta = json.loads(self._mm[start:start+size].decode('utf-8'))
+            version   = self.meta.get('version')
+            byteorder = self.meta.get('byteorder')
+        except (struct.error,ValueError,AttributeError):
+            raise SnapshotError('{:} has a corrupt header'.format(filename))
+        if version != VERSION or byteorder != sys.byteorder:
+            raise SnapshotError('{:} is from an incompatible '\
+                                'version'.format(filename))
+
+        start += size
+        start += -start % 8
+        view   = memoryview(self._mm)
+        self._sections = {}
+        try:
+            for name,(offset,length,typecode) in self.meta['sections'].items():
+                itemsize = array.array(typecode).itemsize
+                section  = view[start+offset:start+offset+length*itemsize]
+                if len(section) != length*itemsize:
+                    raise SnapshotError('{:} is truncated'.format(filename))
+                self._sections[name] = section.cast(typecode)
+
+            self.filename = filename
+            self.loadtime = self.meta.get('loadtime')
+            self._strings = {}
+            self._str_off = self._sections['string_offsets']
+            self._blob    = self._sections['strings']
+            self._values  = self._sections['values']
+            #There are only a handful of distinct attribute name tuples
+            offsets  = self._sections['keyset_offsets']
+            ids      = self._sections['keyset_ids']
+            self._keysets = [tuple(sys.intern(self.string(i))
+                                   for i in ids[offsets[k]:offsets[k+1]])
+                             for k in range(len(offsets)-1)]
+        except SnapshotError:
+            raise
+        except (KeyError,IndexError,ValueError,TypeError,AttributeError):
+            raise SnapshotError('{:} has a corrupt section '\
+                                'table'.format(filename))
+
+    def string(self,i):
+        """
+        Return the string with identifier i
+        """
+        if i == NONE:
+            return None
+        try:
+            return self._strings[i]
+        except KeyError:
+            s = str(self._blob[self._str_off[i]:self._str_off[i+1]],'utf-8')
+            return self._strings.setdefault(i,s)
+
+    def __len__(self):
+        return self.meta['hosts']
+
+    def name(self,i):
+        """
+        Return the name of the i-th host, in sorted order
+        """
+        return self.string(self._sections['hosts'][3*i])
+
+    def record(self,i,table='hosts'):
+        """
+        Return the :class:`.store.HostRecord` of the i-th host
+        """
+        records = self._sections[table]
+        keys    = self._keysets[records[3*i+1]]
+        start   = records[3*i+2]
+        return HostRecord(keys,tuple(self.string(value) for value in
+                                     self._values[start:start+len(keys)]))
+
+    def find(self,name):
+        """
+        Return the position of a host, or None if it is not in the snapshot
+        """
+        lo,hi = 0,len(self)
+        while lo < hi:
+            mid = (lo + hi)//2
+            if self.name(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.name(lo) == name:
+            return lo
+        return None
+
+    @property
+    def located(self):
+        """
+        Whether or not inferred locations are stored in the snapshot
+        """
+        return 'located' in self._sections
+
+    def nodes(self,located=False):
+        """
+        Return the hosts as a read-only mapping of names and records
+
+        :param located: Include the inferred location of each host
+        :type  located: bool
+        """
+        return MappedNodes(self,located=located)
+
+    def locations(self):
+        """
+        Return the inferred locations as a mapping of names and records, or
+        None if none are stored
+        """
+        if not self.located:
+            return None
+        return MappedNodes(self,table='located')
+
+    def mac(self):
+        """
+        Return the ethernet addresses as a read-only mapping of addresses and
+        host names
+        """
+        return MappedMac(self)
+
+    def mac_index(self):
+        """
+        Build a :class:`.index.MacIndex` from the stored sorted addresses
+        """
+        hosts = self._sections['mac_hosts']
+        idx   = index.MacIndex()
+        idx._hosts = dict(zip(self._sections['mac_values'].tolist(),
+                              (self.name(i) for i in hosts)))
+        return idx
+
+    def ip_index(self):
+        """
+        Build a :class:`.index.IpIndex` from the stored sorted addresses
+        """
+        idx = index.IpIndex()
+        idx._keys  = [(version,high << 64 | low) for version,high,low
+                      in zip(self._sections['ip_versions'],
+                             self._sections['ip_high'],
+                             self._sections['ip_low'])]
+        idx._hosts = [self.name(i) for i in self._sections['ip_hosts']]
+        idx._nets  = [self.string(i) for i in self._sections['ip_subnets']]
+        return idx
+
+    def __repr__(self):
+        return '<Snapshot {:} with {:} hosts>'.format(self.filename,len(self))
+
+
+class MappedNodes(Mapping):
+    """
+    Read-only mapping of host names and records stored in a
+    :class:`.Snapshot`. Names are found with a binary search, and records are
+    only decoded when accessed
+
+    :param located: Merge the inferred location into each record
+    :type  located: bool
+
+    :param table: The table of records to read
+    :type  table: str
+    """
+    def __init__(self,snapshot,located=False,table='hosts'):
+        self.snapshot = snapshot
+        self._located = located
+        self._table   = table
+
+    def _record(self,i):
+        record = self.snapshot.record(i,table=self._table)
+        if self._located:
+            info = dict(record)
+            info.update(self.snapshot.record(i,table='located'))
+            record = HostRecord(tuple(info.keys()),tuple(info.values()))
+        return record
+
+    def __getitem__(self,name):
+        i = self.snapshot.find(name)
+        if i is None:
+            raise KeyError(name)
+        return self._record(i)
+
+    def __contains__(self,name):
+        return self.snapshot.find(name) is not None
+
+    def __iter__(self):
+        for i in range(len(self.snapshot)):
+            yield self.snapshot.name(i)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def items(self):
+        return _MappedItems(self)
+
+    def values(self):
+        return _MappedValues(self)
+
+
+class _MappedItems(ItemsView):
+
+    def __iter__(self):
+        nodes = self._mapping
+        for i in range(len(nodes)):
+            yield nodes.snapshot.name(i),nodes._record(i)
+
+
+class _MappedValues(ValuesView):
+
+    def __iter__(self):
+        nodes = self._mapping
+        for i in range(len(nodes)):
+            yield nodes._record(i)
+
+
+class MappedMac(Mapping):
+    """
+    Read-only mapping of the ethernet addresses stored in a
+    :class:`.Snapshot` and host names. Addresses in any format accepted by
+    :func:`.index.parse_mac` can be looked up
+    """
+    def __init__(self,snapshot):
+        self.snapshot = snapshot
+        self._values  = snapshot._sections['mac_values']
+        self._hosts   = snapshot._sections['mac_hosts']
+
+    def __getitem__(self,address):
+        value = index.parse_mac(address)
+        i     = bisect.bisect_left(self._values,value) if value is not None \
+                else len(self._values)
+        if i == len(self._values) or self._values[i] != value:
+            raise KeyError(address)
+        return self.snapshot.name(self._hosts[i])
+
+    def __iter__(self):
+        strings = self.snapshot._sections['mac_strings']
+        for i in range(len(strings)):
+            yield self.snapshot.string(strings[i])
+
+    def __len__(self):
+        return len(self._values)
+
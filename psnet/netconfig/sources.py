@@ -0,0 +1,270 @@
+import io
+import os
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+from os import path,getenv
+
+from . import store
+from . import parsing
+from . import snapshot
+
+module_logger = logging.getLogger(__name__)
+
+#The NetConfig command line tool queried by the live source
+NETCONFIG_BIN    = getenv('PSNET_NETCONFIG_BIN',
+                          '/reg/common/tools/bin/netconfig')
+#Format of the snapshot files
+SNAPSHOT_VERSION = snapshot.VERSION
+
+
+def load_lines(lines):
+    """
+    Parse the lines of a ``netconfig search`` into compact records
+
+    :param lines: An iterable of lines of NetConfig output
+    :type  lines: iterable
+
+    :return: The dictionary of host names and :class:`.store.HostRecord`,
+             and the MAC address dictionary
+    """
+    hosts = store.HostStore()
+    mac   = {}
+    for device,info in parsing.iter_netconfig(lines):
+        hosts.add(device,info)
+        try:
+            mac[info['ethernet_address'].lower()] = device
+        except KeyError:
+            module_logger.debug('{:} has no ethernet '\
+                                'address listed'.format(device))
+    return hosts.nodes,mac
+
+
+def read_snapshot(filename):
+    """
+    Open a snapshot file, or return None if the file is missing, unreadable
+    or from an older format
+
+    :return: Dictionary with the ``nodes`` and ``mac`` of the database, the
+             ``loadtime`` and ``source`` it was loaded from and, if they were
+             saved, the inferred ``locations`` of each host and the
+             ``located`` hosts with their location merged in
+    """
+    try:
+        mapped = snapshot.Snapshot(filename)
+    except (IOError,OSError,snapshot.SnapshotError) as e:
+        module_logger.debug('Unable to read NetConfig snapshot '\
+                            '{:}: {:}'.format(filename,e))
+        return None
+
+    located = mapped.nodes(located=True) if mapped.located else None
+    return {'version'  : mapped.meta['version'],
+            'loadtime' : mapped.loadtime,
+            'source'   : mapped.meta.get('source'),
+            'nodes'    : mapped.nodes(),
+            'mac'      : mapped.mac(),
+            'locations': mapped.locations(),
+            'located'  : located}
+
+
+def write_snapshot(filename,contents):
+    """
+    Atomically replace a snapshot file
+
+    :param contents: Dictionary with at least the ``nodes``, ``mac`` and
+                     ``loadtime`` of the database, and optionally the
+                     ``source`` and inferred ``locations``
+    :type  contents: dict
+
+    :return: Whether or not the snapshot was written
+    """
+    cache_dir = path.dirname(path.abspath(filename))
+    tmp_path  = None
+    try:
+        if not path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        #Write to a temporary file in the same directory so that the
+        #rename is atomic and readers never see a partial snapshot. Processes
+        #that already mapped the old file keep reading it undisturbed
+        with tempfile.NamedTemporaryFile('wb',dir=cache_dir,
+                                         prefix='.netconfig',
+                                         delete=False) as f:
+            tmp_path = f.name
+            snapshot.write(f,contents['nodes'],contents['mac'],
+                           locations=contents.get('locations'),
+                           loadtime=contents['loadtime'],
+                           source=contents.get('source'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path,0o644)
+        os.replace(tmp_path,filename)
+    except (IOError,OSError,TypeError,ValueError) as e:
+        module_logger.warning('Unable to write NetConfig snapshot '\
+                              '{:}: {:}'.format(filename,e))
+        if tmp_path and path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    module_logger.debug('Saved NetConfig snapshot to {:}'.format(filename))
+    return True
+
+
+class Source(object):
+    """
+    Where the NetConfig database is loaded from.
+
+    Sources are described by a specification string, see :func:`.from_spec`
+    """
+    kind = None
+    #Whether loads are slow enough to be worth keeping in the on-disk cache
+    cacheable = True
+
+    def __init__(self,location):
+        self.location = location
+
+    def load(self):
+        """
+        Load the database
+
+        :return: The dictionary of host names and :class:`.store.HostRecord`,
+                 and the MAC address dictionary
+        """
+        raise NotImplementedError
+
+    def __str__(self):
+        return '{:}:{:}'.format(self.kind,self.location)
+
+    def __repr__(self):
+        return '<{:} {:}>'.format(type(self).__name__,self)
+
+
+class CommandSource(Source):
+    """
+    Query the live database with ``netconfig search '*'``, parsing the output
+    while it is still being written
+
+    :param location: Path of the netconfig command line tool
+    :type  location: str
+    """
+    kind = 'netconfig'
+
+    def __init__(self,location=None):
+        super(CommandSource,self).__init__(location or NETCONFIG_BIN)
+
+    def load(self):
+        cmd  = [self.location, "search", "*"]
+        proc = subprocess.Popen(cmd,stdout=subprocess.PIPE)
+        try:
+            stdout = io.TextIOWrapper(proc.stdout,encoding='utf-8')
+            nodes,mac = load_lines(stdout)
+        finally:
+            proc.stdout.close()
+            retcode = proc.wait()
+
+        if retcode:
+            raise subprocess.CalledProcessError(retcode,cmd)
+        return nodes,mac
+
+
+class DumpSource(Source):
+    """
+    Parse the saved output of ``netconfig search '*'``
+
+    :param location: Path of the dump file
+    :type  location: str
+    """
+    kind = 'dump'
+
+    def load(self):
+        with io.open(self.location,encoding='utf-8') as f:
+            return load_lines(f)
+
+
+class SnapshotSource(Source):
+    """
+    Map a snapshot file written by :func:`.save_snapshot`. Nothing is parsed
+    up front and records are read as they are needed, so this is the fastest
+    source
+
+    :param location: Path of the snapshot file
+    :type  location: str
+    """
+    kind      = 'snapshot'
+    cacheable = False
+
+    def load(self):
+        snapshot = read_snapshot(self.location)
+        if snapshot is None:
+            raise IOError('Unable to load NetConfig snapshot '\
+                          '{:}'.format(self.location))
+        return snapshot['nodes'],snapshot['mac']
+
+
+_sources = dict((source.kind,source) for source in (CommandSource,
+                                                     DumpSource,
+                                                     SnapshotSource))
+
+
+def from_spec(spec):
+    """
+    Create a source from a specification string
+
+    ``netconfig``
+        The live database, optionally followed by the path of the tool, for
+        example ``netconfig:/usr/local/bin/netconfig``
+    ``dump:<path>``
+        A saved ``netconfig search '*'`` output
+    ``snapshot:<path>``
+        A snapshot written by :func:`.save_snapshot`
+
+    :param spec: The specification, or an existing :class:`.Source`
+    :type  spec: str
+
+    :rtype: :class:`.Source`
+    """
+    if isinstance(spec,Source):
+        return spec
+    kind,sep,location = spec.partition(':')
+    try:
+        source_class = _sources[kind.strip().lower()]
+    except KeyError:
+        raise ValueError('Unknown NetConfig source {!r}, expected one of '\
+                         '{:}'.format(spec,', '.join(sorted(_sources))))
+    if not location and source_class is not CommandSource:
+        raise ValueError('NetConfig source {!r} needs a path'.format(spec))
+    return source_class(location or None)
+
+
+def save_snapshot(source,filename):
+    """
+    Load a source and save it as a snapshot file
+
+    :param source: The source specification or :class:`.Source`
+    :type  source: str
+
+    :param filename: The snapshot file to write
+    :type  filename: str
+    """
+    nodes,mac = from_spec(source).load()
+    return write_snapshot(filename,{'loadtime':time.time(),
+                                    'nodes'   :nodes,
+                                    'mac'     :mac})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Save a NetConfig snapshot '\
+                                     'for offline use with '\
+                                     'PSNET_NETCONFIG_SOURCE=snapshot:<file>')
+    parser.add_argument('snapshot',help='Snapshot file to write')
+    parser.add_argument('-s','--source',default='netconfig',
+                        help='Source to load, for example '\
+                             'dump:netconfig.txt')
+    args = parser.parse_args()
+    if not save_snapshot(args.source,args.snapshot):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
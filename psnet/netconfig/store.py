@@ -0,0 +1,116 @@
+import sys
+import logging
+from collections.abc import Mapping
+
+module_logger = logging.getLogger(__name__)
+
+
+class HostRecord(Mapping):
+    """
+    Read-only NetConfig information for a single host.
+
+    A record behaves like the dictionary of attributes it replaces, but only
+    stores a tuple of attribute names shared with every other host that has
+    the same set of attributes, and a tuple of values.
+
+    :param keys: The attribute names
+    :type  keys: tuple
+
+    :param values: The value of each attribute, in the same order as keys
+    :type  values: tuple
+    """
+    __slots__ = ('_keys','_values')
+
+    def __init__(self,keys,values):
+        self._keys   = keys
+        self._values = values
+
+    def __getitem__(self,key):
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __contains__(self,key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __eq__(self,other):
+        if isinstance(other,HostRecord) and self._keys == other._keys:
+            return self._values == other._values
+        return super(HostRecord,self).__eq__(other)
+
+    def __ne__(self,other):
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (HostRecord,(self._keys,self._values))
+
+    def __repr__(self):
+        return repr(dict(zip(self._keys,self._values)))
+
+
+class HostStore(object):
+    """
+    Builder of compact :class:`.HostRecord` objects.
+
+    Attribute names are interned and each distinct tuple of names is only
+    stored once. Values are stored as they are, since pooling them slowed
+    down building more than it saved. The schemas are only needed while
+    building, records keep working once the store has been discarded.
+    """
+    def __init__(self):
+        self.nodes    = {}
+        self._schemas = {}
+
+    def record(self,info):
+        """
+        Build a record from a dictionary of attributes without adding it to
+        the store
+        """
+        keys   = tuple(info)
+        schema = self._schemas.get(keys)
+        if schema is None:
+            schema = tuple(sys.intern(key) for key in keys)
+            self._schemas[keys] = schema
+        return HostRecord(schema,tuple(info.values()))
+
+    def add(self,name,info):
+        """
+        Add a host to the store
+
+        :param name: The name of the host
+        :type  name: str
+
+        :param info: Dictionary of attributes and values for the host
+        :type  info: dict
+
+        :return: The new record
+        """
+        record = self.record(info)
+        self.nodes[sys.intern(name)] = record
+        return record
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def compact(hosts):
+    """
+    Convert a dictionary of host names and attribute dictionaries into a
+    dictionary of :class:`.HostRecord`
+    """
+    store = HostStore()
+    for name,info in hosts.items():
+        store.add(name,info)
+    module_logger.debug('Stored {:} hosts using {:} distinct '\
+                        'attribute sets'.format(len(store),
+                                                len(store._schemas)))
+    return store.nodes
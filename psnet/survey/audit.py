@@ -4,9 +4,7 @@
 
 import os
 import sys
-import scp
 import time
-import utils
 import shutil
 import smtplib
 import logging
@@ -15,7 +13,9 @@ import tempfile
 from email.mime.text import MIMEText
 from subprocess import CalledProcessError
 from argparse import ArgumentParser
-from settings import SSH_CONF, LOG_CONF, HOST_IGNORE, CISCO_HOST, ARISTA_HOST, ICX_HOST, EMAIL_CONF
+from . import scp
+from . import utils
+from .settings import SSH_CONF, LOG_CONF, HOST_IGNORE, CISCO_HOST, ARISTA_HOST, ICX_HOST, EMAIL_CONF
 
 
 LOG = logging.getLogger(LOG_CONF.get('logger_name', __name__))
@@ -33,6 +33,9 @@ def parse_cli():
                       action="store_true",
                       help='Flag to enable sending of warning emails')
 
+    # Add the options for auditing many switches at once
+    utils.add_parallel_opts(parser)
+
     # Add the default logger options
     utils.add_log_opts(parser)
 
@@ -144,42 +147,63 @@ def main():
     
     fails = 0
     failed_hosts = {}
+    unfetched = None
+    if opts.jobs > 1:
+        # Fetch every running config before any saved config, so that no
+        # switch sees two connections at once
+        def helpers(run):
+            def helper(host):
+                if host in CISCO_HOST:
+                    return (cisco_scp_run if run else cisco_scp_start), 'cisco'
+                elif host in ARISTA_HOST:
+                    return (arista_scp_run if run else arista_scp_start), 'arista'
+                elif host in ICX_HOST:
+                    return (icx_scp_run if run else icx_scp_start), 'icx'
+                return (scp_run if run else scp_start), 'standard'
+            return helper
+
+        deadline = None
+        if opts.deadline:
+            deadline = time.monotonic() + opts.deadline
+        parallel_kwargs = {
+            'sessions': opts.jobs,
+            'host_timeout': opts.host_timeout,
+            'deadline': deadline,
+        }
+        unfetched = scp.fetch_all(helpers(True), good_switches, **parallel_kwargs)
+        unfetched |= scp.fetch_all(helpers(False),
+                                   [host for host in good_switches if host not in unfetched],
+                                   **parallel_kwargs)
+
     for host in good_switches:
         status = True
-        # don't put this in the same if statement - switch doesn't like simultaneous connections
-        LOG.debug('Attempting to fetch config files for %s', host)
-        """ For tests
-        if host in ICX_HOST:
-            scp_run_cmd = icx_scp_run.get_icx_cfg
-            scp_start_cmd = icx_scp_start.get_icx_cfg
+        if unfetched is not None:
+            # Already fetched above
+            status = host not in unfetched
         else:
-            continue
-        """
-        
-        
-        
-        # Check the type of switch
-        if host in CISCO_HOST:
-            scp_run_cmd = cisco_scp_run.get_cisco_cfg
-            scp_start_cmd = cisco_scp_start.get_cisco_cfg
-        elif host in ARISTA_HOST:
-            scp_run_cmd = arista_scp_run.get_arista_cfg
-            scp_start_cmd = arista_scp_start.get_arista_cfg
-        elif host in ICX_HOST:
-            scp_run_cmd = icx_scp_run.get_icx_cfg
-            scp_start_cmd = icx_scp_start.get_icx_cfg
-        else:
-            scp_run_cmd = scp_run.get_cfg
-            scp_start_cmd = scp_start.get_cfg
-        
-        
-        
-        # Run the scp commands
-        status = status and scp_run_cmd(host) == 0
-        print ('RUN___status = %d' % status)
-        time.sleep(0.25)
-        status = status and scp_start_cmd(host) == 0
-        print ('START_status = %d' % status)
+            # don't put this in the same if statement - switch doesn't like simultaneous connections
+            LOG.debug('Attempting to fetch config files for %s', host)
+
+            # Check the type of switch
+            if host in CISCO_HOST:
+                scp_run_cmd = cisco_scp_run.get_cisco_cfg
+                scp_start_cmd = cisco_scp_start.get_cisco_cfg
+            elif host in ARISTA_HOST:
+                scp_run_cmd = arista_scp_run.get_arista_cfg
+                scp_start_cmd = arista_scp_start.get_arista_cfg
+            elif host in ICX_HOST:
+                scp_run_cmd = icx_scp_run.get_icx_cfg
+                scp_start_cmd = icx_scp_start.get_icx_cfg
+            else:
+                scp_run_cmd = scp_run.get_cfg
+                scp_start_cmd = scp_start.get_cfg
+
+            # Run the scp commands
+            status = status and scp_run_cmd(host) == 0
+            print ('RUN___status = %d' % status)
+            time.sleep(0.25)
+            status = status and scp_start_cmd(host) == 0
+            print ('START_status = %d' % status)
         if status:
             if filecmp.cmp(os.path.join(dest_dir, '%s-run.cfg'%host), os.path.join(dest_dir, '%s-start.cfg'%host)):
                 LOG.debug('The running and save configurations match for %s', host)
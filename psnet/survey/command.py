@@ -1,13 +1,20 @@
 #!/reg/g/pcds/pyps/conda/rhel6/envs/pcds/bin/python
 
 ###!/usr/bin/env python
+import os
 import re
 import sys
+import time
 from . import utils
+from . import engine
+from . import retry
+import select
 import socket
 import logging
 import argparse
 import paramiko
+import collections
+import concurrent.futures
 import telnetlib
 from paramiko.ssh_exception import SSHException
 from subprocess import CalledProcessError
@@ -37,23 +44,42 @@ class TelnetCommandRunner(object):
             self.cmd_list.append(('%s\r\n'%cmd, None))
         self.cmd_list.append((self.tn_prompt, 'exit'))
         self.tn = telnetlib.Telnet()
+        self.host = None
+        # time.monotonic() by which the whole run must finish, if any
+        self.deadline = None
+
+    def _remaining(self, limit=None):
+        """
+        Seconds left before the deadline, at most limit, or limit if there
+        is no deadline. Raises socket.timeout once the deadline has passed
+        """
+        if self.deadline is None:
+            return limit
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('Timed out waiting for a response from %s' % self.host)
+        return remaining if limit is None else min(remaining, limit)
 
     def run(self, host):
         """
         Runs the command on the passed list of hosts
         """
         output = ''
+        self.host = host
         
         try:
-            self.tn.open(host, self.port, self.timeout)
+            self.tn.open(host, self.port, self._remaining(self.timeout))
             # Container for useful telnet output
             keep_next_out = False
             for prompt, reply in self.cmd_list:
                 if reply is None:
-                    cur_out = self.tn.read_until(prompt, 1)
+                    cur_out = self.tn.read_until(prompt, self._remaining(1))
                     keep_next_out = True
                 else:
-                    cur_out = self.tn.read_until(prompt)
+                    cur_out = self.tn.read_until(prompt, self._remaining())
+                    if not cur_out.endswith(prompt):
+                        # read_until gave up at the deadline
+                        self._remaining()
                     if keep_next_out:
                         if cur_out.endswith(prompt):
                             cur_out = cur_out[:-len(prompt)]
@@ -67,7 +93,93 @@ class TelnetCommandRunner(object):
         finally:
             self.tn.close()
 
+class Exchange(object):
+    """
+    One command sent to an interactive switch shell.
+
+    The lines read back from the switch are passed to :meth:`.feed`, which
+    skips everything up to the echo of the command, answers the pager and
+    collects the output until the prompt returns. The blocking runners and
+    the multiplexed :mod:`.engine` drive the same state machine.
+
+    With keepOutput False the exchange is over as soon as any prompt is
+    seen, and if a sink is given the output lines are passed to it instead
+    of being collected.
+    """
+    def __init__(self, cmd, prompt_pattern, page_cont_pattern, terminator, keepOutput=True, sink=None):
+        self.cmd = cmd
+        self.prompt_pattern = prompt_pattern
+        self.page_cont_pattern = page_cont_pattern
+        self.terminator = terminator
+        self.keepOutput = keepOutput
+        self.sink = sink
+        self.seen_echo = False
+        self.done = False
+        self.mode = None
+        self._output = []
+
+    @property
+    def output(self):
+        """
+        The output collected so far
+        """
+        return ''.join(self._output)
+
+    def request(self):
+        """
+        The text that starts the exchange
+        """
+        return '%s%s'%(self.cmd, self.terminator)
+
+    def _write(self, text):
+        if self.sink is not None:
+            self.sink(text)
+        else:
+            self._output.append(text)
+
+    def feed(self, line):
+        """
+        Handle the next line from the switch, returning any text that
+        should be sent back
+        """
+        if not self.seen_echo:
+            if self.keepOutput:
+                prompt_match = self.prompt_pattern.match(line.rstrip())
+                if prompt_match and prompt_match.group('cmd') == self.cmd:
+                    self.mode = prompt_match.group('mode')
+                    self.seen_echo = True
+                    # sort of ugly but works consistently for all switches
+                    return ' %s'%self.terminator
+            else:
+                prompt_match = self.prompt_pattern.match(line)
+                if prompt_match:
+                    self.mode = prompt_match.group('mode')
+                    self.seen_echo = True
+                    self.done = True
+            return None
+
+        page_cont = self.page_cont_pattern.match(line)
+        if page_cont:
+            self._write('%s\n'%page_cont.group('data'))
+            return ' %s'%self.terminator
+        prompt_match = self.prompt_pattern.match(line)
+        if prompt_match:
+            self.mode = prompt_match.group('mode')
+            self.done = True
+        else:
+            self._write(line)
+        return None
+
+
 class CommandRunner(object):
+    # Longest we wait on a silent switch before giving up on a command
+    cmd_timeout = 60.0
+    # Commands that turn off the pager for the rest of the session, tried in
+    # order until one is accepted
+    paging_cmds = []
+    # Reply to a command the switch did not accept
+    cmd_error_pattern = re.compile('^\s*(?:%|Invalid input|Error|Ambiguous input|Unrecognized command|Incomplete command)', re.I | re.M)
+
     def __init__(self, user, pw, enablepw, port, cmds, prompt, terminator, timeout=None, private_key=False, priv=False):
         self.user = user
         self.pw = pw
@@ -81,10 +193,22 @@ class CommandRunner(object):
         self.prompt_temp = prompt
         self.prompt_pattern = None
         self.terminator = terminator
-        self.ssh_out = None
-        self.recv_buf = 8192
+        self.recv_buf = 65536
+        # Retries and circuit breaker, replace it with one shared between
+        # runners for their failures to count together
+        self.connect_policy = retry.ConnectPolicy()
         self.chan = None
+        self.host = None
+        # time.monotonic() by which the whole run must finish, if any
+        self.deadline = None
         self.mode = ''
+        # Whether the switch may still page its output
+        self.paging = True
+        # Partial line and decoded lines received but not yet handled
+        self._rbuf = b''
+        self._lines = collections.deque()
+        # (cmd, seconds) for each command of the last run or execute
+        self.latency = []
         self._config()
 
     def _config(self):
@@ -93,81 +217,174 @@ class CommandRunner(object):
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
     def enter(self):
-        pass
+        self.disable_paging()
+
+    def disable_paging(self):
+        """
+        Ask the switch to send whole outputs instead of pausing at each page,
+        so that long tables arrive in one stream. If the switch refuses, or
+        the type of switch has no such command, the pager is answered page
+        by page as before. Returns whether paging is now off
+        """
+        for cmd in self.paging_cmds:
+            reply = self.exec_cmd(cmd)
+            if self.cmd_error_pattern.search(reply):
+                LOG.debug('%s refused %r, answering its pager instead: %s', self.host, cmd, reply.strip())
+                continue
+            LOG.debug('Turned off paging on %s with %r', self.host, cmd)
+            self.paging = False
+            break
+        return not self.paging
 
     def exit(self):
-        self.exec_cmd('exit', False)
+        try:
+            self.exec_cmd('exit', False)
+        except SSHException:
+            # the switch hung up, which is what we asked for
+            pass
 
-    def exec_cmd(self, cmd, keepOutput=True):
-        seen_echo = False
-        seen_prompt = False
-        self.chan.send('%s%s'%(cmd, self.terminator))
-        output = ''
-        
-        while not seen_echo:
-            if self.chan.recv_ready():
-                line = self.ssh_out.readline().decode("utf-8")
-                if keepOutput:
-                    prompt_match = self.prompt_pattern.match(line.rstrip())
-                    if prompt_match and prompt_match.group('cmd') == cmd:
-                        self.mode = prompt_match.group('mode')
-                        seen_echo = True
-                else:
-                    prompt_match = self.prompt_pattern.match(line)
-                    if prompt_match:
-                        self.mode = prompt_match.group('mode')
-                        seen_echo = True
+    def _wait_readable(self, deadline):
+        """
+        Block until the channel has data to read or the deadline passes.
+        Raises socket.timeout if the switch stays silent
+        """
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            ready, _, _ = select.select([self.chan], [], [], remaining)
+            if ready:
+                return
+        raise socket.timeout('Timed out waiting for a response from %s' % self.host)
+
+    def _deadline(self, now):
+        deadline = now + self.cmd_timeout
+        if self.deadline is not None:
+            deadline = min(deadline, self.deadline)
+        return deadline
+
+    def _readline(self, deadline):
+        """
+        Return the next line from the channel, sleeping in select until the
+        switch sends more data. Data is received in chunks of recv_buf bytes
+        and every complete line of a chunk is decoded at once
+        """
+        while not self._lines:
+            self._wait_readable(deadline)
+            data = self.chan.recv(self.recv_buf)
+            if not data:
+                raise SSHException('Channel closed by switch')
+            lines, self._rbuf = engine.split_lines(self._rbuf + data)
+            self._lines.extend(lines)
+        return self._lines.popleft()
+
+    def exchange(self, cmd, keepOutput=True, sink=None):
+        """
+        Create the :class:`.Exchange` for a command on this type of switch
+        """
+        return Exchange(cmd, self.prompt_pattern, self.page_cont_pattern,
+                        self.terminator, keepOutput=keepOutput, sink=sink)
 
+    def exec_cmd(self, cmd, keepOutput=True):
+        start = time.monotonic()
+        deadline = self._deadline(start)
+        exchange = self.exchange(cmd, keepOutput)
+        self.chan.send(exchange.request())
+
+        while not exchange.done:
+            reply = exchange.feed(self._readline(deadline))
+            if reply:
+                self.chan.send(reply)
+            if exchange.seen_echo:
+                # each line or page the switch sends resets the deadline
+                deadline = self._deadline(time.monotonic())
+
+        if exchange.mode:
+            self.mode = exchange.mode
+        elapsed = time.monotonic() - start
+        self.latency.append((cmd, elapsed))
+        LOG.debug('Command %r took %.3fs', cmd, elapsed)
         if keepOutput:
-            # sort of ugly but works consistently for all switches
-            self.chan.send(' %s'%self.terminator)
-            while not seen_prompt:
-                if self.chan.recv_ready():
-                    line = self.ssh_out.readline().decode("utf-8")
-                    page_cont = self.page_cont_pattern.match(line)
-                    if page_cont:
-                        self.chan.send(' %s'%self.terminator)
-                        output += '%s\n'%page_cont.group('data')
-                    else:
-                        prompt_match = self.prompt_pattern.match(line)
-                        if prompt_match:
-                            self.mode = prompt_match.group('mode')
-                            seen_prompt = True
-                        else:
-                            output += line
-        if keepOutput:
-            return output
+            return exchange.output
 
-    def run(self, host):
+    def open(self, host):
         """
-        Runs the command on the passed list of hosts
+        Log into the host and start an interactive shell, leaving the session
+        ready for :meth:`.execute` until :meth:`.close` is called.
+
+        Raises :class:`.retry.ConnectError` if the host cannot be reached, or
+        :class:`.retry.CircuitOpen` if it has been failing and is skipped
         """
         # Sigh... now we want to actually see if our prompt is '>' or '#' and enable if needed!
         self.prompt_pattern = re.compile(self.prompt_temp % (host, '(?P<mode>[#>])'))
-        output = ''
+        self.host = host
 
-        # The connect seems to fail a lot.  Let's see if we can catch this at all
-        # and retry?
-        did_connect = False
-        for i in range(5):
-            try:
-                self.ssh.connect(host, self.port, self.user, self.pw,
-                                 timeout=self.timeout,look_for_keys=False)
-                did_connect = True
-                break
-            except:
-                print("SSH connect failed, retry %d!" % i)
-        if not did_connect:
-            print("SSH connect failed, aborting!")
-            sys.exit(0)
+        # The connect seems to fail a lot, retry with backoff. Raises
+        # retry.ConnectError if the host cannot be reached
+        self.connect_policy.connect(host,
+                                    lambda: self.ssh.connect(host, self.port, self.user, self.pw,
+                                                             timeout=self.timeout, look_for_keys=False),
+                                    deadline=self.deadline)
 
         try:
             self.chan = self.ssh.invoke_shell()
-            self.ssh_out = self.chan.makefile('rb', self.recv_buf)
-
+            self._rbuf = b''
+            self._lines.clear()
+            self.latency = []
+            self.mode = ''
+            self.paging = True
             self.enter()
-            for cmd in self.cmds:
-                output += self.exec_cmd(cmd)
+        except:
+            self.ssh.close()
+            raise
+
+    def execute(self, cmds):
+        """
+        Run commands on the open shell and return their combined output
+        """
+        self.latency = []
+        output = []
+        for cmd in self._fix_cmds(cmds):
+            output.append(self.exec_cmd(cmd))
+        return ''.join(output)
+
+    def _fix_cmds(self, cmds):
+        return list(cmds)
+
+    def enable(self, enablepw=None):
+        """
+        Enter privileged mode on the open shell, for the switches that need
+        it before configuration commands
+        """
+        if enablepw:
+            self.enablepw = enablepw
+        self.priv = True
+
+    def alive(self):
+        """
+        Whether the shell is still open and its connection is up
+        """
+        if self.chan is None or self.chan.closed:
+            return False
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        """
+        Leave the shell and disconnect
+        """
+        try:
+            if self.alive():
+                self.exit()
+        finally:
+            self.ssh.close()
+            self.chan = None
+
+    def run(self, host):
+        """
+        Runs the command on the passed list of hosts
+        """
+        self.open(host)
+        try:
+            output = self.execute(self.cmds)
             self.exit()
             return (self.chan.recv_exit_status(), output)
         finally:
@@ -177,26 +394,35 @@ class CommandRunner(object):
 class AristaCommandRunner(CommandRunner):
     def __init__(self, user, pw, enablepw, port, cmds, timeout=None, private_key=False, priv=False):
         super(AristaCommandRunner, self).__init__(user, pw, enablepw, port, cmds, '^%s(?:\.ARISTA)?%s(?P<cmd>.*)', '\n', timeout, private_key, priv)
-        self.cmds = self._fix_cmds()
 
-    def _fix_cmds(self):
+    def disable_paging(self):
+        # Every command is piped through no-more instead
+        self.paging = False
+        return True
+
+    def _fix_cmds(self, cmds):
         new_cmds = []
-        for cmd in self.cmds:
-            new_cmds.append('%s | no-more'%cmd)
+        for cmd in cmds:
+            if cmd.rstrip().endswith('| json'):
+                # Keep | json as the last pipe of the command
+                new_cmds.append(cmd)
+            else:
+                new_cmds.append('%s | no-more'%cmd)
         return new_cmds
 
 
 class CiscoCommandRunner(CommandRunner):
+    paging_cmds = ['terminal length 0']
+
     def __init__(self, user, pw, enablepw, port, cmds, timeout=None, private_key=False, priv=False):
         super(CiscoCommandRunner, self).__init__(user, pw, enablepw, port, cmds, '^%s%s(?P<cmd>.*)', '\n', timeout, private_key, priv)
 
-    def enter(self):
-        self.exec_cmd('terminal length 0', False)
-
 
 class BrocadeCommandRunner(CommandRunner):
-    def __init__(self, user, pw, enablepw, port, cmds, timeout=None):
-        super(BrocadeCommandRunner, self).__init__(user, pw, enablepw, port, cmds, '^SSH@%s(?:\([\w-]*\))?%s(?P<cmd>.*)', '\r\n', timeout)
+    paging_cmds = ['skip-page-display']
+
+    def __init__(self, user, pw, enablepw, port, cmds, timeout=None, private_key=False, priv=False):
+        super(BrocadeCommandRunner, self).__init__(user, pw, enablepw, port, cmds, '^SSH@%s(?:\([\w-]*\))?%s(?P<cmd>.*)', '\r\n', timeout, private_key, priv)
 
     def exit(self):
         self.chan.send('exit%s'%self.terminator)
@@ -210,18 +436,30 @@ class BrocadeCommandRunner(CommandRunner):
             pass
 
 class RuckusCommandRunner(CommandRunner):
+    # A bare 'skip' sent here without reading its reply used to freeze the
+    # session. The full command is now read back like any other, and a
+    # refusal leaves the pager loop to do the work
+    paging_cmds = ['skip-page-display']
+
     def __init__(self, user, pw, enablepw, port, cmds, timeout=None, private_key=False, priv=False):
         super(RuckusCommandRunner, self).__init__(user, pw, enablepw, port, cmds, '^SSH@%s(?:\([\w-]*\))?%s(?P<cmd>.*)', '\n', timeout, private_key, priv)
 
     def enter(self):
-        # This doesn't seem to work.  If we do this, we freeze during the output.
-        #     self.exec_cmd('skip', False)
-        #
+        # Also tells us the mode we logged in with
+        self.disable_paging()
         if self.priv:
+            self.enable()
+
+    def enable(self, enablepw=None):
+        super(RuckusCommandRunner, self).enable(enablepw)
+        if not self.mode:
             # We do this only to get the mode.
             self.exec_cmd('show clock')
-            if self.mode == '>':
-                self.exec_cmd("enable %s" % self.enablepw)
+        if self.mode == '>':
+            self.exec_cmd("enable %s" % self.enablepw)
+            if self.paging:
+                # Some releases only allow it once enabled
+                self.disable_paging()
 
     def exit(self):
         self.chan.send('exit%s'%self.terminator)
@@ -281,12 +519,165 @@ def parse_cli():
     utils.add_ssh_opts(brocade_parser)
     utils.add_ssh_opts(arista_parser)
 
+    # Add the options for running on many hosts at once
+    for dev_parser in (cisco_parser, brocade_parser, arista_parser, digi_parser):
+        utils.add_parallel_opts(dev_parser)
+
+        dev_parser.add_argument('--output-dir',
+                                metavar='DIR',
+                                help='Write the output of each host to its own file in DIR instead of the console')
+
+        dev_parser.add_argument('--multiplex',
+                                action='store_true',
+                                help='Drive up to --jobs sessions from a single thread instead of a thread per host, for runs across the whole fleet')
+
     # Add the default logger options
     utils.add_log_opts(parser)
 
     return parser.parse_args()
 
 
+def make_runner(args, passwd):
+    """
+    Create a command runner for a single host from the command line opts.
+    SSH runners share the retry policy of the run, so that the failures of
+    a host count towards its circuit breaker across connections
+    """
+    if hasattr(args,'private_key'):
+        runner = args.cmd_run(args.user, passwd, None, args.port, args.cmds, timeout=args.timeout, private_key=args.private_key)
+    else:
+        runner = args.cmd_run(args.user, passwd, None, args.port, args.cmds, timeout=args.timeout)
+    policy = getattr(args, 'connect_policy', None)
+    if policy is not None and isinstance(runner, CommandRunner):
+        runner.connect_policy = policy
+    return runner
+
+
+def run_host(args, passwd, host, deadline=None):
+    """
+    Run the commands on one host, giving up after the per-host timeout or the
+    overall deadline, whichever comes first
+    """
+    cmd_run = make_runner(args, passwd)
+    if args.host_timeout:
+        host_deadline = time.monotonic() + args.host_timeout
+        deadline = host_deadline if deadline is None else min(deadline, host_deadline)
+    if deadline is not None and deadline <= time.monotonic():
+        raise socket.timeout('Deadline passed before reaching %s' % host)
+    cmd_run.deadline = deadline
+    LOG.info('Running command(s) %s on %s', ', '.join(args.cmds), host)
+    return cmd_run.run(host)
+
+
+class OutputFile(object):
+    """
+    Write the output of a host to a file as it arrives. The file is only
+    opened on the first write, so that waiting hosts hold no descriptors
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = None
+
+    def __call__(self, text):
+        if self.f is None:
+            self.f = open(self.filename, 'w')
+        self.f.write(text)
+
+    def close(self):
+        if self.f is None:
+            self.f = open(self.filename, 'w')
+        self.f.close()
+
+
+def run_threaded(args, passwd, hosts, deadline=None):
+    """
+    Run the hosts on a pool of threads, yielding (host, result, error) in
+    the order of the hosts as soon as every host before them has finished
+    """
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(args.jobs, 1))
+    jobs = [(host, pool.submit(run_host, args, passwd, host, deadline)) for host in hosts]
+    try:
+        for host, job in jobs:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            concurrent.futures.wait([job], timeout=remaining)
+            if not job.done():
+                job.cancel()
+                yield host, None, socket.timeout('did not finish before the deadline')
+                continue
+            try:
+                result = job.result()
+            except Exception as err:
+                # A failure on one host, whatever it is, must not end the run
+                LOG.debug('Error running commands on %s', host, exc_info=True)
+                yield host, None, err
+            else:
+                yield host, result, None
+    finally:
+        # Hosts still running stop at their own deadline
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_multiplexed(args, passwd, hosts, deadline=None):
+    """
+    Drive the sessions to every host from this thread with the
+    :class:`.engine.Engine`, yielding (host, result, error) in the order of
+    the hosts. With an output directory the output of the switches is
+    streamed straight into their files, and the result holds None in place
+    of the output
+    """
+    jobs = []
+    for host in hosts:
+        runner = make_runner(args, passwd)
+        if isinstance(runner, CommandRunner):
+            sink = None
+            if args.output_dir:
+                sink = OutputFile(os.path.join(args.output_dir, host))
+            jobs.append(engine.ShellJob(host, runner, sink=sink))
+        else:
+            jobs.append(engine.CallJob(host, runner.run, runner=runner))
+
+    position = dict((job, i) for i, job in enumerate(jobs))
+    mux = engine.Engine(sessions=args.jobs,
+                        cmd_timeout=CommandRunner.cmd_timeout,
+                        host_timeout=args.host_timeout,
+                        deadline=deadline)
+    finished = {}
+    upcoming = 0
+    for job in mux.run(jobs):
+        if getattr(job, 'sink', None) is not None:
+            job.sink.close()
+            if job.result is not None:
+                job.result = (job.result[0], None)
+        finished[position.pop(job)] = job
+        while upcoming in finished:
+            job = finished.pop(upcoming)
+            upcoming += 1
+            yield job.host, job.result, job.error
+
+
+def write_output(args, host, status_code, output):
+    """
+    Write the output of a host to the console, or to its own file in the
+    output directory
+    """
+    if status_code != 0:
+        LOG.warn('Commands returned non-zero status code on %s', host)
+    if args.output_dir:
+        filename = os.path.join(args.output_dir, host)
+        if output is not None:
+            with open(filename, 'w') as f:
+                f.write(output)
+        LOG.info('Wrote output of %s to %s', host, filename)
+    elif status_code == 0:
+        sys.stdout.write(output)
+        sys.stdout.flush()
+    else:
+        sys.stderr.write(output)
+        sys.stderr.flush()
+
+
 def main():
     # grab the command line opts
     args = parse_cli()
@@ -302,11 +693,6 @@ def main():
               args.port,
               ', '.join(args.cmds))
 
-    if hasattr(args,'private_key'):
-        cmd_run = args.cmd_run(args.user, passwd, args.port, args.cmds, timeout=args.timeout, private_key=args.private_key)
-    else:
-        cmd_run = args.cmd_run(args.user, passwd, args.port, args.cmds, timeout=args.timeout)
-
     # if no hosts are specified try to get a list from netconfig
     if args.hosts is None:
         try:
@@ -323,27 +709,41 @@ def main():
         good_devices = args.hosts
         num_sw_good = len(good_devices)
 
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
     fails = 0
     failed_hosts = []
 
+    deadline = None
+    if args.deadline:
+        deadline = time.monotonic() + args.deadline
+
+    # one retry policy for the whole run, handed to every runner
+    args.connect_policy = retry.ConnectPolicy()
+
+    hosts = []
     for host in good_devices:
-        try:
-            if args.subset is None or host in args.subset:
-                LOG.info('Running command(s) %s on %s', ', '.join(args.cmds), host)
-                status_code, output = cmd_run.run(host)
-                if status_code == 0:
-                    sys.stdout.write(output)
-                    sys.stdout.flush()
-                else:
-                    LOG.warn('Commands returned non-zero status code')
-                    sys.stderr.write(output)
-                    sys.stderr.flush()
-            else:
-                LOG.warning('Not running command(s) %s on %s since device type does not match', ', '.join(args.cmds), host)
-        except (SSHException, socket.error) as err:
+        if args.subset is None or host in args.subset:
+            hosts.append(host)
+        else:
+            LOG.warning('Not running command(s) %s on %s since device type does not match', ', '.join(args.cmds), host)
+
+    # Hosts run concurrently, but their output is written in the order of the
+    # host list as soon as every host before them has finished
+    if args.multiplex:
+        LOG.info('Running command(s) %s on %d %s, %d at a time', ', '.join(args.cmds), len(hosts), args.dev, args.jobs)
+        outcomes = run_multiplexed(args, passwd, hosts, deadline)
+    else:
+        outcomes = run_threaded(args, passwd, hosts, deadline)
+
+    for host, result, err in outcomes:
+        if err is None:
+            write_output(args, host, *result)
+        else:
             fails +=1
             failed_hosts.append(host)
-            LOG.error('Failure connecting to %s: %s', host, err)
+            LOG.error('Failure running commands on %s: %s', host, err)
             LOG.error('Skipping running command on %s', host)
 
     if fails != 0:
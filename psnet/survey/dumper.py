@@ -3,13 +3,14 @@
 ###!/usr/bin/env python
 import os
 import sys
-import scp
-import utils
+import time
 import pickle
 import logging
 from subprocess import CalledProcessError
 from argparse import ArgumentParser
-from settings import SSH_CONF, LOG_CONF, HOST_IGNORE, CISCO_HOST, ARISTA_HOST, ICX_HOST
+from . import scp
+from . import utils
+from .settings import SSH_CONF, LOG_CONF, HOST_IGNORE, CISCO_HOST, ARISTA_HOST, ICX_HOST
 
 
 LOG = logging.getLogger(LOG_CONF.get('logger_name', __name__))
@@ -40,6 +41,9 @@ def parse_cli():
                         action="store_true",
                         help='Write out a file containing info on failed hosts')
 
+    # Add the options for dumping many switches at once
+    utils.add_parallel_opts(parser)
+
     # Add the default logger options
     utils.add_log_opts(parser)
 
@@ -104,22 +108,43 @@ def main():
     fails = 0
     failed_hosts = []
     failed_hosts_fname = os.path.join(dest_dir, SSH_CONF.get('failed_backup_file'))
-    for host in good_switches:
-        LOG.debug('Attempting to fetch config file for %s', host)
-        # Check the type of switch
-        if host in CISCO_HOST:
-            scp_cmd = cisco_scp_client.get_cisco_cfg
-        elif host in ARISTA_HOST:
-            scp_cmd = arista_scp_client.get_arista_cfg
-        elif host in ICX_HOST:
-            scp_cmd = icx_scp_client.get_icx_cfg
-        else:
-            scp_cmd = scp_client.get_cfg
-        # Run the scp command
-        if scp_cmd(host) != 0:
-            failed_hosts.append(host)
-            fails += 1
-        LOG.debug('----------------------------------------------------------')
+    if opts.jobs > 1:
+        # Fetch from many switches at once, driving the sessions from here
+        def helpers(host):
+            if host in CISCO_HOST:
+                return cisco_scp_client, 'cisco'
+            elif host in ARISTA_HOST:
+                return arista_scp_client, 'arista'
+            elif host in ICX_HOST:
+                return icx_scp_client, 'icx'
+            return scp_client, 'standard'
+
+        deadline = None
+        if opts.deadline:
+            deadline = time.monotonic() + opts.deadline
+        failed = scp.fetch_all(helpers, good_switches, sessions=opts.jobs,
+                               host_timeout=opts.host_timeout,
+                               deadline=deadline)
+        failed_hosts = [host for host in good_switches if host in failed]
+        fails = len(failed_hosts)
+    else:
+        for host in good_switches:
+            LOG.debug('Attempting to fetch config file for %s', host)
+            # Check the type of switch
+            if host in CISCO_HOST:
+                scp_cmd = cisco_scp_client.get_cisco_cfg
+            elif host in ARISTA_HOST:
+                scp_cmd = arista_scp_client.get_arista_cfg
+            elif host in ICX_HOST:
+                scp_cmd = icx_scp_client.get_icx_cfg
+            else:
+                scp_cmd = scp_client.get_cfg
+            # Run the scp command
+            if scp_cmd(host) != 0:
+                failed_hosts.append(host)
+                fails += 1
+            LOG.debug('----------------------------------------------------------')
+
     LOG.info('Successfully retrieved %d of %d switch configs', num_sw_good - fails, num_sw_good)
     
     # Write out list of hosts with failed backups
@@ -0,0 +1,470 @@
+"""
+Drive the sessions to many switches from a single thread.
+
+Logging in is a short blocking exchange, so it runs on a small pool of worker
+threads. Once a host is logged in its channel is handed to a selector, and
+one loop reads every channel as data arrives, feeding the lines to each job.
+At most ``sessions`` hosts are connected at once, which bounds the sockets,
+channels and buffered output regardless of the size of the fleet.
+
+Paramiko still runs one transport thread per open connection underneath;
+the engine only removes the thread per host that would otherwise sit in a
+blocking read.
+"""
+import re
+import time
+import queue
+import socket
+import logging
+import selectors
+import threading
+import collections
+import concurrent.futures
+import paramiko
+from paramiko.ssh_exception import SSHException
+from .settings import LOG_CONF
+
+
+LOG = logging.getLogger(LOG_CONF.get('logger_name', __name__))
+
+_line_re = re.compile('[^\n]*\n')
+
+
+def split_lines(data):
+    """
+    Split the complete lines off the front of the data received from a host,
+    decoding them in one go
+
+    :param data: The bytes received so far
+    :type  data: bytes
+
+    :return: The decoded lines, each with its newline, and the bytes of the
+             partial line left at the end
+    """
+    end = data.rfind(b'\n') + 1
+    if not end:
+        return [], data
+    # A newline byte never falls inside a multibyte character, so the
+    # complete lines always decode on their own
+    return _line_re.findall(data[:end].decode('utf-8')), data[end:]
+
+
+class Job(object):
+    """
+    The conversation with a single host.
+
+    :meth:`.connect` and :meth:`.close` run on a worker thread and may
+    block, everything in between is called from the engine loop and must
+    not. Once the job is finished, ``result`` holds whatever the job
+    produced, or ``error`` the exception that ended it.
+
+    :param host: The name of the host
+    :type  host: str
+    """
+    def __init__(self, host):
+        self.host = host
+        self.done = False
+        self.result = None
+        self.error = None
+        self.deadline = None
+        self.chan = None
+        self._buffer = b''
+        self._lines = collections.deque()
+
+    def connect(self):
+        """
+        Log into the host and return the channel to read from
+        """
+        raise NotImplementedError
+
+    def _open(self):
+        self.chan = self.connect()
+
+    def start(self):
+        """
+        Text to send once the channel is open, or None
+        """
+        return None
+
+    def feed(self, line):
+        """
+        Handle the next line sent by the host, returning any text that
+        should be sent back
+        """
+        raise NotImplementedError
+
+    def receive(self, data):
+        """
+        Split newly received data into lines for :meth:`.feed`, keeping any
+        partial line until the rest arrives. Returns the replies to send
+        """
+        lines, self._buffer = split_lines(self._buffer + data)
+        self._lines.extend(lines)
+        replies = []
+        while self._lines and not self.done:
+            reply = self.feed(self._lines.popleft())
+            if reply:
+                replies.append(reply)
+        return ''.join(replies)
+
+    def eof(self):
+        """
+        The host closed the channel
+        """
+        if not self.done:
+            raise SSHException('Channel to %s closed unexpectedly' % self.host)
+
+    def close(self):
+        """
+        Log out and release the connection
+        """
+        pass
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.host)
+
+
+class ShellJob(Job):
+    """
+    Run commands on an interactive shell opened by a
+    :class:`.command.CommandRunner`, using the same prompt and pager
+    handling as the runner itself
+
+    :param runner: The command runner for this type of switch
+    :type  runner: :class:`.command.CommandRunner`
+
+    :param cmds: The commands to run, by default those of the runner
+    :type  cmds: list
+
+    :param sink: Called with each piece of output as it arrives instead of
+                 collecting the output in ``result``
+    :type  sink: callable
+    """
+    def __init__(self, host, runner, cmds=None, sink=None):
+        super(ShellJob, self).__init__(host)
+        self.runner = runner
+        self.sink = sink
+        self.cmds = collections.deque(runner._fix_cmds(runner.cmds if cmds is None else cmds))
+        self.exchange = None
+        self.output = []
+
+    def connect(self):
+        # Connect retries, login and the session setup count towards the
+        # deadline of the job too
+        self.runner.deadline = self.deadline
+        self.runner.open(self.host)
+        # Anything read past the end of the login belongs to us now
+        self._buffer, self.runner._rbuf = self.runner._rbuf, b''
+        self._lines, self.runner._lines = self.runner._lines, collections.deque()
+        return self.runner.chan
+
+    def start(self):
+        return self._next()
+
+    def _next(self):
+        if self.exchange is not None:
+            if self.exchange.mode:
+                self.runner.mode = self.exchange.mode
+            if self.sink is None:
+                self.output.append(self.exchange.output)
+        if not self.cmds:
+            self.done = True
+            self.result = (0, ''.join(self.output))
+            return None
+        self.exchange = self.runner.exchange(self.cmds.popleft(), sink=self.sink)
+        return self.exchange.request()
+
+    def feed(self, line):
+        reply = self.exchange.feed(line)
+        if self.exchange.done:
+            return self._next()
+        return reply
+
+    def close(self):
+        self.runner._rbuf, self._buffer = self._buffer, b''
+        self.runner._lines, self._lines = self._lines, collections.deque()
+        if self.error is not None:
+            # No point in logging out politely from a broken session
+            self.runner.ssh.close()
+            self.runner.chan = None
+        else:
+            self.runner.deadline = self.deadline
+            self.runner.close()
+
+
+class ExecJob(Job):
+    """
+    Run a single command through an SSH exec channel and read its output
+    until the host closes the channel
+
+    :param connect_kwargs: Keyword arguments for ``SSHClient.connect``
+    :type  connect_kwargs: dict
+
+    :param cmd: The command to run
+    :type  cmd: str
+
+    :param stdin: Text written to the command once it has started
+    :type  stdin: str
+    """
+    def __init__(self, host, connect_kwargs, cmd, stdin=None):
+        super(ExecJob, self).__init__(host)
+        self.connect_kwargs = connect_kwargs
+        self.cmd = cmd
+        self.stdin = stdin
+        self.ssh = None
+        self.lines = []
+
+    def connect(self):
+        self.ssh = paramiko.SSHClient()
+        self.ssh.load_system_host_keys()
+        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.ssh.connect(self.host, **self.connect_kwargs)
+        chan = self.ssh.get_transport().open_session()
+        chan.exec_command(self.cmd)
+        return chan
+
+    def start(self):
+        return self.stdin
+
+    def feed(self, line):
+        self.lines.append(line)
+
+    def eof(self):
+        if self._buffer:
+            self.feed(self._buffer.decode('utf-8'))
+            self._buffer = b''
+        if not self.done:
+            self.done = True
+            self.result = (self.chan.recv_exit_status(), ''.join(self.lines))
+
+    def close(self):
+        if self.ssh is not None:
+            self.ssh.close()
+
+
+class CallJob(Job):
+    """
+    Run a blocking function on a worker thread, for hosts whose protocol
+    has not been written as a job. It still counts towards the session limit
+
+    :param func: Called with the host name, its return value is the result
+    :type  func: callable
+
+    :param runner: Object whose deadline is set to that of the job before
+                   func is called, so that the call stops on time rather than
+                   leaving a worker blocked on a dead host
+    """
+    def __init__(self, host, func, runner=None):
+        super(CallJob, self).__init__(host)
+        self.func = func
+        self.runner = runner
+
+    def connect(self):
+        if self.runner is not None:
+            self.runner.deadline = self.deadline
+        result = self.func(self.host)
+        # The engine may have given up on the call in the meantime
+        if self.error is None:
+            self.result = result
+            self.done = True
+
+
+class Engine(object):
+    """
+    Run jobs on many hosts at once from the calling thread.
+
+    :param sessions: Most hosts connected at the same time
+    :type  sessions: int
+
+    :param workers: Threads used to log in and out of hosts
+    :type  workers: int
+
+    :param cmd_timeout: Seconds a host may stay silent before its job fails
+    :type  cmd_timeout: float
+
+    :param host_timeout: Seconds a single job may take in total
+    :type  host_timeout: float
+
+    :param deadline: time.monotonic() by which every job must finish
+    :type  deadline: float
+    """
+    recv_buf = 65536
+
+    def __init__(self, sessions=64, workers=8, cmd_timeout=60.,
+                 host_timeout=None, deadline=None):
+        self.sessions = max(sessions, 1)
+        self.workers = max(min(workers, self.sessions), 1)
+        self.cmd_timeout = cmd_timeout
+        self.host_timeout = host_timeout
+        self.deadline = deadline
+
+    def run(self, jobs):
+        """
+        Run the jobs, yielding each one as it finishes. Jobs are started in
+        the order given
+        """
+        pending = collections.deque(jobs)
+        finished = queue.Queue()
+        selector = selectors.DefaultSelector()
+        wake_r, wake_w = socket.socketpair()
+        wake_r.setblocking(False)
+        selector.register(wake_r, selectors.EVENT_READ)
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        # time.monotonic() after which each streaming job is abandoned
+        expires = {}
+        # The same for jobs still connecting on a worker, those given up on
+        # are closed by their worker once the connect returns
+        connecting = {}
+        abandoned = set()
+        settled = set()
+        lock = threading.Lock()
+        registered = set()
+        in_flight = 0
+
+        def open_job(job):
+            try:
+                job._open()
+            finally:
+                with lock:
+                    settled.add(job)
+                    late = job in abandoned
+                if late:
+                    try:
+                        job.close()
+                    except Exception as err:
+                        LOG.debug('Error closing session to %s: %s', job.host, err)
+
+        def submit(job, func, stage):
+            def notify(future):
+                finished.put((job, stage, future.exception()))
+                try:
+                    wake_w.send(b'\0')
+                except OSError:
+                    # The run was abandoned by the caller
+                    pass
+            pool.submit(func).add_done_callback(notify)
+
+        def stop(job, error=None):
+            if job.chan is not None and job.chan in registered:
+                selector.unregister(job.chan)
+                registered.discard(job.chan)
+            expires.pop(job, None)
+            if error is not None and job.error is None:
+                job.error = error
+            submit(job, job.close, 'close')
+
+        try:
+            while pending or in_flight:
+                while pending and in_flight < self.sessions:
+                    job = pending.popleft()
+                    now = time.monotonic()
+                    if self.host_timeout:
+                        job.deadline = now + self.host_timeout
+                    if self.deadline is not None:
+                        job.deadline = self.deadline if job.deadline is None \
+                                       else min(job.deadline, self.deadline)
+                    if job.deadline is not None and job.deadline <= now:
+                        job.error = socket.timeout('Deadline passed before reaching %s' % job.host)
+                        yield job
+                        continue
+                    in_flight += 1
+                    if job.deadline is not None:
+                        connecting[job] = job.deadline
+                    submit(job, lambda job=job: open_job(job), 'connect')
+
+                timeout = None
+                if expires or connecting:
+                    timeout = max(min(list(expires.values()) + list(connecting.values()))
+                                  - time.monotonic(), 0)
+
+                for key, events in selector.select(timeout):
+                    if key.fileobj is wake_r:
+                        try:
+                            while wake_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    else:
+                        self._read(key.data, stop, expires)
+
+                now = time.monotonic()
+                for job in [job for job, when in expires.items() if when <= now]:
+                    LOG.debug('Timed out waiting for %s', job.host)
+                    stop(job, socket.timeout('Timed out waiting for a response from %s' % job.host))
+
+                for job in [job for job, when in connecting.items() if when <= now]:
+                    del connecting[job]
+                    with lock:
+                        if job in settled:
+                            # Its connect finished, the result is queued
+                            continue
+                        abandoned.add(job)
+                    LOG.debug('Timed out connecting to %s', job.host)
+                    job.error = socket.timeout('Timed out connecting to %s' % job.host)
+                    in_flight -= 1
+                    yield job
+
+                while not finished.empty():
+                    job, stage, error = finished.get()
+                    if stage == 'connect':
+                        connecting.pop(job, None)
+                        if job in abandoned:
+                            # Already reported, its worker closes it
+                            continue
+                        if error is not None or job.done:
+                            stop(job, error)
+                        else:
+                            selector.register(job.chan, selectors.EVENT_READ, job)
+                            registered.add(job.chan)
+                            self._begin(job, stop, expires)
+                    else:
+                        if error is not None:
+                            LOG.debug('Error closing session to %s: %s', job.host, error)
+                        in_flight -= 1
+                        yield job
+        finally:
+            pool.shutdown(wait=False)
+            selector.close()
+            wake_r.close()
+            wake_w.close()
+
+    def _begin(self, job, stop, expires):
+        # Send the opening request, then handle anything the host sent
+        # before the channel was handed over
+        try:
+            request = job.start()
+            if request:
+                job.chan.send(request)
+            reply = job.receive(b'')
+            if reply:
+                job.chan.send(reply)
+        except (SSHException, socket.error, UnicodeDecodeError) as err:
+            stop(job, err)
+            return
+        if job.done:
+            stop(job)
+        else:
+            expires[job] = self._expiry(job)
+
+    def _read(self, job, stop, expires):
+        try:
+            data = job.chan.recv(self.recv_buf)
+            if data:
+                reply = job.receive(data)
+                if reply:
+                    job.chan.send(reply)
+            else:
+                job.eof()
+        except (SSHException, socket.error, UnicodeDecodeError) as err:
+            stop(job, err)
+            return
+        if job.done:
+            stop(job)
+        else:
+            expires[job] = self._expiry(job)
+
+    def _expiry(self, job):
+        expiry = time.monotonic() + self.cmd_timeout
+        if job.deadline is not None:
+            expiry = min(expiry, job.deadline)
+        return expiry
@@ -0,0 +1,185 @@
+"""
+Retrying of SSH connections to switches.
+
+A :class:`.ConnectPolicy` retries a failed connection with exponential
+backoff and full jitter, so that many clients retrying at once spread out
+instead of hammering a switch that is already struggling. It also keeps a
+circuit breaker for each host: once breaker_failures connections to a host
+have failed in a row it is skipped without connecting for breaker_cooldown
+seconds. A connection counts as failed once all of its retries are used
+up. After the cooldown a connection is let through again, success closes
+the breaker and a single failure reopens it.
+
+A host that cannot be reached raises :class:`.ConnectError`, which carries
+the host, the number of attempts made and the last error.
+"""
+import time
+import random
+import socket
+import logging
+import threading
+from paramiko.ssh_exception import SSHException, AuthenticationException
+from .settings import LOG_CONF, RETRY_CONF
+
+
+LOG = logging.getLogger(LOG_CONF.get('logger_name', __name__))
+
+
+class ConnectError(SSHException):
+    """
+    A host could not be connected to
+
+    :param host: The name of the host
+    :type  host: str
+
+    :param attempts: The number of connections attempted
+    :type  attempts: int
+
+    :param error: The exception raised by the last attempt
+    :type  error: Exception
+    """
+    def __init__(self, host, attempts, error=None):
+        super(ConnectError, self).__init__(host, attempts, error)
+        self.host = host
+        self.attempts = attempts
+        self.error = error
+
+    def __str__(self):
+        return 'Unable to connect to %s after %d attempt(s): %s' % (self.host, self.attempts, self.error)
+
+
+class CircuitOpen(ConnectError):
+    """
+    A host was skipped without connecting because its recent connections
+    failed
+
+    :param retry_at: time.monotonic() after which the host is tried again
+    :type  retry_at: float
+    """
+    def __init__(self, host, retry_at):
+        super(CircuitOpen, self).__init__(host, 0)
+        self.retry_at = retry_at
+
+    def __str__(self):
+        return 'Skipped %s after repeated connection failures, retrying in %.0fs' % (self.host, max(self.retry_at - time.monotonic(), 0))
+
+
+class ConnectPolicy(object):
+    """
+    How often and how patiently to retry connections, shared by every
+    connection that should count towards the same circuit breakers.
+    Unspecified settings are taken from RETRY_CONF
+
+    :param attempts: Connection attempts before giving up on a host
+    :type  attempts: int
+
+    :param backoff: Seconds before the first retry, doubling with each retry
+    :type  backoff: float
+
+    :param max_backoff: Longest wait between two attempts
+    :type  max_backoff: float
+
+    :param breaker_failures: Consecutive failed connections, each after all
+                             its attempts, after which a host is skipped, 0
+                             to never skip hosts
+    :type  breaker_failures: int
+
+    :param breaker_cooldown: Seconds a failing host is skipped for
+    :type  breaker_cooldown: float
+    """
+    def __init__(self, attempts=None, backoff=None, max_backoff=None,
+                 breaker_failures=None, breaker_cooldown=None):
+        def conf(value, key, default):
+            return RETRY_CONF.get(key, default) if value is None else value
+        self.attempts = max(conf(attempts, 'attempts', 5), 1)
+        self.backoff = conf(backoff, 'backoff', 0.5)
+        self.max_backoff = conf(max_backoff, 'max_backoff', 8.0)
+        self.breaker_failures = conf(breaker_failures, 'breaker_failures', 3)
+        self.breaker_cooldown = conf(breaker_cooldown, 'breaker_cooldown', 60.0)
+        # host -> (consecutive failures, time.monotonic() it is skipped until)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def delay(self, retry):
+        """
+        Seconds to wait before a retry, counting from 0 for the first one
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def check(self, host):
+        """
+        Raise :class:`.CircuitOpen` if the host is currently being skipped
+        """
+        with self._lock:
+            failures, retry_at = self._hosts.get(host, (0, None))
+        if retry_at is not None and time.monotonic() < retry_at:
+            raise CircuitOpen(host, retry_at)
+
+    def succeeded(self, host):
+        """
+        Record a successful connection, closing the breaker of the host
+        """
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failed(self, host):
+        """
+        Record a connection that failed after all of its attempts, returning
+        whether the breaker of the host is now open
+        """
+        with self._lock:
+            failures = self._hosts.get(host, (0, None))[0] + 1
+            retry_at = None
+            if self.breaker_failures and failures >= self.breaker_failures:
+                retry_at = time.monotonic() + self.breaker_cooldown
+            self._hosts[host] = (failures, retry_at)
+        if retry_at is not None:
+            LOG.warning('Skipping %s for %.0fs after %d failed connections', host, self.breaker_cooldown, failures)
+        return retry_at is not None
+
+    def reset(self, host=None):
+        """
+        Forget the failures of a host, or of every host
+        """
+        with self._lock:
+            if host is None:
+                self._hosts.clear()
+            else:
+                self._hosts.pop(host, None)
+
+    def connect(self, host, connect, deadline=None):
+        """
+        Make a connection, retrying after failures
+
+        :param connect: Called with no arguments to make each attempt, its
+                        return value is returned
+        :type  connect: callable
+
+        :param deadline: time.monotonic() after which no retry is started
+        :type  deadline: float
+
+        :raises: :class:`.CircuitOpen` if the host is being skipped, or
+                 :class:`.ConnectError` once the retries are exhausted
+        """
+        self.check(host)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = connect()
+            except AuthenticationException as err:
+                # The switch is up, and retrying a bad password only risks
+                # locking the account
+                raise ConnectError(host, attempt, err)
+            except (SSHException, socket.error, EOFError) as err:
+                LOG.debug('Connection %d to %s failed: %s', attempt, host, err)
+                wait = self.delay(attempt - 1)
+                if attempt >= self.attempts or \
+                   (deadline is not None and time.monotonic() + wait >= deadline):
+                    self.failed(host)
+                    raise ConnectError(host, attempt, err)
+                LOG.info('SSH connect to %s failed, retrying in %.1fs', host, wait)
+                time.sleep(wait)
+            else:
+                self.succeeded(host)
+                return result
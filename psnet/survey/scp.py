@@ -1,5 +1,6 @@
 import re
 import os
+import copy
 import stat
 import time
 import socket
@@ -8,7 +9,8 @@ import logging
 import tempfile
 import paramiko
 from paramiko.ssh_exception import SSHException
-from settings import LOG_CONF
+from . import engine
+from .settings import LOG_CONF
 
 
 LOG = logging.getLogger(LOG_CONF.get('logger_name', __name__))
@@ -56,6 +58,29 @@ class SCPHelper(object):
         self.ssh.load_system_host_keys()
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
+    def job(self, host, kind='standard'):
+        """
+        Create a job that fetches the configuration of a host when run by an
+        :class:`.engine.Engine`. The result of the job is 0 on success, like
+        the get_*_cfg methods
+
+        :param kind: The type of switch, one of standard, arista, cisco or icx
+        :type  kind: str
+        """
+        if kind == 'standard':
+            return ScpConfigJob(self, host)
+        elif kind == 'arista':
+            return AristaConfigJob(self, host)
+        # The interactive fetches run whole on a worker thread, with their own
+        # connection
+        helper = copy.copy(self)
+        helper._config()
+        if kind == 'cisco':
+            return engine.CallJob(host, helper.get_cisco_cfg)
+        elif kind == 'icx':
+            return engine.CallJob(host, helper.get_icx_cfg)
+        raise ValueError('Unknown switch type %s' % kind)
+
     def get_arista_cfg(self, host):
         # Temporary file for writing the config to
         LOG.info('Getting configuration %-8s : %s' % ('ARISTA', host))
@@ -328,3 +353,162 @@ class SCPHelper(object):
             self.ssh.close()
             if temp_path is not None and os.path.exists(temp_path):
                 os.remove(temp_path)
+
+
+class ConfigJob(engine.ExecJob):
+    """
+    Fetch a configuration through an exec channel, writing it to a temporary
+    file as it arrives and copying it into place once the switch closes the
+    channel
+
+    :param helper: The helper holding the connection settings and destination
+    :type  helper: :class:`.SCPHelper`
+    """
+    def __init__(self, helper, host, cmd, stdin=None):
+        connect_kwargs = dict(helper.connect_kwargs, port=helper.port,
+                              username=helper.user, password=helper.pw)
+        super(ConfigJob, self).__init__(host, connect_kwargs, cmd, stdin)
+        self.helper = helper
+        self.outf = None
+        self.temp_path = None
+
+    def header(self, line):
+        """
+        Check the first line of output, returning False to abandon the fetch
+        """
+        return True
+
+    def write(self, line):
+        self.outf.write(line)
+
+    def feed(self, line):
+        if self.outf is None:
+            if not self.header(line):
+                LOG.error('Skipping file transfer for %s', self.host)
+                self.done = True
+                self.result = 1
+                return None
+            self.outf = tempfile.NamedTemporaryFile('w', delete=False)
+            self.temp_path = self.outf.name
+            LOG.debug('Transfering configuration file to %s', self.temp_path)
+            return None
+        self.write(line)
+        return None
+
+    def eof(self):
+        if self._buffer:
+            self.feed(self._buffer.decode('utf-8'))
+            self._buffer = b''
+        if self.done:
+            return
+        self.done = True
+        self.result = 1
+        if self.outf is None:
+            LOG.error('No configuration received from %s', self.host)
+            return
+        dest = os.path.join(self.helper.dest_dir, self.helper.dest_file%self.host)
+        try:
+            self.outf.close()
+            # If we got here its safe to overwrite the cfg with the temp one
+            shutil.copy(self.temp_path, dest)
+            os.chmod(dest, self.helper.cfg_perms)
+            self.result = 0
+        except IOError as io_err:
+            LOG.error('Failure writting %s config to disk: %s', self.host, io_err)
+            LOG.error('Skipping file transfer for %s', self.host)
+
+    def close(self):
+        try:
+            super(ConfigJob, self).close()
+        finally:
+            if self.outf is not None:
+                self.outf.close()
+            if self.temp_path is not None and os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+
+class ScpConfigJob(ConfigJob):
+    """
+    Fetch a configuration with ``scp -f``, like :meth:`.SCPHelper.get_cfg`
+    """
+    def __init__(self, helper, host):
+        # Write a newline to stdin to start the switches dump
+        super(ScpConfigJob, self).__init__(helper, host, helper.cmd, stdin='\n')
+        self.ended = False
+
+    def header(self, line):
+        # first line of stdout should be the scp protocol message:
+        # Cmmmm <length> <filename> where mmmm is the file mode
+        if self.helper.prot_re.match(line):
+            LOG.debug('Successful scp connection to %s', self.host)
+            return True
+        LOG.error('Invalid scp protocol msg: %s', line)
+        return False
+
+    def write(self, line):
+        # The scp data is null terminated, so we can stop there
+        if line == '\0':
+            self.ended = True
+        if not self.ended:
+            self.outf.write(line)
+
+
+class AristaConfigJob(ConfigJob):
+    """
+    Fetch a configuration with ``show``, like
+    :meth:`.SCPHelper.get_arista_cfg`
+    """
+    def __init__(self, helper, host):
+        super(AristaConfigJob, self).__init__(helper, host, '%s\n'%helper.arista_cmd)
+        self.first = True
+
+    def header(self, line):
+        # Should return a header of the form:
+        # ! Command: <cmd>
+        if self.helper.arista_re.match(line):
+            return True
+        LOG.error('Problem running command \'%s\': %s', self.helper.arista_cmd, line)
+        return False
+
+    def write(self, line):
+        # Check if there is leading modified time line otherwise write it to config
+        if self.first:
+            self.first = False
+            mod_time_match = self.helper.arista_modtime_re.match(line)
+            if mod_time_match:
+                LOG.debug('Config last modified on %s', mod_time_match.group('date'))
+                return
+        self.outf.write(line)
+
+
+def fetch_all(helpers, hosts, sessions=16, host_timeout=None, deadline=None):
+    """
+    Fetch the configurations of many switches at once with an
+    :class:`.engine.Engine`
+
+    :param helpers: Callable returning the helper and type of switch to use for
+                    a host, the type being one of those of
+                    :meth:`.SCPHelper.job`
+    :type  helpers: callable
+
+    :param sessions: The most switches connected at the same time
+    :type  sessions: int
+
+    :return: The hosts whose configuration could not be fetched
+    :rtype: set
+    """
+    jobs = []
+    for host in hosts:
+        helper, kind = helpers(host)
+        jobs.append(helper.job(host, kind))
+
+    failed = set()
+    mux = engine.Engine(sessions=sessions, host_timeout=host_timeout,
+                        deadline=deadline)
+    for job in mux.run(jobs):
+        if job.error is not None:
+            LOG.error('Failure connecting to %s: %s', job.host, job.error)
+            LOG.error('Skipping file transfer for %s', job.host)
+        if job.error is not None or job.result != 0:
+            failed.add(job.host)
+    return failed
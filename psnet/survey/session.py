@@ -0,0 +1,153 @@
+"""
+Pool of logged in switch shells, so that repeated commands to the same
+switch skip the SSH handshake and login
+"""
+import time
+import socket
+import logging
+import threading
+import contextlib
+from paramiko.ssh_exception import SSHException
+from . import retry
+from .settings import LOG_CONF
+
+
+LOG = logging.getLogger(LOG_CONF.get('logger_name', __name__))
+
+
+class SessionPool(object):
+    """
+    Keep interactive shells open between commands.
+
+    A shell is checked out for the duration of a ``with`` block and returned
+    to the pool afterwards. Shells that sit unused for longer than
+    idle_timeout seconds are logged out, and a shell that has been idle for
+    more than check_after seconds is probed with an empty command before it
+    is handed out again. A shell that raises an error while checked out is
+    discarded, the next request logs in afresh.
+
+    :param idle_timeout: Seconds before an unused shell is closed
+    :type  idle_timeout: float
+
+    :param check_after: Seconds of idleness after which a shell is probed
+                        before reuse
+    :type  check_after: float
+
+    :param connect_policy: Retries and circuit breakers shared by every
+                           shell the pool opens, by default a new
+                           :class:`.retry.ConnectPolicy`
+    :type  connect_policy: :class:`.retry.ConnectPolicy`
+    """
+    def __init__(self, idle_timeout=300., check_after=60., connect_policy=None):
+        self.idle_timeout = idle_timeout
+        self.check_after  = check_after
+        self.connect_policy = connect_policy or retry.ConnectPolicy()
+        # Number of logins made, the rest of the requests reused a shell
+        self.handshakes   = 0
+        self._idle  = {}
+        self._lock  = threading.Lock()
+        self._timer = None
+
+    @contextlib.contextmanager
+    def session(self, runner_class, host, user, pw, enablepw=None, port=22,
+                timeout=None):
+        """
+        Check out a logged in :class:`.command.CommandRunner` for the host,
+        opening a new one if there is no healthy shell in the pool
+        """
+        key    = (runner_class, host, user, port)
+        runner = self._checkout(key)
+        if runner is None:
+            runner = runner_class(user, pw, enablepw, port, [],
+                                  timeout=timeout)
+            runner.connect_policy = self.connect_policy
+            LOG.debug('Opening a new session to %s', host)
+            runner.open(host)
+            with self._lock:
+                self.handshakes += 1
+        elif enablepw:
+            runner.enablepw = enablepw
+        try:
+            yield runner
+        except:
+            LOG.debug('Discarding session to %s after an error', host)
+            self._discard(runner)
+            raise
+        self._checkin(key, runner)
+
+    def _checkout(self, key):
+        with self._lock:
+            runner, last_used = self._idle.pop(key, (None, None))
+        if runner is None:
+            return None
+
+        idle = time.monotonic() - last_used
+        if idle > self.idle_timeout or not runner.alive():
+            self._discard(runner)
+            return None
+        if idle > self.check_after:
+            try:
+                runner.exec_cmd('', False)
+            except (SSHException, socket.error) as err:
+                LOG.debug('Session to %s failed its health check: %s',
+                          runner.host, err)
+                self._discard(runner)
+                return None
+        return runner
+
+    def _checkin(self, key, runner):
+        with self._lock:
+            spare = key in self._idle
+            if not spare:
+                self._idle[key] = (runner, time.monotonic())
+                if self._timer is None:
+                    self._schedule(self.idle_timeout)
+        if spare:
+            # Another thread returned a shell for the same switch first
+            self._discard(runner)
+
+    def _schedule(self, delay):
+        # Called with the lock held
+        self._timer = threading.Timer(delay, self.expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _discard(self, runner):
+        try:
+            runner.close()
+        except (SSHException, socket.error) as err:
+            LOG.debug('Error closing session to %s: %s', runner.host, err)
+
+    def expire(self):
+        """
+        Close the shells that have been idle for longer than idle_timeout
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._timer = None
+            expired = [key for key, (runner, last_used) in self._idle.items()
+                       if now - last_used >= self.idle_timeout]
+            runners = [self._idle.pop(key)[0] for key in expired]
+            if self._idle:
+                oldest = min(last_used for runner, last_used
+                             in self._idle.values())
+                self._schedule(oldest + self.idle_timeout - now)
+        for runner in runners:
+            LOG.debug('Closing idle session to %s', runner.host)
+            self._discard(runner)
+
+    def close(self):
+        """
+        Close every shell in the pool
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            runners = [runner for runner, last_used in self._idle.values()]
+            self._idle.clear()
+        for runner in runners:
+            self._discard(runner)
+
+    def __len__(self):
+        return len(self._idle)
@@ -31,6 +31,16 @@ SSH_CONF = {
     'failed_backup_file'     : 'failed_backups.pkl',
 }
 
+# Retrying of failed SSH connections, see retry.ConnectPolicy
+RETRY_CONF = {
+    'attempts'         : 5,    # connection attempts before giving up on a host
+    'backoff'          : 0.5,  # seconds before the first retry, doubled each time
+    'max_backoff'      : 8.0,  # longest wait between two attempts
+    'breaker_failures' : 3,    # failed connections in a row, each after all its
+                               # attempts, before a host is skipped
+    'breaker_cooldown' : 60.0, # seconds a failing host is skipped for
+}
+
 # Telnet setting for connection to digis
 TELNET_CONF = {
     'username'          : 'root',
@@ -1,5 +1,7 @@
 import re
+import json
 import logging
+import contextlib
 
 from . import command
 from . import utils
@@ -12,16 +14,53 @@ class Surveyer(object):
     _port_format = None
     _cmd_runner  = None
     
-    def __init__(self,user,pw,enablepw,port=None,timeout=None):
+    def __init__(self,user,pw,enablepw,port=None,timeout=None,pool=None):
         self.user    = user
         self.pw      = pw
         self.enablepw= enablepw
         self.port    = port
         self.timeout = timeout
+        self.pool    = pool
         self._vlan_cmd = ['show vlan']
         self._mac_cmd  = ['show mac-address']
+        self._interface_cmd = ['show interfaces brief']
         self._vlan_formatter = None
 
+    @contextlib.contextmanager
+    def session(self,host):
+        """
+        A logged in command runner for the host, taken from the session pool
+        if there is one, otherwise opened and closed around the block
+
+        host (str)    - Name of host
+        """
+        if self.pool is not None:
+            with self.pool.session(self._cmd_runner,host,self.user,self.pw,
+                                   enablepw=self.enablepw,port=self.port,
+                                   timeout=self.timeout) as cmdr:
+                yield cmdr
+        else:
+            cmdr = self._cmd_runner(self.user,self.pw,self.enablepw,self.port,
+                                    [],timeout=self.timeout)
+            cmdr.open(host)
+            try:
+                yield cmdr
+            finally:
+                cmdr.close()
+
+    def run(self,host,cmds,priv=False):
+        """
+        Run a list of commands on the switch and return the output
+
+        host (str)    - Name of host
+        cmds (list)   - Commands to run
+        priv (bool)   - Enter privileged mode before running the commands
+        """
+        with self.session(host) as cmdr:
+            if priv:
+                cmdr.enable(self.enablepw)
+            return cmdr.execute(cmds)
+
     def show_vlan(self,host,vlan_no=None):
         """
         Create a dictionary of each VLAN with untagged ports. If a specific
@@ -30,16 +69,23 @@ class Surveyer(object):
         host (str)    - Name of host
         vlan_no (str) - Number of vlan to be observed.
         """
-        vlan_info = {}
-        cmd  = self._vlan_cmd
-        
+        return self.parse_vlan(self.run(host,self._vlan_query(vlan_no)))
+
+    def _vlan_query(self,vlan_no=None):
+        """
+        The commands that list the ports of each VLAN, or of a single VLAN
+        """
+        cmd  = list(self._vlan_cmd)
         if vlan_no:
             cmd[0] = '{:} {:}'.format(cmd[0].rstrip('\n'),vlan_no) 
-        
-        cmdr  = self._cmd_runner(self.user,self.pw,self.enablepw,self.port,
-                                    cmd,timeout=self.timeout)
-        #Parse output
-        out_code,raw_vlan = cmdr.run(host)
+        return cmd
+
+    def parse_vlan(self,raw_vlan):
+        """
+        Create a dictionary of each VLAN with untagged ports from the output
+        of the VLAN command
+        """
+        vlan_info = {}
         if self._vlan_formatter is not None:
             raw_vlan = self._vlan_formatter(raw_vlan)
         vlan = self._vlan_format.findall(raw_vlan)
@@ -53,24 +99,53 @@ class Surveyer(object):
         """
         Create a dictionary of MAC addresses found on each port.
         """
-        mac_info = {}
-        cmd      = self._mac_cmd
-        if vlan_no:
-            cmd[0] = '{:} vlan {:}'.format(cmd[0].rstrip('\n'),vlan_no) 
-        
-        cmdr     = self._cmd_runner(self.user,
-                                    self.pw,
-                                    self.enablepw,
-                                    self.port,
-                                    cmd,timeout=self.timeout)
-        out_code,raw_mac = cmdr.run(host)
+        raw_mac = self.run(host,self._mac_query(vlan_no))
         with open("am", "w") as f:
             f.write(raw_mac)
 
-        #Parse output
+        return self.parse_mac(raw_mac)
+
+    def _mac_query(self,vlan_no=None):
+        """
+        The commands that list the MAC addresses learned on each port, or on
+        the ports of a single VLAN
+        """
+        cmd      = list(self._mac_cmd)
+        if vlan_no:
+            cmd[0] = '{:} vlan {:}'.format(cmd[0].rstrip('\n'),vlan_no) 
+        return cmd
+
+    def parse_mac(self,raw_mac):
+        """
+        Create a dictionary of MAC addresses found on each port from the
+        output of the MAC address command
+        """
         mac = self._mac_format.findall(raw_mac) 
         return dict([(j,utils.convert_eth(i)) for i,j in mac])
 
+    def survey(self,host,interfaces=False):
+        """
+        Query the VLAN and MAC address tables, and optionally the interface
+        status, back to back over a single session
+
+        host (str)        - Name of host
+        interfaces (bool) - Also return the interface status output
+
+        Returns a dictionary with the ``vlan`` and ``mac`` dictionaries, as
+        show_vlan and show_mac would, the privilege ``mode`` of the prompt,
+        and the raw ``interfaces`` output if requested
+        """
+        with self.session(host) as cmdr:
+            raw_vlan = cmdr.execute(self._vlan_query())
+            raw_mac  = cmdr.execute(self._mac_query())
+            info = {'mode':cmdr.mode}
+            if interfaces:
+                info['interfaces'] = cmdr.execute(self._interface_cmd)
+
+        info['vlan'] = self.parse_vlan(raw_vlan)
+        info['mac']  = self.parse_mac(raw_mac)
+        return info
+
     # Let's claim no one needs an enable command by default!
     def check_mode(self, host):
         return False
@@ -82,11 +157,11 @@ class BrocadeSurveyer(Surveyer):
     _mac_format  = re.compile(r'([\S]{14})[\s]+?([\S]+)[\s]+?Dynamic')  
     _cmd_runner  = command.BrocadeCommandRunner 
     
-    def __init__(self,user,pw,enablepw,port=22,timeout=None):
+    def __init__(self,user,pw,enablepw,port=22,timeout=None,pool=None):
         super(BrocadeSurveyer,self).__init__(user,pw,enablepw,port=port,
-                                             timeout=timeout)
+                                             timeout=timeout,pool=pool)
    
-    def show_vlan(self,host,vlan_no=None):
+    def parse_vlan(self,raw_vlan):
         ''' Python 2.7 :  for vlan,port_info in vlan_info.iteritems(): '''
         ''' Python 3.5 :  for vlan,port_info in vlan_info.items():     '''
         """
@@ -95,7 +170,7 @@ class BrocadeSurveyer(Surveyer):
         An extra complication is added because of the way the ports are
         displayed by the Brocade.
         """
-        vlan_info = super(BrocadeSurveyer,self).show_vlan(host,vlan_no=vlan_no)
+        vlan_info = super(BrocadeSurveyer,self).parse_vlan(raw_vlan)
         #for vlan,port_info in vlan_info.iteritems():
         for vlan,port_info in vlan_info.items():
             full_ports = []
@@ -115,11 +190,11 @@ class RuckusSurveyer(Surveyer):
     _mac_format  = re.compile(r'([\S]{14})[\s]+?([\S]+)[\s]+?Dynamic')  
     _cmd_runner  = command.RuckusCommandRunner 
 
-    def __init__(self,user,pw,enablepw,port=22,timeout=None):
+    def __init__(self,user,pw,enablepw,port=22,timeout=None,pool=None):
         super(RuckusSurveyer,self).__init__(user,pw,enablepw,port=port,
-                                           timeout=timeout)
+                                           timeout=timeout,pool=pool)
     
-    def show_vlan(self,host,vlan_no=None):
+    def parse_vlan(self,raw_vlan):
         ''' Python 2.7 :  for vlan,port_info in vlan_info.iteritems(): '''
         ''' Python 3.5 :  for vlan,port_info in vlan_info.items():     '''
         """
@@ -128,7 +203,7 @@ class RuckusSurveyer(Surveyer):
         An extra complication is added because of the way the ports are
         displayed by the Brocade.
         """
-        vlan_info = super(RuckusSurveyer,self).show_vlan(host,vlan_no=vlan_no)
+        vlan_info = super(RuckusSurveyer,self).parse_vlan(raw_vlan)
         #for vlan,port_info in vlan_info.iteritems():
         for vlan,port_info in vlan_info.items():
             full_ports = []
@@ -142,10 +217,10 @@ class RuckusSurveyer(Surveyer):
 
     # Return True if we need to enable!
     def check_mode(self, host):
-        cmdr  = self._cmd_runner(self.user,self.pw,self.enablepw,self.port,
-                                 ["show clock"],timeout=self.timeout)
-        cmdr.run(host)
-        return cmdr.mode == '>'
+        with self.session(host) as cmdr:
+            if not cmdr.mode:
+                cmdr.exec_cmd('show clock')
+            return cmdr.mode == '>'
         
 
 class CiscoSurveyer(Surveyer):
@@ -155,35 +230,103 @@ class CiscoSurveyer(Surveyer):
     _mac_format  = re.compile(r' [\d]{3}[\s]+?(\S+)[\s]+?DYNAMIC[\s]+(.+)')
     _cmd_runner  = command.CiscoCommandRunner 
 
-    def __init__(self,user,pw,enablepw,port=22,timeout=None):
+    def __init__(self,user,pw,enablepw,port=22,timeout=None,pool=None):
         super(CiscoSurveyer,self).__init__(user,pw,enablepw,port=port,
-                                           timeout=timeout)
+                                           timeout=timeout,pool=pool)
+        self._interface_cmd = ['show interfaces status']
 
 
 class AristaSurveyer(Surveyer):
+    """
+    Surveyer for Arista switches.
 
+    The text tables are parsed by default. Set use_json to True to ask EOS
+    for its tables as JSON instead, which is decoded straight into the VLAN
+    and MAC dictionaries without depending on the text layout, on releases
+    that support it. benchmarks/bench_arista.py compares the two
+    """
     _vlan_format = re.compile(r'([\d]+).*active(.*)')
-    _port_format = re.compile(r'(Et[\d]{1,2})')
+    # Modular and breakout ports keep their full name, Et49/1
+    _port_format = re.compile(r'(Et[\d]+(?:/[\d]+)*)')
     _mac_format  = re.compile(r' [\d]{3}[\s]+?(\S+)[\s]+?DYNAMIC[\s]+(\S+)')
     _cmd_runner  = command.AristaCommandRunner 
+    # Abbreviations EOS uses for interface names in its text tables
+    _intf_abbrev = (('Ethernet','Et'),('Port-Channel','Po'),
+                    ('Vxlan','Vx'),('Management','Ma'))
 
-    def __init__(self,user,pw,enablepw,port=22,timeout=None):
+    def __init__(self,user,pw,enablepw,port=22,timeout=None,pool=None,
+                 use_json=False):
         super(AristaSurveyer,self).__init__(user,pw,enablepw,port=port,
-                                            timeout=timeout)
+                                            timeout=timeout,pool=pool)
+        self.use_json = use_json
         self._mac_cmd = ['show mac address-table']
+        self._interface_cmd = ['show interfaces status']
         self._vlan_formatter = self.__vlan_format
 
+    def _vlan_query(self,vlan_no=None):
+        cmd = super(AristaSurveyer,self)._vlan_query(vlan_no)
+        if self.use_json:
+            cmd[0] += ' | json'
+        return cmd
+
+    def _mac_query(self,vlan_no=None):
+        cmd = super(AristaSurveyer,self)._mac_query(vlan_no)
+        if self.use_json:
+            cmd[0] += ' | json'
+        return cmd
+
+    def _abbreviate(self,intf):
+        """
+        Shorten an interface name the way the text tables do, Ethernet1 to Et1
+        """
+        for name,abbrev in self._intf_abbrev:
+            if intf.startswith(name):
+                return abbrev + intf[len(name):]
+        return intf
+
+    def _decode(self,raw):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            raise ValueError('Expected JSON output from the switch but got '
+                             '{!r}, releases without it need use_json=False'
+                             .format(raw[:80]))
+
+    def parse_vlan(self,raw_vlan):
+        """
+        Create a dictionary of each active VLAN with its Ethernet ports from
+        the output of the VLAN command
+        """
+        if not self.use_json:
+            return super(AristaSurveyer,self).parse_vlan(raw_vlan)
+        vlan_info = {}
+        for vlan_no,vlan in self._decode(raw_vlan)['vlans'].items():
+            if vlan.get('status') != 'active':
+                continue
+            vlan_info[vlan_no] = [self._abbreviate(intf)
+                                  for intf in vlan.get('interfaces',{})
+                                  if intf.startswith('Ethernet')]
+        return vlan_info
+
+    def parse_mac(self,raw_mac):
+        """
+        Create a dictionary of the MAC address found on each port from the
+        dynamic entries of the MAC address table
+        """
+        if not self.use_json:
+            return super(AristaSurveyer,self).parse_mac(raw_mac)
+        table = self._decode(raw_mac)['unicastTable']['tableEntries']
+        return dict((self._abbreviate(entry['interface']),
+                     utils.convert_eth(entry['macAddress']))
+                    for entry in table if entry['entryType'] == 'dynamic')
+
     def __vlan_format(self, l1):
-        ll = l1.split("\n")
-        cont = False
-        l2 = ""
-        for l in ll:
-            if cont and len(l) > 0 and l[0] >= '0' and l[0] <= '9':
-                l2 += "\n"
-                cont = False
-            if len(l) > 0 and l[0] >= '0' and l[0] <= '9':
-                l2 += l.strip()
-                cont = True
-            elif cont:
-                l2 += ", " + l.strip()
-        return l2
+        # Join the continuation lines listing more ports of a VLAN on to the
+        # line that starts with its number
+        vlans = []
+        for l in l1.split("\n"):
+            if '0' <= l[:1] <= '9':
+                vlans.append([l.strip()])
+            elif vlans:
+                vlans[-1].append(l.strip())
+        return "\n".join(", ".join(vlan) for vlan in vlans)
@@ -17,8 +17,11 @@ __MAC_REGEX  = re.compile('^\s*Ethernet Address: (?P<mac>\S*)$')
 
 def convert_eth(ethernet):
     """
-    Convert MAC-address separated by decimal to colon.
+    Convert MAC-address separated by decimal to colon. Addresses that are
+    already separated by colons are returned as they are.
     """
+    if '.' not in ethernet:
+        return ethernet
     parts = ethernet.split('.')
     return ':'.join([part[:2]+':'+part[2:] for part in parts])
 
@@ -266,6 +269,25 @@ def add_telnet_opts(parser):
                         help='The hosts to run the commands on (default: all Digi PortServers/ConnectPorts found in netconfig)')
 
 
+def add_parallel_opts(parser):
+    parser.add_argument('-j',
+                        '--jobs',
+                        metavar='N',
+                        default=1,
+                        type=int,
+                        help='The number of hosts to work on at once (default: 1)')
+
+    parser.add_argument('--host-timeout',
+                        metavar='SECONDS',
+                        type=float,
+                        help='Give up on a host after this many seconds (default: no limit)')
+
+    parser.add_argument('--deadline',
+                        metavar='SECONDS',
+                        type=float,
+                        help='Give up on every host still running after this many seconds (default: no limit)')
+
+
 def add_con_opts(parser):
     group = parser.add_argument_group('remote connection options', description='options for connecting to the remote devices to be backed up')
     group.add_argument('-u',
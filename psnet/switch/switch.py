@@ -2,11 +2,13 @@ import os
 import sys
 import time
 import logging
+import threading
 import simplejson
 from os import path,getenv
 
 from ..ui import dialogs
 from ..survey import survey
+from ..survey import session
 from ..netconfig import netconfig
 
 module_logger = logging.getLogger(__name__)
@@ -74,8 +76,12 @@ class Switch(netconfig.host.Host):
                              switch. By default, this is done automatically
                              when the object initializes.
     :type  load_connections: bool
+
+    Commands are sent over a shell that is kept logged in between operations,
+    and closed after session_timeout seconds without use or by :meth:`.close`
     """
     timeout = 5
+    session_timeout = 300
     _port    = 22
     _vlan_alias = 'VLAN_{:}'
     _vlan    = []
@@ -84,7 +90,10 @@ class Switch(netconfig.host.Host):
     def __init__(self,switch_name,user='admin',pw=None,enablepw=None,
                  type=None,load_connections=True):
 
+        #NetConfig changes arrive on the refresh thread
+        self._lock = threading.RLock()
         self._nc   = netconfig.NetConfig()
+        self._nc.subscribe(self._netconfig_changed)
 
         if not type:
             type = determine_type(self._nc, switch_name)
@@ -108,6 +117,7 @@ class Switch(netconfig.host.Host):
         else:
             self._pw = pw
         self._enablepw = enablepw
+        self._sessions = session.SessionPool(idle_timeout=self.session_timeout)
         
         #Load VLAN information
         if load_connections:
@@ -179,60 +189,117 @@ class Switch(netconfig.host.Host):
         """
         Load the ports found on each VLAN
         """
-        self._vlan = []
         #Load vlan information
         module_logger.info('Loading port locations from switch')
-        vlan = self._surveyer().show_vlan(self.name)
-        
-        #Organize
-        self._portmap = {}
-        for vlan_no,ports in vlan.items():
-            module_logger.debug('Found VLAN {:} on switch'.format(vlan_no))
-            v = Vlan(vlan_no,ports,switch=self)
-            self._vlan.append(v)
-            setattr(self,self._vlan_alias.format(str(vlan_no)),v)
-            for p in ports:
-                self._portmap[p] = vlan_no
+        self._load_vlans(self._surveyer().show_vlan(self.name))
+
+    def _load_vlans(self,vlan):
+        """
+        Organize the ports of each VLAN, as returned by the surveyer
+        """
+        with self._lock:
+            self._vlan = []
+            self._portmap = {}
+            for vlan_no,ports in vlan.items():
+                module_logger.debug('Found VLAN {:} on switch'.format(vlan_no))
+                v = Vlan(vlan_no,ports,switch=self)
+                self._vlan.append(v)
+                setattr(self,self._vlan_alias.format(str(vlan_no)),v)
+                for p in ports:
+                    self._portmap[p] = vlan_no
 
     def find_connections(self):
         """
         Load the devices connected to the switch
         """
-        for vlan in self._vlan:
-            vlan._devices = {}
-            vlan._unknown = {}
-
         module_logger.info('Requesting mac addresses from switch')
-        mac = self._surveyer().show_mac(self.name)
-        module_logger.info('Searching for mac addresses in NetConfig')
-        for port,address in mac.items():
-            module_logger.debug('Found {:} on port {:}.'.format(port,address))
-            vlan_no = self.find_port(port)
-            if not vlan_no:
-                module_logger.debug('{:} is a tagged port, '\
-                                   'ignoring mac address'.format(port))
-                pass
-            else:
-                #Find VLAN
-                vlan_name = self._vlan_alias.format(vlan_no)
-                vlan = getattr(self,vlan_name)
-                try:
-                    node = self._nc._mac[address.lower()]
-                    vlan._devices[node] = {'ethernet_address':address,
-                                           'port':port,
-                                           'vlan':vlan_no}
-                except KeyError:
-                    module_logger.debug('Unable to find NetConfig entry for '\
-                                        '{:} on port {:}'.format(address,port))
-                    vlan._unknown[address] = {'port':port,'vlan':vlan_no}
+        self._load_macs(self._surveyer().show_mac(self.name))
+
+    def _load_macs(self,mac):
+        """
+        Match the port and MAC address pairs returned by the surveyer to
+        NetConfig entries on each VLAN
+        """
+        with self._lock:
+            for vlan in self._vlan:
+                vlan._devices = {}
+                vlan._unknown = {}
+
+            module_logger.info('Searching for mac addresses in NetConfig')
+            nodes = self._nc.join_macs(mac.values())
+            for (port,address),node in zip(mac.items(),nodes):
+                module_logger.debug('Found {:} on port {:}.'.format(port,address))
+                vlan_no = self.find_port(port)
+                if not vlan_no:
+                    module_logger.debug('{:} is a tagged port, '\
+                                       'ignoring mac address'.format(port))
+                    pass
+                else:
+                    #Find VLAN
+                    vlan_name = self._vlan_alias.format(vlan_no)
+                    vlan = getattr(self,vlan_name)
+                    if node:
+                        vlan._devices[node] = {'ethernet_address':address,
+                                               'port':port,
+                                               'vlan':vlan_no}
+                    else:
+                        module_logger.debug('Unable to find NetConfig entry for '\
+                                            '{:} on port {:}'.format(address,port))
+                        vlan._unknown[address] = {'port':port,'vlan':vlan_no}
                     
 
+    def _netconfig_changed(self,delta):
+        """
+        Match the devices already found on the switch against a refreshed
+        NetConfig, without asking the switch for its MAC table again
+
+        :param delta: The hosts changed by the refresh
+        :type  delta: :class:`.netconfig.registry.Delta`
+
+        :return: Whether or not any device was affected
+        """
+        with self._lock:
+            hosts   = delta.hosts
+            changed = False
+            for vlan in getattr(self,'_vlan',[]):
+                found = [(info['ethernet_address'],info)
+                         for node,info in vlan._devices.items()
+                         if node in hosts]
+                found.extend((address,dict(info,ethernet_address=address))
+                             for address,info in vlan._unknown.items())
+                if not found:
+                    continue
+                devices = dict((node,info) for node,info in vlan._devices.items()
+                               if node not in hosts)
+                unknown = {}
+                nodes   = self._nc.join_macs(address for address,info in found)
+                for (address,info),node in zip(found,nodes):
+                    if node:
+                        devices[node] = info
+                    else:
+                        unknown[address] = {'port':info['port'],
+                                            'vlan':info['vlan']}
+                if devices != vlan._devices or unknown != vlan._unknown:
+                    module_logger.info('NetConfig update changed the devices '\
+                                       'on VLAN {:}'.format(vlan._vlan_no))
+                    vlan._devices = devices
+                    vlan._unknown = unknown
+                    changed = True
+            return changed
+
+
     def update(self):
         """
         Load both the current port locations as well as the connected devices.
+
+        Both tables are requested from the switch in a single session
         """
-        self.load_ports()
-        self.find_connections()
+        module_logger.info('Loading port locations and mac addresses '\
+                           'from switch')
+        info = self._surveyer().survey(self.name)
+        with self._lock:
+            self._load_vlans(info['vlan'])
+            self._load_macs(info['mac'])
     
     
     def find_port(self,port):
@@ -369,7 +436,8 @@ class Switch(netconfig.host.Host):
         :rtype: bool
         """
         # This is a privileged command: do we need/have the enable password?
-        if not self._enablepw and self._surveyer().check_mode(self.name):
+        surveyer = self._surveyer()
+        if not self._enablepw and surveyer.check_mode(self.name):
             self._enablepw = dialogs.passwddialog.getPassword('Enable password for {:}: '.format(self._user))
         
         commands = ['config terminal']
@@ -412,15 +480,8 @@ class Switch(netconfig.host.Host):
             commands.extend(['exit'])
 
         #Run commands
-        cmd = self._surveyer()._cmd_runner(self._user,
-                                           self._pw,
-                                           self._enablepw,
-                                           self._port,
-                                           commands,
-                                           timeout=self.timeout,
-                                           priv=True)
-        
-        out_code,resp = cmd.run(self.name)
+        surveyer.enablepw = self._enablepw
+        resp = surveyer.run(self.name,commands,priv=True)
         module_logger.info('Finished running switch commands')
         if not verify:
             return True
@@ -693,10 +754,18 @@ class Switch(netconfig.host.Host):
 
         surveyer = survey_type(self._user,self._pw,self._enablepw,
                                port=self._port,
-                               timeout=self.timeout)
+                               timeout=self.timeout,
+                               pool=self._sessions)
         return surveyer
 
 
+    def close(self):
+        """
+        Log out of the switch. Any later operation logs in again
+        """
+        self._sessions.close()
+
+
     def _load_host(self,host):
         """
         Return a Host object for a device with name host
@@ -7,6 +7,9 @@ from .vlan import VlanWidget
 from ...EpicsQT.qlogdisplay import QLogDisplay
 from .. import dialogs
 from ...switch.switch import Switch
+from ...survey.retry import ConnectError
+
+module_logger = logging.getLogger(__name__)
 
 class SwitchWidget(QtWidgets.QWidget):
     
@@ -14,6 +17,8 @@ class SwitchWidget(QtWidgets.QWidget):
     
     misplaced = pyqtSignal(str)
     updated   = pyqtSignal()
+    #NetConfig changes, emitted from the refresh thread
+    netconfig_changed = pyqtSignal(object)
 
     def __init__(self,switch,user=None,pw=None,timeout=1.0,parent=None):
         super(SwitchWidget,self).__init__(parent=parent)
@@ -21,6 +26,8 @@ class SwitchWidget(QtWidgets.QWidget):
 
         self.refresh_timeout = timeout * 3600000 # Now ms!
 
+        self.netconfig_changed.connect(self.apply_netconfig,
+                                       QtCore.Qt.QueuedConnection)
         self._switch = PyQtSwitch(switch,user=user,pw=pw,enablepw=None,parent=self)
         self.updated.connect(self.refresh)
 
@@ -173,6 +180,13 @@ class SwitchWidget(QtWidgets.QWidget):
     def do_update(self):
         self._switch.update()
 
+    @pyqtSlot(object)
+    def apply_netconfig(self,delta):
+        """
+        Match the devices of the switch against a NetConfig refresh
+        """
+        self._switch.apply_netconfig(delta)
+
     @pyqtSlot()
     def refresh(self):
         """
@@ -251,7 +265,10 @@ class SwitchWidget(QtWidgets.QWidget):
                                      parent=self) 
         if dialog.exec_():
             port,vlan = dialog.current_move()
-            self._switch.move_port(port,vlan)
+            try:
+                self._switch.move_port(port,vlan)
+            except ConnectError as e:
+                self.switch_log.error('Unable to move port {:}: {:}'.format(port,e))
 
     
     def auto_configure(self): 
@@ -272,7 +289,11 @@ class SwitchWidget(QtWidgets.QWidget):
             approved = dialog.approved_moves
             for move in approved:
                 device,port,subnet = move
-                self._switch.move_device(device,subnet=subnet)
+                try:
+                    self._switch.move_device(device,subnet=subnet)
+                except ConnectError as e:
+                    self.switch_log.error('Unable to move {:}: {:}'.format(device,e))
+                    break
 
 
 class PyQtSwitch(Switch):
@@ -283,8 +304,33 @@ class PyQtSwitch(Switch):
         
     def update(self):
         """
-        Update switch configuration and emit signal
+        Update switch configuration and emit signal. If the switch can not
+        be reached the failure is logged and the last known configuration is
+        kept
         """
-        super(PyQtSwitch,self).update()
+        try:
+            super(PyQtSwitch,self).update()
+        except ConnectError as e:
+            module_logger.error(str(e))
+            return
         if self.parent:
             self.parent.updated.emit()
+
+    def _netconfig_changed(self,delta):
+        """
+        Pass the refreshed NetConfig to the GUI thread, so that the devices
+        are never replaced while the widget is reading them
+        """
+        if self.parent:
+            self.parent.netconfig_changed.emit(delta)
+        else:
+            self.apply_netconfig(delta)
+
+    def apply_netconfig(self,delta):
+        """
+        Match devices against the refreshed NetConfig and emit signal
+        """
+        changed = super(PyQtSwitch,self)._netconfig_changed(delta)
+        if changed and self.parent:
+            self.parent.updated.emit()
+        return changed